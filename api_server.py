@@ -0,0 +1,349 @@
+# Headless API Server
+"""
+Exposes every task from SimpleUI.route_task as a JSON endpoint, for use by
+other services without Streamlit.
+
+    python api_server.py --port 8000 --max-concurrent 4 --max-queue 32
+
+    curl -X POST localhost:8000/api/qa -d '{"user_input": "Capital of France?"}'
+    curl -N -X POST localhost:8000/api/cot_reasoning -d '{"user_input": "17 * 23", "stream": true}'
+
+Requests beyond `--max-concurrent` wait in a bounded queue; once the queue is
+full the server answers 503 immediately instead of piling work onto a single
+Ollama backend. Identical non-streaming requests that arrive while one is
+already running share its upstream call. Malformed arguments are answered with
+400 before any work starts; anything that fails after that is a 500.
+"""
+import json
+import time
+import logging
+import argparse
+import threading
+import contextlib
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from virtual_assistant import TaskManager, SimpleUI, get_ollama_client, scheduled_as
+
+
+# URL slug -> task name used by SimpleUI.route_task
+API_TASKS = {
+    "qa": "Q&A",
+    "summarization": "Summarization",
+    "translation": "Translation",
+    "roleplay": "Role-Play",
+    "json_formatting": "JSON Formatter",
+    "classification": "Classification",
+    "cot_reasoning": "CoT Reasoning",
+    "json_validator": "JSON Validator",
+    "roleplay_comparison": "Role-Play Comparison"
+}
+
+TASK_ARGUMENTS = ["source_lang", "target_lang", "role", "classification_mode", "shot_type", "session_id", "schema", "adaptive"]
+
+# Accepted JSON types per argument
+ARGUMENT_TYPES = {
+    "source_lang": str,
+    "target_lang": (str, list),
+    "role": (str, list),
+    "classification_mode": str,
+    "shot_type": str,
+    "session_id": str,
+    "schema": (dict, str),
+    "adaptive": bool
+}
+
+REQUIRED_ARGUMENTS = {
+    "translation": ["source_lang", "target_lang"],
+    "roleplay": ["role"],
+    "roleplay_comparison": ["role"],
+    "classification": ["classification_mode", "shot_type"]
+}
+
+# Arguments that may be a list of strings, and the tasks that accept one: a
+# translation into several languages, a comparison of several roles
+LIST_ARGUMENTS = {
+    "target_lang": ["translation"],
+    "role": ["roleplay_comparison"]
+}
+
+logger = logging.getLogger("api_server")
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class InvalidArgumentError(ValueError):
+    pass
+
+
+def validate_arguments(slug, body):
+    """
+    Returns the task keyword arguments from a request body, or raises
+    InvalidArgumentError naming the first argument that is missing or has the
+    wrong type.
+    """
+    kwargs = {name: body.get(name) for name in TASK_ARGUMENTS}
+    for name in REQUIRED_ARGUMENTS.get(slug, []):
+        if kwargs[name] is None:
+            raise InvalidArgumentError(f"'{name}' is required for {slug}")
+    for name, value in kwargs.items():
+        if value is not None and not isinstance(value, ARGUMENT_TYPES[name]):
+            raise InvalidArgumentError(f"'{name}' has the wrong type ({type(value).__name__})")
+    for name, slugs in LIST_ARGUMENTS.items():
+        value = kwargs[name]
+        if not isinstance(value, list):
+            continue
+        if slug not in slugs:
+            raise InvalidArgumentError(f"'{name}' must be a string for {slug}")
+        if not value or not all(isinstance(item, str) for item in value):
+            raise InvalidArgumentError(f"'{name}' must be a string or a non-empty list of strings")
+    # A list of target languages is answered as one {language: translation} object
+    if isinstance(kwargs["target_lang"], list) and (body.get("stream") or kwargs["session_id"]):
+        raise InvalidArgumentError("a list 'target_lang' cannot be combined with 'stream' or 'session_id'")
+    return kwargs
+
+
+class AdmissionController:
+    """
+    At most `max_concurrent` requests run at once and at most `max_queue` wait
+    for a slot; anything beyond that is rejected straight away.
+    """
+
+    def __init__(self, max_concurrent=4, max_queue=32, queue_timeout=30.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def admit(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self.waiting >= self.max_queue:
+                    self.rejected += 1
+                    raise QueueFullError("Request queue is full")
+                self.waiting += 1
+            try:
+                acquired = self._slots.acquire(timeout=self.queue_timeout)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+            if not acquired:
+                with self._lock:
+                    self.rejected += 1
+                raise QueueFullError(f"No worker became free within {self.queue_timeout:.0f}s")
+
+        with self._lock:
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+            self._slots.release()
+
+
+class RequestCoalescer:
+    """
+    Collapses identical in-flight calls: the first caller for a key runs the
+    work, later callers with the same key wait for and share its result.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+
+class APIRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/api/tasks":
+            self._send_json(200, {"tasks": sorted(API_TASKS)})
+        elif self.path == "/api/stats":
+            self._send_json(200, self.server.stats())
+        elif self.path == "/metrics":
+            data = self.server.ui.tm.metrics.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        prefix, _, slug = self.path.rpartition("/")
+        if prefix != "/api" or slug not in API_TASKS:
+            self._send_json(404, {"error": f"Unknown task endpoint {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "Request body must be JSON"})
+            return
+        if not isinstance(body, dict):
+            self._send_json(400, {"error": "Request body must be a JSON object"})
+            return
+
+        user_input = body.get("user_input", "")
+        if not isinstance(user_input, str) or not user_input.strip():
+            self._send_json(400, {"error": "'user_input' is required"})
+            return
+
+        task = API_TASKS[slug]
+        try:
+            kwargs = validate_arguments(slug, body)
+        except InvalidArgumentError as e:
+            self._send_json(400, {"error": f"Invalid arguments for {slug}: {e}"})
+            return
+        stream = bool(body.get("stream")) and task in SimpleUI.STREAMING_TASKS
+        # Callers are queued fairly by X-User, falling back to their address
+        user = self.headers.get("X-User") or self.client_address[0]
+
+        try:
+            if stream:
+                with self.server.admission.admit(), scheduled_as(user):
+                    self._send_stream(self.server.ui.route_task(task, user_input, stream=True, **kwargs))
+            else:
+                key = json.dumps([task, user_input, kwargs], sort_keys=True)
+                result = self.server.coalescer.run(key, lambda: self._run_admitted(task, user_input, kwargs, user))
+                self._send_json(200, {"task": slug, "response": result})
+        except QueueFullError as e:
+            self._send_json(503, {"error": str(e)}, {"Retry-After": "1"})
+        except Exception:
+            # Arguments were validated above, so this is a bug or a backend failure, not a bad request
+            logger.exception("Request to %s failed", self.path)
+            self._send_json(500, {"error": f"Internal error while running {slug}"})
+
+    def _run_admitted(self, task, user_input, kwargs, user):
+        with self.server.admission.admit(), scheduled_as(user):
+            return self.server.ui.route_task(task, user_input, **kwargs)
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, chunks):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for text in chunks:
+                self._write_chunk({"response": text, "done": False})
+            self._write_chunk({"response": "", "done": True})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away: closing the generator cancels the upstream generation
+            chunks.close()
+        except Exception:
+            # The 200 is already sent: drop the connection so the client sees an incomplete stream
+            logger.exception("Stream for %s failed", self.path)
+            self.close_connection = True
+
+    def _write_chunk(self, body):
+        line = (json.dumps(body, ensure_ascii=False) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+
+class APIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=8000, task_manager=None, max_concurrent=4, max_queue=32, queue_timeout=30.0):
+        super().__init__((host, port), APIRequestHandler)
+        self.ui = SimpleUI(task_manager or TaskManager())
+        self.admission = AdmissionController(max_concurrent, max_queue, queue_timeout)
+        self.coalescer = RequestCoalescer()
+        self.started = time.time()
+
+    def stats(self):
+        stats = {
+            "uptime": time.time() - self.started,
+            "active": self.admission.active,
+            "queued": self.admission.waiting,
+            "rejected": self.admission.rejected,
+            "coalesced": self.coalescer.coalesced,
+            "tasks": self.ui.tm.metrics.snapshot(),
+            "sessions": self.ui.tm.sessions.stats(),
+            "backends": get_ollama_client().status(),
+            "scheduler": get_ollama_client().scheduler.stats(),
+            "reasoning": self.ui.tm.reasoning.stats(),
+            "prompt_variant": self.ui.tm.prompt_variant
+        }
+        if self.ui.tm.cache is not None:
+            stats["cache"] = self.ui.tm.cache.stats()
+        if self.ui.tm.semantic_cache is not None:
+            stats["semantic_cache"] = self.ui.tm.semantic_cache.stats()
+        if self.ui.tm.classifier is not None:
+            stats["classifier"] = self.ui.tm.classifier.stats()
+        if self.ui.tm.translation_memory is not None:
+            stats["translation_memory"] = self.ui.tm.translation_memory.stats()
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the assistant's tasks as a JSON HTTP API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-concurrent", type=int, default=4, help="Requests sent to Ollama at once")
+    parser.add_argument("--max-queue", type=int, default=32, help="Requests allowed to wait for a free slot")
+    parser.add_argument("--queue-timeout", type=float, default=30.0, help="Seconds a queued request waits before 503")
+    args = parser.parse_args()
+
+    server = APIServer(args.host, args.port, max_concurrent=args.max_concurrent, max_queue=args.max_queue, queue_timeout=args.queue_timeout)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,648 @@
+# Async Task Manager
+"""
+asyncio counterpart of TaskManager for embedding the assistant in async
+services. Every task method has the same signature as in TaskManager but
+returns a coroutine (or an async generator when `stream=True`).
+
+    async with AsyncTaskManager(max_concurrency=64) as atm:
+        answer = await atm.qa("What is the capital of France?")
+
+        async for text in atm.cot_reasoning("What is 17 * 23?", stream=True):
+            print(text, end="")
+
+        with atm.deadline(5):
+            label = await atm.few_shot_classification("Great app!")
+
+Requires `aiohttp`.
+
+AsyncTaskManager talks to a single Ollama host through AsyncOllamaClient (by
+default OLLAMA_URL). It does not use the backend pool, failover or request
+scheduler of OllamaRouter; only `task_models` from the backend configuration
+is honoured. Pass a client per host to spread async load yourself.
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import weakref
+import itertools
+import contextlib
+import contextvars
+from collections import deque
+
+import aiohttp
+
+from virtual_assistant import (
+    OLLAMA_URL, OLLAMA_MODEL, OLLAMA_POOL_SIZE, OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT,
+    OLLAMA_MAX_RETRIES, OLLAMA_BACKOFF_BASE, OLLAMA_BACKOFF_MAX, COMPARISON_MAX_WORKERS,
+    STOP_TOKENS, CACHED_TASKS, TASK_PRIORITIES, SCHEDULER_RESERVED_SLOTS, OLLAMA_STAT_FIELDS, LONG_DOC_MAX_WORKERS, TRANSLATION_BATCH_SIZE,
+    TRANSLATION_MAX_WORKERS, COT_ADAPTIVE, COT_FAST_SAMPLES, COT_FAST_OPTIONS,
+    COT_STOP_TOKENS, SESSION_TASKS, SESSION_STOP_TOKENS, CircuitBreaker,
+    CircuitOpenError, OllamaServerError, ResponseCache, SchemaError, StopSequenceFilter, TaskManager,
+    apply_stop_tokens, budget_params, chunk_document, compile_schema, consistent_answer, error_category, estimate_tokens,
+    is_error_response, load_backend_config, sampling_params, solve_arithmetic
+)
+
+
+# Maximum number of generations in flight per AsyncTaskManager
+ASYNC_MAX_CONCURRENCY = 32
+
+def async_error_category(e):
+    if isinstance(e, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(e, aiohttp.ClientConnectionError):
+        return "connection"
+    return error_category(e)
+
+
+# Absolute (time.monotonic) deadline for the current task, set by AsyncTaskManager.deadline
+_deadline = contextvars.ContextVar("ollama_deadline", default=None)
+
+
+class AsyncOllamaClient:
+    """
+    aiohttp version of OllamaClient with the same pooling, timeout, retry and
+    circuit-breaker behaviour. The session is created lazily inside the running
+    event loop.
+    """
+
+    def __init__(self, url=OLLAMA_URL, model=OLLAMA_MODEL, pool_size=OLLAMA_POOL_SIZE,
+                 connect_timeout=OLLAMA_CONNECT_TIMEOUT, read_timeout=OLLAMA_READ_TIMEOUT,
+                 max_retries=OLLAMA_MAX_RETRIES, backoff_base=OLLAMA_BACKOFF_BASE,
+                 backoff_max=OLLAMA_BACKOFF_MAX, breaker=None):
+        self.url = url
+        self.model = model
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+            )
+        return self._session
+
+    async def _backoff(self, attempt):
+        await asyncio.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt))))
+
+    async def post(self, payload):
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"Circuit open for {self.url}; retry in {self.breaker.reset_timeout:.0f}s")
+
+            try:
+                response = await self._get_session().post(self.url, json=payload)
+            except aiohttp.ClientConnectorError:
+                self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    raise
+                await self._backoff(attempt)
+                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.breaker.record_failure()
+                raise
+
+            if response.status >= 500:
+                self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    return response
+                response.close()
+                await self._backoff(attempt)
+                continue
+
+            self.breaker.record_success()
+            return response
+
+    async def generate(self, prompt, **params):
+        payload = {"model": self.model, "prompt": prompt, "stream": False}
+        payload.update(params)
+        response = await self.post(payload)
+        try:
+            if response.status != 200:
+                raise OllamaServerError(response.status, await response.text())
+            result = await response.json(content_type=None)
+        except BaseException:
+            # Dropping the connection (rather than releasing it) makes Ollama abort the generation
+            response.close()
+            raise
+        response.release()
+        return result
+
+    async def generate_stream(self, prompt, **params):
+        payload = {"model": self.model, "prompt": prompt, "stream": True}
+        payload.update(params)
+        response = await self.post(payload)
+        try:
+            if response.status != 200:
+                raise OllamaServerError(response.status, await response.text())
+            async for line in response.content:
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise RuntimeError(chunk["error"])
+                yield chunk
+                if chunk.get("done"):
+                    break
+        finally:
+            response.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class AsyncTaskManager(TaskManager):
+    """
+    Reuses TaskManager's prompt building; only run_model, chat and the methods
+    that fan out to several generations are reimplemented on top of asyncio.
+    Generations go to the one host of `client`, not through the backend pool.
+    """
+
+    def __init__(self, client=None, cache=None, max_concurrency=ASYNC_MAX_CONCURRENCY, timeout=None, classifier=None, prompt_variant=None):
+        # Embedding lookups are blocking calls, so the semantic cache is only used by TaskManager
+        super().__init__(cache=cache, classifier=classifier, semantic_cache=False, prompt_variant=prompt_variant)
+        self.client = client or AsyncOllamaClient()
+        self.task_models = load_backend_config()[1]
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._semaphore = None
+        # ChatSession.lock is a threading.Lock, which would block the event loop
+        self._chat_locks = weakref.WeakKeyDictionary()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.close()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def deadline(seconds):
+        """
+        Every generation started inside the block must finish within `seconds`
+        (measured from entering the block) or raises asyncio.TimeoutError.
+        """
+        token = _deadline.set(time.monotonic() + seconds)
+        try:
+            yield
+        finally:
+            _deadline.reset(token)
+
+    def _remaining(self):
+        limits = []
+        if self.timeout is not None:
+            limits.append(self.timeout)
+        if _deadline.get() is not None:
+            limits.append(_deadline.get() - time.monotonic())
+        if not limits:
+            return None
+        remaining = min(limits)
+        if remaining <= 0:
+            raise asyncio.TimeoutError("Deadline exceeded before the request was sent")
+        return remaining
+
+    @contextlib.asynccontextmanager
+    async def _limit(self, priority="standard"):
+        # Only interactive requests may use the last SCHEDULER_RESERVED_SLOTS slots
+        if self._semaphore is None:
+            reserved = max(0, min(SCHEDULER_RESERVED_SLOTS, self.max_concurrency - 1))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._shared_semaphore = asyncio.Semaphore(self.max_concurrency - reserved)
+        async with contextlib.AsyncExitStack() as stack:
+            if priority != "interactive":
+                await stack.enter_async_context(self._shared_semaphore)
+            await stack.enter_async_context(self._semaphore)
+            yield
+
+    def run_model(self, full_prompt, stream=False, task=None, stop_tokens=STOP_TOKENS, query=None, query_args=None, priority=None, **params):
+        params = budget_params(task, full_prompt, params)
+        priority = priority or TASK_PRIORITIES.get(task, "standard")
+        if stream:
+            return self._stream_model(full_prompt, task, stop_tokens, params, priority)
+        if any(not isinstance(token, str) for token in stop_tokens):
+            # Pattern stop tokens are matched client-side, so stream to cancel the generation at the match
+            return self._join(self._stream_model(full_prompt, task, stop_tokens, params, priority))
+        return self._run_model(full_prompt, task, stop_tokens, params, priority)
+
+    def _model_for(self, task):
+        return self.task_models.get(task, self.client.model)
+
+    def _cache_key(self, full_prompt, task, params=None):
+        if task not in CACHED_TASKS or self.cache is None:
+            return None
+        return ResponseCache.make_key(full_prompt, self._model_for(task), sampling_params(params or {}))
+
+    async def _run_model(self, full_prompt, task, stop_tokens, params, priority):
+        started = time.perf_counter()
+        key = self._cache_key(full_prompt, task, params)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.metrics.record(task, time.perf_counter() - started, cache_hit=True)
+                return cached
+
+        stats = {}
+        try:
+            # Checked before the coroutine is created, so an expired deadline leaves none unawaited
+            timeout = self._remaining()
+            result = await asyncio.wait_for(self._generate(full_prompt, task, stop_tokens, stats, params, priority), timeout)
+        except asyncio.TimeoutError:
+            stats["error"] = "deadline"
+            raise
+        finally:
+            self.metrics.record(task, time.perf_counter() - started, **stats)
+
+        if key is not None and not is_error_response(result):
+            self.cache.set(key, result)
+        return result
+
+    async def _generate(self, full_prompt, task, stop_tokens, stats, params, priority):
+        async with self._limit(priority):
+            try:
+                result = await self.client.generate(full_prompt, model=self._model_for(task), **sampling_params(params))
+                stats.update((field, result[field]) for field in OLLAMA_STAT_FIELDS if field in result)
+                return apply_stop_tokens(result.get("response", ""), stop_tokens) or "[Empty response]"
+            except OllamaServerError as e:
+                stats["error"] = async_error_category(e)
+                return str(e)
+            except Exception as e:
+                stats["error"] = async_error_category(e)
+                return f"[Exception]: {e}"
+
+    async def _stream_model(self, full_prompt, task, stop_tokens, params, priority):
+        started = time.perf_counter()
+        key = self._cache_key(full_prompt, task, params)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.metrics.record(task, time.perf_counter() - started, cache_hit=True)
+                yield cached
+                return
+
+        remaining = self._remaining()
+        deadline = None if remaining is None else time.monotonic() + remaining
+        parts = []
+        stats = {"chunks": 0}
+        ttft = None
+
+        try:
+            async with self._limit(priority):
+                stop_filter = StopSequenceFilter(stop_tokens)
+                chunks = self.client.generate_stream(full_prompt, model=self._model_for(task), **sampling_params(params))
+                try:
+                    while not stop_filter.stopped:
+                        timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                        except StopAsyncIteration:
+                            break
+                        if chunk.get("done"):
+                            stats.update((field, chunk[field]) for field in OLLAMA_STAT_FIELDS if field in chunk)
+                        elif chunk.get("response"):
+                            stats["chunks"] += 1
+                            if ttft is None:
+                                ttft = time.perf_counter() - started
+                        text = stop_filter.feed(chunk.get("response", ""))
+                        if text:
+                            parts.append(text)
+                            yield text
+                    text = stop_filter.flush()
+                    if text:
+                        parts.append(text)
+                        yield text
+                except OllamaServerError as e:
+                    stats["error"] = async_error_category(e)
+                    parts.append(str(e))
+                    yield str(e)
+                except asyncio.TimeoutError:
+                    stats["error"] = "deadline"
+                    raise
+                except (aiohttp.ClientError, CircuitOpenError, RuntimeError, ValueError) as e:
+                    stats["error"] = async_error_category(e)
+                    parts.append(f"[Exception]: {e}")
+                    yield f"[Exception]: {e}"
+                finally:
+                    await chunks.aclose()
+        finally:
+            self.metrics.record(task, time.perf_counter() - started, ttft=ttft, **stats)
+
+        if not parts:
+            parts.append("[Empty response]")
+            yield "[Empty response]"
+
+        result = "".join(parts)
+        if key is not None and not is_error_response(result):
+            self.cache.set(key, result)
+
+    def chat(self, session_id, user_input, task="qa", stream=False, **task_kwargs):
+        if task not in SESSION_TASKS:
+            message = f"[Invalid Task] {task} does not support sessions"
+            return self._yield_text(message) if stream else self._return_text(message)
+        session, prefix, turn = self._start_chat(session_id, user_input, task, task_kwargs)
+        if stream:
+            return self._chat_stream(session, prefix, turn)
+        return self._chat(session, prefix, turn)
+
+    def _chat_lock(self, session):
+        return self._chat_locks.setdefault(session, asyncio.Lock())
+
+    def _async_chat_params(self, session):
+        params = self._chat_params(session)
+        # Routing hints for OllamaRouter; the async client talks to one host
+        del params["priority"], params["prefer"]
+        return sampling_params(params)
+
+    async def _generate_chat(self, prompt, params):
+        async with self._limit("interactive"):
+            return await self.client.generate(prompt, **params)
+
+    async def _chat(self, session, prefix, turn):
+        stop_tokens = SESSION_STOP_TOKENS.get(session.task, STOP_TOKENS)
+        async with self._chat_lock(session):
+            started = time.perf_counter()
+            stats = {}
+            try:
+                timeout = self._remaining()
+                result = await asyncio.wait_for(self._generate_chat(self._chat_prompt(session, prefix, turn), self._async_chat_params(session)), timeout)
+                stats.update((field, result[field]) for field in OLLAMA_STAT_FIELDS + ("context",) if field in result)
+                answer = apply_stop_tokens(result.get("response", ""), stop_tokens) or "[Empty response]"
+            except asyncio.TimeoutError:
+                stats["error"] = "deadline"
+                raise
+            except OllamaServerError as e:
+                stats["error"] = async_error_category(e)
+                answer = str(e)
+            except Exception as e:
+                stats["error"] = async_error_category(e)
+                answer = f"[Exception]: {e}"
+            finally:
+                self._finish_chat_turn(session, prefix, turn, stats, started)
+        return answer
+
+    async def _chat_stream(self, session, prefix, turn):
+        stop_tokens = SESSION_STOP_TOKENS.get(session.task, STOP_TOKENS)
+        async with self._chat_lock(session):
+            started = time.perf_counter()
+            stats = {"chunks": 0}
+            emitted = False
+            try:
+                remaining = self._remaining()
+                deadline = None if remaining is None else time.monotonic() + remaining
+                async with self._limit("interactive"):
+                    stop_filter = StopSequenceFilter(stop_tokens)
+                    chunks = self.client.generate_stream(self._chat_prompt(session, prefix, turn), **self._async_chat_params(session))
+                    try:
+                        # Read to the end even after a local stop pattern, so the context for the next turn arrives
+                        while True:
+                            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                            try:
+                                chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                            except StopAsyncIteration:
+                                break
+                            if chunk.get("done"):
+                                stats.update((field, chunk[field]) for field in OLLAMA_STAT_FIELDS + ("context",) if field in chunk)
+                            elif chunk.get("response"):
+                                stats["chunks"] += 1
+                                stats.setdefault("first_token_at", time.perf_counter())
+                            text = stop_filter.feed(chunk.get("response", ""))
+                            if text:
+                                emitted = True
+                                yield text
+                        text = stop_filter.flush()
+                        if text:
+                            emitted = True
+                            yield text
+                    finally:
+                        await chunks.aclose()
+            except asyncio.TimeoutError:
+                stats["error"] = "deadline"
+                raise
+            except OllamaServerError as e:
+                stats["error"] = async_error_category(e)
+                emitted = True
+                yield str(e)
+            except (aiohttp.ClientError, CircuitOpenError, RuntimeError, ValueError) as e:
+                stats["error"] = async_error_category(e)
+                emitted = True
+                yield f"[Exception]: {e}"
+            finally:
+                self._finish_chat_turn(session, prefix, turn, stats, started)
+        if not emitted:
+            yield "[Empty response]"
+
+    def summarize_document(self, source, stream=False, progress=None, max_workers=LONG_DOC_MAX_WORKERS):
+        if stream:
+            return self._summarize_document_stream(source, progress, max_workers)
+        return self._summarize_document(source, progress, max_workers)
+
+    async def _summarize_document(self, source, progress, max_workers):
+        prompt = await self._document_prompt(source, progress, max_workers)
+        if is_error_response(prompt):
+            return prompt
+        return await self.run_model(prompt, task="summarization")
+
+    async def _summarize_document_stream(self, source, progress, max_workers):
+        prompt = await self._document_prompt(source, progress, max_workers)
+        if is_error_response(prompt):
+            yield prompt
+            return
+        async for text in self.run_model(prompt, stream=True, task="summarization"):
+            yield text
+
+    async def _document_prompt(self, source, progress, max_workers):
+        chunks = chunk_document(source)
+        first = next(chunks, "")
+        second = next(chunks, None)
+        if second is None:
+            return self._template("summarization").render(user_input=first)
+
+        limit = asyncio.Semaphore(max(1, max_workers))
+
+        async def summarize(text):
+            async with limit:
+                return await self._summarize_chunk(text)
+
+        summaries = []
+        pending = deque()
+        total = 0
+        for chunk in itertools.chain([first, second], chunks):
+            pending.append(asyncio.ensure_future(summarize(chunk)))
+            total += 1
+            if len(pending) >= max_workers * 2:
+                summaries.append(await pending.popleft())
+                if progress:
+                    progress(len(summaries), total, "map")
+        while pending:
+            summaries.append(await pending.popleft())
+            if progress:
+                progress(len(summaries), total, "map")
+
+        while True:
+            error = next((summary for summary in summaries if is_error_response(summary)), None)
+            if error is not None:
+                return error
+            groups = self._reduce_groups(summaries)
+            if groups is None:
+                break
+            summaries = list(await asyncio.gather(*(summarize("\n\n".join(group)) for group in groups)))
+            if progress:
+                progress(len(groups), len(groups), "reduce")
+
+        return self._template("summarization").render(user_input="\n\n".join(summaries))
+
+    def cot_reasoning(self, user_input, stream=False, adaptive=COT_ADAPTIVE, telemetry=None):
+        chunks = self._cot_reasoning_stream(user_input, adaptive, telemetry)
+        return chunks if stream else self._join(chunks)
+
+    @staticmethod
+    async def _join(chunks):
+        return "".join([text async for text in chunks])
+
+    async def _cot_reasoning_stream(self, user_input, adaptive, telemetry):
+        started = time.perf_counter()
+        spent = 0
+        if adaptive:
+            answer = solve_arithmetic(user_input)
+            if answer is not None:
+                self.metrics.record("cot_reasoning_local", time.perf_counter() - started)
+                self.reasoning.record("local", 0, time.perf_counter() - started, telemetry=telemetry)
+                yield answer
+                return
+
+            prompt = self._template("cot_short").render(user_input=user_input)
+            samples = await asyncio.gather(*(
+                self.run_model(prompt, task="cot_reasoning_short", stop_tokens=COT_STOP_TOKENS, options=dict(COT_FAST_OPTIONS, seed=seed))
+                for seed in range(COT_FAST_SAMPLES)
+            ))
+            spent = sum(estimate_tokens(sample) for sample in samples)
+            answer = consistent_answer(samples)
+            if answer is not None:
+                self.reasoning.record("short", spent, time.perf_counter() - started, telemetry=telemetry)
+                yield answer
+                return
+
+        template = self._template("cot_reasoning")
+        parts = []
+        async for text in self.run_model(template.render(user_input=user_input), stream=True, task="cot_reasoning", stop_tokens=COT_STOP_TOKENS):
+            parts.append(text)
+            yield text
+        if not is_error_response("".join(parts)):
+            tokens = estimate_tokens("".join(parts))
+            self.reasoning.record("full", spent + tokens, time.perf_counter() - started, full_tokens=tokens, telemetry=telemetry)
+
+    async def compare_roleplay_vs_normal(self, user_input, role):
+        roles = [role] if isinstance(role, str) else list(role)
+        results, wall_time = await self.compare_roles(user_input, roles)
+        return self.format_comparison(results, wall_time)
+
+    async def compare_roles(self, user_input, roles, max_workers=COMPARISON_MAX_WORKERS, include_normal=True):
+        branches = ([None] if include_normal else []) + list(roles)
+        limit = asyncio.Semaphore(max(1, max_workers))
+
+        async def run_branch(role):
+            async with limit:
+                started = time.perf_counter()
+                response = await (self.qa(user_input) if role is None else self.roleplay(user_input, role))
+                return {"role": role, "response": response, "latency": time.perf_counter() - started}
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(run_branch(role) for role in branches))
+        return list(results), time.perf_counter() - started
+
+    async def translate_many(self, segments, source_lang, target_langs, batch_size=TRANSLATION_BATCH_SIZE, max_workers=TRANSLATION_MAX_WORKERS):
+        results, jobs = self._plan_translations(segments, source_lang, target_langs, batch_size)
+        limit = asyncio.Semaphore(max(1, max_workers))
+
+        async def run_job(target_lang, batch):
+            async with limit:
+                return await self._translate_packed(batch, source_lang, target_lang)
+
+        translated = await asyncio.gather(*(run_job(target_lang, batch) for target_lang, batch in jobs))
+        for (target_lang, batch), translations in zip(jobs, translated):
+            self._remember_translations(results[target_lang], source_lang, target_lang, batch, translations)
+        return self._collect_translations(results, segments)
+
+    async def translate_text(self, user_input, source_lang, target_langs):
+        segments = [line for line in user_input.splitlines() if line.strip()] or [user_input]
+        results = await self.translate_many(segments, source_lang, target_langs)
+        return {target_lang: "\n".join(lines) for target_lang, lines in results.items()}
+
+    async def _translate_packed(self, batch, source_lang, target_lang):
+        if len(batch) == 1:
+            return [await self.translation(batch[0], source_lang, target_lang)]
+
+        prompt = self.packed_translation_prompt(batch, source_lang, target_lang)
+        output = await self.run_model(prompt, task="translation", stop_tokens=[], priority="standard")
+
+        async def translation_or_retry(segment, translation):
+            if translation is not None:
+                return translation
+            return await self.translation(segment, source_lang, target_lang)
+
+        parsed = self.parse_packed_translations(output, batch)
+        return list(await asyncio.gather(*(translation_or_retry(segment, translation) for segment, translation in zip(batch, parsed))))
+
+    async def classify_batch(self, texts, mode="sentiment", shot_type="few", batch_size=8, max_workers=4):
+        pending = []
+        for batch in self._batched(texts, batch_size):
+            pending.append(asyncio.ensure_future(self._classify_packed(batch, mode, shot_type)))
+            if len(pending) >= max_workers * 2:
+                for label in await pending.pop(0):
+                    yield label
+        for future in pending:
+            for label in await future:
+                yield label
+
+    def few_shot_classification(self, user_input, mode="sentiment", shot_type="few", stream=False):
+        label = self._fast_label(user_input, mode, shot_type)
+        if label is None:
+            return self._llm_classification(user_input, mode, shot_type, stream)
+        return self._yield_text(label) if stream else self._return_text(label)
+
+    def json_formatting(self, user_input, stream=False, schema=None):
+        if schema is not None:
+            try:
+                compile_schema(schema)
+            except (SchemaError, re.error) as e:
+                message = f"[Invalid Schema] {e}"
+                return self._yield_text(message) if stream else self._return_text(message)
+        return super().json_formatting(user_input, stream=stream, schema=schema)
+
+    @staticmethod
+    async def _return_text(text):
+        return text
+
+    @staticmethod
+    async def _yield_text(text):
+        yield text
+
+    async def _classify_packed(self, batch, mode, shot_type):
+        labels = [self._fast_label(text, mode, shot_type) for text in batch]
+        remaining = [text for text, label in zip(batch, labels) if label is None]
+        if len(remaining) == 1:
+            llm_labels = [await self._llm_classification(remaining[0], mode, shot_type)]
+        elif remaining:
+            prompt = self.packed_classification_prompt(remaining, mode, shot_type)
+            output = await self.run_model(prompt, task="few_shot_classification", stop_tokens=[], priority="bulk")
+
+            async def label_or_retry(text, label):
+                if label is not None:
+                    return label
+                return await self._llm_classification(text, mode, shot_type)
+
+            parsed = self.parse_numbered_labels(output, len(remaining))
+            llm_labels = await asyncio.gather(*(label_or_retry(text, label) for text, label in zip(remaining, parsed)))
+        else:
+            llm_labels = []
+
+        llm_labels = iter(llm_labels)
+        return [label if label is not None else next(llm_labels) for label in labels]
@@ -0,0 +1,158 @@
+# Bulk Classification
+"""
+Labels a CSV or JSONL file with TaskManager.classify_batch and writes the
+results incrementally, so an interrupted run loses nothing and resumes from
+the last written row.
+
+    python batch_classify.py reviews.csv labelled.csv --mode sentiment
+    python batch_classify.py utterances.jsonl intents.jsonl --mode intent --text-field query
+"""
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+from collections import deque
+
+from virtual_assistant import TaskManager, is_error_response
+
+
+# Block size used when scanning the output backwards for its last complete line
+REPAIR_BLOCK_SIZE = 64 * 1024
+
+
+def read_records(path, text_field):
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record, str(record[text_field])
+    else:
+        with open(path, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                yield row, row[text_field]
+
+
+def repair_output(path):
+    """
+    Drops a half-written last line left behind by a crash and returns the number
+    of records already labelled.
+    """
+    if not os.path.exists(path):
+        return 0
+
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        if end:
+            f.seek(end - 1)
+            if f.read(1) != b"\n":
+                f.truncate(last_newline(f, end) + 1)
+
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            return sum(1 for line in f if line.strip())
+    with open(path, encoding="utf-8", newline="") as f:
+        return sum(1 for _ in csv.DictReader(f))
+
+
+def last_newline(f, end):
+    """
+    Offset of the last newline before `end` in a binary file, or -1.
+    """
+    position = end
+    while position > 0:
+        start = max(0, position - REPAIR_BLOCK_SIZE)
+        f.seek(start)
+        index = f.read(position - start).rfind(b"\n")
+        if index != -1:
+            return start + index
+        position = start
+    return -1
+
+
+class OutputWriter:
+    def __init__(self, path, label_field, resume):
+        self.path = path
+        self.label_field = label_field
+        self.is_jsonl = path.endswith(".jsonl")
+        self.file = open(path, "a" if resume else "w", encoding="utf-8", newline="")
+        self.csv_writer = None
+        self.write_header = not resume or os.path.getsize(path) == 0
+
+    def write(self, record, label):
+        record = dict(record)
+        record[self.label_field] = label
+        if self.is_jsonl:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            if self.csv_writer is None:
+                self.csv_writer = csv.DictWriter(self.file, fieldnames=list(record), lineterminator="\n")
+                if self.write_header:
+                    self.csv_writer.writeheader()
+            self.csv_writer.writerow(record)
+        self.file.flush()
+
+    def close(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk sentiment/intent classification through Ollama.")
+    parser.add_argument("input", help="Input .csv or .jsonl file")
+    parser.add_argument("output", help="Output .csv or .jsonl file (appended to when resuming)")
+    parser.add_argument("--mode", choices=["sentiment", "intent"], default="sentiment")
+    parser.add_argument("--shot-type", choices=["few", "zero"], default="few")
+    parser.add_argument("--text-field", default="text", help="Column/key holding the text to classify")
+    parser.add_argument("--label-field", default="label", help="Column/key to write the label to")
+    parser.add_argument("--batch-size", type=int, default=8, help="Inputs packed into one prompt")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent requests to Ollama")
+    parser.add_argument("--restart", action="store_true", help="Ignore existing output instead of resuming")
+    args = parser.parse_args(argv)
+
+    done = 0 if args.restart else repair_output(args.output)
+    if done:
+        print(f"Resuming after {done} labelled records", file=sys.stderr)
+
+    records = read_records(args.input, args.text_field)
+    for _ in range(done):
+        next(records, None)
+
+    # classify_batch consumes texts lazily and yields labels in order, so the
+    # matching records only need to be buffered while their batch is in flight
+    in_flight = deque()
+
+    def texts():
+        for record, text in records:
+            in_flight.append(record)
+            yield text
+
+    tm = TaskManager()
+    writer = OutputWriter(args.output, args.label_field, resume=done > 0)
+    started = time.perf_counter()
+    count = 0
+    error = None
+    try:
+        for label in tm.classify_batch(texts(), args.mode, args.shot_type, args.batch_size, args.workers):
+            # An error is not a label: stop here so a resumed run retries this row
+            if is_error_response(label):
+                error = label
+                break
+            writer.write(in_flight.popleft(), label)
+            count += 1
+            if count % 100 == 0:
+                rate = count / (time.perf_counter() - started)
+                print(f"{done + count} labelled ({rate:.1f}/s)", file=sys.stderr)
+    finally:
+        writer.close()
+
+    if error is not None:
+        sys.exit(f"Stopped after {done + count} labelled records: {error}\nRun the same command again to resume.")
+    print(f"Done: {count} new labels written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
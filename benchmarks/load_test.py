@@ -0,0 +1,183 @@
+"""
+Offline load test: replays a prompt corpus through every TaskManager method
+against the mock Ollama server and reports throughput, latency percentiles and
+memory use. Results are written as JSON so runs can be compared across commits.
+
+    python benchmarks/load_test.py --concurrency 1 8 32 --requests 200 --latency 0.05 --tokens-per-second 200
+    python benchmarks/load_test.py --stream --error-rate 0.02 --output results/stream.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import platform
+import tracemalloc
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mock_ollama import MockOllamaServer, make_reply
+
+
+# (task method, args) pairs replayed round-robin; CoT problems are added from the app
+CORPUS = [
+    ("qa", ("What is the capital of France?",)),
+    ("qa", ("Who wrote Pride and Prejudice?",)),
+    ("summarization", ("The Industrial Revolution began in Britain in the late 18th century and spread to Europe and North America. "
+                       "It transformed economies that had been based on agriculture and handicrafts into economies based on "
+                       "large-scale industry, mechanized manufacturing, and the factory system.",)),
+    ("translation", ("Good morning, how are you today?", "English", "French")),
+    ("translation", ("Where is the train station?", "English", "Japanese")),
+    ("roleplay", ("I have had a headache for three days.", "Doctor")),
+    ("roleplay", ("My laptop will not turn on.", "Tech Support")),
+    ("json_formatting", ("Name John Smith, age 34, email john@example.com, city Boston",)),
+    ("few_shot_classification", ("Fantastic, the app crashed again right before my deadline.", "sentiment", "few")),
+    ("few_shot_classification", ("Book me a table for two tonight.", "intent", "zero")),
+]
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+
+    def rank(q):
+        return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+    return {"p50": rank(50), "p95": rank(95), "p99": rank(99), "max": values[-1]}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_level(va, corpus, concurrency, requests, stream, args):
+    metrics = va.MetricsRegistry()
+    # Anything that can answer without the model is off unless asked for, so the
+    # benchmark measures the model path
+    tm = va.TaskManager(
+        cache=None if args.cache else False,
+        semantic_cache=None if args.semantic_cache else False,
+        translation_memory=None if args.translation_memory else False,
+        classifier=None if args.classifier else False,
+        metrics=metrics
+    )
+
+    def call(i):
+        method, args = corpus[i % len(corpus)]
+        started = time.perf_counter()
+        result = getattr(tm, method)(*args, stream=stream)
+        if not isinstance(result, str):
+            result = "".join(result)
+        return method, time.perf_counter() - started, va.is_error_response(result)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(requests)))
+    elapsed = time.perf_counter() - started
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = [latency for _, latency, _ in results]
+    errors = sum(1 for _, _, failed in results if failed)
+    per_task = {}
+    for method in sorted({method for method, _, _ in results}):
+        per_task[method] = percentiles([latency for m, latency, _ in results if m == method])
+
+    snapshot = metrics.snapshot()
+    ttfts = [summary["ttft_p50"] for summary in snapshot.values() if summary["ttft_p50"] is not None]
+    completion_tokens = sum(summary["completion_tokens"] for summary in snapshot.values())
+
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "elapsed": elapsed,
+        "throughput_rps": requests / elapsed,
+        "completion_tokens_per_second": completion_tokens / elapsed,
+        "errors": errors,
+        "error_rate": errors / requests,
+        "latency": percentiles(latencies),
+        "ttft_p50": sorted(ttfts)[len(ttfts) // 2] if ttfts else None,
+        "per_task": per_task,
+        "peak_traced_mb": peak_traced / (1024 * 1024),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test TaskManager against a mock Ollama server.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=100, help="Requests per concurrency level")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock time before the first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Mock generation speed")
+    parser.add_argument("--reply-tokens", type=int, default=40, help="Tokens in each mock reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock requests failing with 500")
+    parser.add_argument("--stream", action="store_true", help="Use the streaming path")
+    parser.add_argument("--cache", action="store_true", help="Enable the response cache")
+    parser.add_argument("--semantic-cache", action="store_true", help="Enable the semantic cache")
+    parser.add_argument("--translation-memory", action="store_true", help="Enable the translation memory")
+    parser.add_argument("--classifier", action="store_true", help="Enable the local fast-path classifier")
+    parser.add_argument("--tasks", nargs="+", help="Only replay these TaskManager methods")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=os.path.join("benchmarks", "results", "load_test.json"))
+    args = parser.parse_args()
+
+    server = MockOllamaServer(reply=make_reply(args.reply_tokens), latency=args.latency,
+                              tokens_per_second=args.tokens_per_second, error_rate=args.error_rate, seed=args.seed).start()
+    os.environ["OLLAMA_URL"] = server.url
+    # Opt-in caches stay in memory rather than writing files into the working directory
+    for variable in ("RESPONSE_CACHE_PATH", "SEMANTIC_CACHE_PATH", "TRANSLATION_MEMORY_PATH"):
+        os.environ.setdefault(variable, "")
+
+    import virtual_assistant as va
+
+    corpus = CORPUS + [("cot_reasoning", (problem,)) for problem in va.COT_SAMPLE_PROBLEMS]
+    if args.tasks:
+        corpus = [entry for entry in corpus if entry[0] in args.tasks]
+
+    levels = []
+    try:
+        for concurrency in args.concurrency:
+            level = run_level(va, corpus, concurrency, args.requests, args.stream, args)
+            levels.append(level)
+            latency = level["latency"]
+            print(f"concurrency={concurrency:<4} {level['throughput_rps']:8.1f} req/s  "
+                  f"p50={latency['p50'] * 1000:7.1f}ms  p95={latency['p95'] * 1000:7.1f}ms  p99={latency['p99'] * 1000:7.1f}ms  "
+                  f"errors={level['errors']}  peak={level['peak_traced_mb']:.1f}MB")
+    finally:
+        server.stop()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "mock_failures_injected": server.failed,
+        "levels": levels
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
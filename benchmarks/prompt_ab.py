@@ -0,0 +1,221 @@
+"""
+A/B test of prompt template variants.
+
+Replays a labelled corpus through one TaskManager per variant (by default the
+full and compact templates) and reports, per task, the answer quality next to
+the prompt tokens and prompt-eval time Ollama spent. Quality is label accuracy
+for classification, the rate of answers that parse as a JSON object (and match
+the record's schema, if any) for JSON formatting, and for the other tasks the
+rate of answers containing one of the expected strings.
+
+Caches and the local classifier are disabled so every record reaches the
+model, and the order of the variants alternates between records so neither
+one always runs against a warm backend.
+
+    python benchmarks/prompt_ab.py
+    python benchmarks/prompt_ab.py --tasks classification json_formatting --output results/prompt_ab.json
+    python benchmarks/prompt_ab.py --mock
+
+`--mock` runs against the mock Ollama server with canned answers: the token
+and time columns are meaningful, the quality columns are not.
+
+Results are tagged with the git revision.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mock_ollama import MockOllamaServer
+from load_test import git_revision
+
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompt_ab_corpus.jsonl")
+
+# Corpus task -> MetricsRegistry task name
+METRIC_TASKS = {
+    "classification": "few_shot_classification",
+    "json_formatting": "json_formatting",
+    "qa": "qa",
+    "summarization": "summarization",
+    "translation": "translation",
+    "roleplay": "roleplay"
+}
+
+QUALITY_METRICS = {"classification": "accuracy", "json_formatting": "json_valid"}
+
+LABEL_PREFIX_RE = re.compile(r"^\s*(?:A\s*:\s*)?(?:(?:sentiment|intent)\s*:\s*)?", re.IGNORECASE)
+
+
+def load_corpus(path, tasks=None):
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return [record for record in records if not tasks or record["task"] in tasks]
+
+
+def mock_reply(payload):
+    prompt = payload.get("prompt", "").rstrip()
+    if prompt.endswith("Sentiment:"):
+        return "Negative"
+    if prompt.endswith("Intent:"):
+        return "Intent: Booking"
+    if prompt.endswith("JSON:"):
+        return '{"name": "John Smith", "age": 34}'
+    return "Paris is the capital of France."
+
+
+def run_record(tm, record, shot_type):
+    task = record["task"]
+    if task == "classification":
+        return tm.few_shot_classification(record["input"], record["mode"], shot_type)
+    if task == "json_formatting":
+        return tm.json_formatting(record["input"], schema=record.get("schema"))
+    if task == "translation":
+        return tm.translation(record["input"], record["source_lang"], record["target_lang"])
+    if task == "roleplay":
+        return tm.roleplay(record["input"], record["role"])
+    return getattr(tm, task)(record["input"])
+
+
+def classification_label(output):
+    line = next((line for line in output.splitlines() if line.strip()), "")
+    return LABEL_PREFIX_RE.sub("", line).strip().strip("*`.").lower()
+
+
+def score(va, record, output):
+    if va.is_error_response(output):
+        return False
+    task = record["task"]
+    if task == "classification":
+        label = classification_label(output)
+        expected = record["expected"]
+        if isinstance(expected, str):
+            return label.split(" ")[0].strip(".,!") == expected.lower()
+        return any(keyword in label for keyword in expected)
+    if task == "json_formatting":
+        # As strict as the UI, which parses the answer as it is
+        try:
+            parsed = json.loads(output)
+        except ValueError:
+            return False
+        if not isinstance(parsed, dict):
+            return False
+        return "schema" not in record or not va.compile_schema(record["schema"]).errors(parsed)
+    return any(expected.lower() in output.lower() for expected in record["expected"])
+
+
+def summarize(records, outcomes, snapshots, variants):
+    rows = []
+    for task in [task for task in METRIC_TASKS if any(record["task"] == task for record in records)]:
+        indices = [i for i, record in enumerate(records) if record["task"] == task]
+        row = {"task": task, "metric": QUALITY_METRICS.get(task, "match"), "records": len(indices)}
+        for variant in variants:
+            summary = snapshots[variant].get(METRIC_TASKS[task], {})
+            row[variant] = {
+                "quality": sum(outcomes[variant][i] for i in indices) / len(indices),
+                "prompt_tokens": summary.get("prompt_tokens", 0),
+                "prompt_eval_seconds": summary.get("prompt_eval_seconds", 0.0)
+            }
+        rows.append(row)
+
+    total = {"task": "total", "metric": "all", "records": len(records)}
+    for variant in variants:
+        total[variant] = {
+            "quality": sum(outcomes[variant]) / len(records) if records else 0.0,
+            "prompt_tokens": sum(row[variant]["prompt_tokens"] for row in rows),
+            "prompt_eval_seconds": sum(row[variant]["prompt_eval_seconds"] for row in rows)
+        }
+    rows.append(total)
+
+    baseline, candidate = variants[0], variants[-1]
+    for row in rows:
+        base, other = row[baseline], row[candidate]
+        row["quality_delta"] = other["quality"] - base["quality"]
+        row["prompt_tokens_saved"] = base["prompt_tokens"] - other["prompt_tokens"]
+        row["prompt_eval_seconds_saved"] = base["prompt_eval_seconds"] - other["prompt_eval_seconds"]
+    return rows
+
+
+def print_report(rows, variants):
+    baseline, candidate = variants[0], variants[-1]
+    print(f"{'task':<16}{'metric':<12}{'n':>4}"
+          f"{baseline[:8]:>10}{candidate[:8]:>10}{'delta':>8}"
+          f"{'tokens ' + baseline[:8]:>16}{'tokens ' + candidate[:8]:>16}{'saved':>8}{'eval s saved':>14}")
+    for row in rows:
+        base, other = row[baseline], row[candidate]
+        saved = row["prompt_tokens_saved"] / base["prompt_tokens"] if base["prompt_tokens"] else 0.0
+        print(f"{row['task']:<16}{row['metric']:<12}{row['records']:>4}"
+              f"{base['quality']:>10.0%}{other['quality']:>10.0%}{row['quality_delta'] * 100:>+7.0f}%"
+              f"{base['prompt_tokens']:>16}{other['prompt_tokens']:>16}{saved:>8.0%}{row['prompt_eval_seconds_saved']:>14.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare prompt template variants on a labelled corpus.")
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--variants", nargs=2, default=["full", "compact"], metavar=("BASELINE", "CANDIDATE"))
+    parser.add_argument("--tasks", nargs="+", choices=sorted(METRIC_TASKS), help="Only replay these corpus tasks")
+    parser.add_argument("--shot-type", choices=["few", "zero"], default="few", help="Classification prompting")
+    parser.add_argument("--mock", action="store_true", help="Run against the mock Ollama server")
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=500.0, help="Mock prompt evaluation speed")
+    parser.add_argument("--output", default=os.path.join("benchmarks", "results", "prompt_ab.json"))
+    args = parser.parse_args()
+
+    server = None
+    if args.mock:
+        server = MockOllamaServer(reply=mock_reply, prompt_tokens_per_second=args.prompt_tokens_per_second).start()
+        os.environ["OLLAMA_URL"] = server.url
+        os.environ.setdefault("RESPONSE_CACHE_PATH", "")
+
+    import virtual_assistant as va
+
+    records = load_corpus(args.corpus, args.tasks)
+    managers = {
+        variant: va.TaskManager(cache=False, metrics=va.MetricsRegistry(), classifier=False, semantic_cache=False,
+                                translation_memory=False, prompt_variant=variant)
+        for variant in args.variants
+    }
+    outcomes = {variant: [] for variant in args.variants}
+    answers = []
+
+    started = time.perf_counter()
+    try:
+        for i, record in enumerate(records):
+            answer = {"record": i}
+            for variant in args.variants[::1 if i % 2 == 0 else -1]:
+                output = run_record(managers[variant], record, args.shot_type)
+                outcomes[variant].append(score(va, record, output))
+                answer[variant] = output
+            answers.append(answer)
+            print(f"\r{i + 1}/{len(records)} records", end="", file=sys.stderr, flush=True)
+        print(file=sys.stderr)
+    finally:
+        if server is not None:
+            server.stop()
+
+    snapshots = {variant: tm.metrics.snapshot() for variant, tm in managers.items()}
+    rows = summarize(records, outcomes, snapshots, args.variants)
+    print_report(rows, args.variants)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": git_revision(),
+        "corpus": args.corpus,
+        "mock": args.mock,
+        "elapsed": time.perf_counter() - started,
+        "variants": args.variants,
+        "rows": rows,
+        "answers": answers
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Token accounting for the prompt template library.
+
+Renders every task template in each variant with a sample input and reports
+the prompt size: total tokens, the fixed instructions around the input and the
+input itself. Counts are the same word/punctuation estimate the token budgets
+use; with `--ollama` the prompts are also sent to the configured backend with
+`num_predict=1` and Ollama's own `prompt_eval_count`/`prompt_eval_duration`
+are reported next to them.
+
+    python benchmarks/prompt_tokens.py
+    python benchmarks/prompt_tokens.py --ollama --output results/prompt_tokens.json
+"""
+import os
+import sys
+import json
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from virtual_assistant import (
+    INTENT_EXAMPLES, SENTIMENT_EXAMPLES, PROMPT_TEMPLATES, estimate_tokens, get_ollama_client, get_prompt_template
+)
+
+
+VARIANTS = ["full", "compact"]
+
+SAMPLE_ARGS = {
+    "qa": {"user_input": "What is the capital of France?"},
+    "summarization": {"user_input": "The Industrial Revolution began in Britain in the late 18th century and spread to Europe "
+                                    "and North America, turning economies based on agriculture and handicrafts into economies "
+                                    "based on large-scale industry and the factory system."},
+    "translation": {"user_input": "Good morning, how are you today?", "source_lang": "English", "target_lang": "French"},
+    "roleplay": {"user_input": "I have had a headache for three days.", "role": "doctor"},
+    "json_formatting": {"user_input": "Name John Smith, age 34, email john@example.com, city Boston"},
+    "few_shot_classification": {"user_input": "Fantastic, the app crashed again right before my deadline.", "mode": "sentiment",
+                                "examples": SENTIMENT_EXAMPLES},
+    "few_shot_classification_batch": {"inputs": ["I love this app!", "Book me a table for two tonight.", "It's fine, I guess."],
+                                      "mode": "sentiment", "examples": SENTIMENT_EXAMPLES},
+    # `<template>:<label>` renders the same template with other arguments
+    "few_shot_classification:intent": {"user_input": "Book me a table for two tonight.", "mode": "intent",
+                                       "examples": INTENT_EXAMPLES},
+}
+
+
+def input_tokens(kwargs):
+    text = kwargs.get("user_input") or "\n".join(kwargs.get("inputs", []))
+    return estimate_tokens(text)
+
+
+def measure(name, variant, kwargs, ollama=False):
+    template = name.split(":")[0]
+    prompt = get_prompt_template(template, variant).render(**kwargs)
+    row = {
+        "template": name,
+        "variant": variant,
+        "defined": variant == "full" or f"{template}.{variant}" in PROMPT_TEMPLATES,
+        "prompt_tokens": estimate_tokens(prompt),
+        "input_tokens": input_tokens(kwargs),
+        "chars": len(prompt)
+    }
+    row["instruction_tokens"] = row["prompt_tokens"] - row["input_tokens"]
+
+    if ollama:
+        # Ollama only evaluates the part of a prompt it has not cached yet, so
+        # each prompt is measured on its first send
+        result = get_ollama_client().generate(prompt, options={"num_predict": 1, "temperature": 0})
+        row["prompt_eval_count"] = result.get("prompt_eval_count", 0)
+        row["prompt_eval_seconds"] = result.get("prompt_eval_duration", 0) / 1e9
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report prompt tokens per template and variant.")
+    parser.add_argument("--ollama", action="store_true", help="Measure prompt_eval_count on the configured Ollama backend")
+    parser.add_argument("--variants", nargs="+", default=VARIANTS)
+    parser.add_argument("--output", help="Also write the rows as JSON to this path")
+    args = parser.parse_args()
+
+    rows = [measure(name, variant, kwargs, args.ollama) for name, kwargs in SAMPLE_ARGS.items() for variant in args.variants]
+
+    # Savings are relative to the first variant, in Ollama's count when measured
+    key = "prompt_eval_count" if args.ollama else "prompt_tokens"
+    baseline = {row["template"]: row[key] for row in rows if row["variant"] == args.variants[0]}
+    header = f"{'template':<38}{'variant':<10}{'prompt':>8}{'instr.':>8}{'input':>7}"
+    if args.ollama:
+        header += f"{'ollama':>8}{'eval (ms)':>11}"
+    print(header + f"{'saved':>8}")
+    for row in rows:
+        saved = 1 - row[key] / baseline[row["template"]] if baseline[row["template"]] else 0.0
+        line = (f"{row['template']:<38}{row['variant'] + ('' if row['defined'] else '*'):<10}{row['prompt_tokens']:>8}"
+                f"{row['instruction_tokens']:>8}{row['input_tokens']:>7}")
+        if args.ollama:
+            line += f"{row['prompt_eval_count']:>8}{row['prompt_eval_seconds'] * 1000:>11.1f}"
+        print(line + f"{saved:>8.0%}")
+    if not all(row["defined"] for row in rows):
+        print("* no template of this variant; the full template is used")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"ollama": args.ollama, "rows": rows}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
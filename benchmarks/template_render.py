@@ -0,0 +1,47 @@
+"""
+Micro-benchmark for prompt rendering.
+
+Compares the old per-call `jinja2.Template(source)` construction with the
+compile-once templates served by `get_prompt_template`.
+
+    python benchmarks/template_render.py [iterations]
+"""
+import os
+import sys
+import timeit
+from jinja2 import Template
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from virtual_assistant import PROMPT_TEMPLATES, SENTIMENT_EXAMPLES, get_prompt_template
+
+
+RENDER_ARGS = {
+    "qa": {"user_input": "What is the capital of France?"},
+    "summarization": {"user_input": "The quick brown fox jumps over the lazy dog. " * 20},
+    "translation": {"user_input": "Good morning, how are you?", "source_lang": "English", "target_lang": "French"},
+    "roleplay": {"user_input": "I have a headache.", "role": "doctor"},
+    "json_formatting": {"user_input": "name John, age 30, city Paris"},
+    "few_shot_classification": {"user_input": "Great app!", "mode": "sentiment", "examples": SENTIMENT_EXAMPLES, "label_format": "A:"},
+    "cot_reasoning": {"user_input": "What is the result of (8 * 5) + (12 ÷ 4) - 7?"},
+}
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    print(f"{'template':<26}{'per-call Template (us)':>24}{'registry (us)':>16}{'speedup':>10}")
+    for name, kwargs in RENDER_ARGS.items():
+        source = PROMPT_TEMPLATES[name]
+        assert Template(source).render(**kwargs) == get_prompt_template(name, "full").render(**kwargs)
+
+        before = timeit.timeit(lambda: Template(source).render(**kwargs), number=iterations)
+        after = timeit.timeit(lambda: get_prompt_template(name, "full").render(**kwargs), number=iterations)
+
+        before_us = before / iterations * 1e6
+        after_us = after / iterations * 1e6
+        print(f"{name:<26}{before_us:>24.1f}{after_us:>16.1f}{before_us / after_us:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
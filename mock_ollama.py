@@ -0,0 +1,239 @@
+# Mock Ollama Server
+"""
+A small stand-in for Ollama's `/api/generate` endpoint, for exercising and
+benchmarking the assistant without a model. It answers with a canned reply,
+in one JSON object or as one NDJSON chunk per token when `"stream": true` is
+requested, and reports the same timing/token fields as Ollama. `/api/embed`,
+`/api/ps` and `/api/tags` are answered too.
+
+    python mock_ollama.py --port 11434 --latency 0.2 --tokens-per-second 50 --error-rate 0.01
+
+or from Python:
+
+    server = MockOllamaServer(latency=0.05).start()
+    client = OllamaClient(url=server.url)
+    ...
+    server.stop()
+"""
+import re
+import sys
+import json
+import math
+import hashlib
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+DEFAULT_REPLY = "This is a mock response from the Ollama stand-in."
+EMBEDDING_DIM = 256
+
+
+def make_reply(token_count):
+    return " ".join(f"token{i}" for i in range(token_count))
+
+
+def mock_embedding(text, dim=EMBEDDING_DIM):
+    """
+    Hashed bag of character trigrams: crude, but texts sharing most of their
+    words get a high cosine similarity, which is enough to exercise a cache.
+    """
+    vector = [0.0] * dim
+    text = " ".join(re.findall(r"\w+", text.lower()))
+    for i in range(len(text) - 2):
+        vector[int(hashlib.md5(text[i:i + 3].encode("utf-8")).hexdigest(), 16) % dim] += 1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if self.path == "/api/ps":
+            self._send_json(200, {"models": [{"name": name} for name in sorted(server.loaded_models)]})
+        elif self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": name} for name in server.models]})
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+        if self.path == "/api/embed":
+            inputs = payload.get("input", [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            server.embeddings += len(inputs)
+            self._send_json(200, {"model": payload.get("model"), "embeddings": [mock_embedding(text) for text in inputs]})
+            return
+        server.record_request(payload)
+
+        delay = server.prompt_eval_seconds(payload)
+        if delay:
+            time.sleep(delay)
+
+        if server.should_fail():
+            self._send_json(500, {"error": "injected failure"})
+            return
+
+        reply = server.reply(payload) if callable(server.reply) else server.reply
+        tokens = re.findall(r"\s*\S+", reply) or [reply]
+        started = time.perf_counter()
+
+        if payload.get("stream", True):
+            self._send_stream(payload, tokens, started)
+        else:
+            if server.tokens_per_second:
+                time.sleep(len(tokens) / server.tokens_per_second)
+            body = {"model": payload.get("model"), "response": reply, "done": True}
+            body.update(server.stats(payload, len(tokens), started))
+            self._send_json(200, body)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.cancelled += 1
+
+    def _send_stream(self, payload, tokens, started):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        delay = 1.0 / self.server.tokens_per_second if self.server.tokens_per_second else 0
+        try:
+            for token in tokens:
+                if delay:
+                    time.sleep(delay)
+                self._write_chunk({"model": payload.get("model"), "response": token, "done": False})
+            final = {"model": payload.get("model"), "response": "", "done": True}
+            final.update(self.server.stats(payload, len(tokens), started))
+            self._write_chunk(final)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, e.g. after hitting a stop token
+            self.server.cancelled += 1
+
+    def _write_chunk(self, body):
+        line = (json.dumps(body) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+
+class MockOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, reply=DEFAULT_REPLY, latency=0.0,
+                 tokens_per_second=0.0, error_rate=0.0, seed=None, models=(), prompt_tokens_per_second=0.0):
+        super().__init__((host, port), MockOllamaHandler)
+        self.reply = reply
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        # Prompt evaluation speed; 0 charges only `latency`, whatever the prompt size
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.error_rate = error_rate
+        # Reported by /api/tags; /api/ps lists the models requested so far
+        self.models = list(models)
+        self.loaded_models = set()
+        self.requests = []
+        self.cancelled = 0
+        self.failed = 0
+        self.embeddings = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/generate"
+
+    def record_request(self, payload):
+        with self._lock:
+            self.requests.append(payload)
+            if payload.get("model"):
+                self.loaded_models.add(payload["model"])
+
+    def should_fail(self):
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+            self.failed += failed
+            return failed
+
+    def prompt_eval_seconds(self, payload):
+        if not self.prompt_tokens_per_second:
+            return self.latency
+        return self.latency + len(payload.get("prompt", "").split()) / self.prompt_tokens_per_second
+
+    def stats(self, payload, token_count, started):
+        eval_duration = int((time.perf_counter() - started) * 1e9)
+        prompt_eval_duration = int(self.prompt_eval_seconds(payload) * 1e9)
+        prompt_tokens = len(payload.get("prompt", "").split())
+        # Like Ollama, only the new prompt is evaluated when a context is passed back
+        context = list(payload.get("context") or []) + list(range(prompt_tokens + token_count))
+        return {
+            "context": context,
+            "total_duration": prompt_eval_duration + eval_duration,
+            "load_duration": 0,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": prompt_eval_duration,
+            "eval_count": token_count,
+            "eval_duration": eval_duration
+        }
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections is expected, not an error
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a mock Ollama /api/generate server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Generation speed (0 = instant)")
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=0.0, help="Prompt evaluation speed (0 = instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    parser.add_argument("--reply-tokens", type=int, help="Reply with this many tokens instead of --reply")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    reply = make_reply(args.reply_tokens) if args.reply_tokens else args.reply
+    server = MockOllamaServer(args.host, args.port, reply, args.latency, args.tokens_per_second, args.error_rate, args.seed,
+                              prompt_tokens_per_second=args.prompt_tokens_per_second)
+    print(f"Mock Ollama listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
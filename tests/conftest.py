@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mock_ollama import DEFAULT_REPLY, MockOllamaServer
+
+# One mock server for the whole run. The assistant reads its configuration at
+# import time, so this has to happen before any test imports virtual_assistant.
+SERVER = MockOllamaServer().start()
+os.environ.update(
+    OLLAMA_URL=SERVER.url,
+    OLLAMA_BACKENDS="",
+    OLLAMA_BACKENDS_FILE=os.path.join(ROOT, "tests", "no_backends.json"),
+    RESPONSE_CACHE_PATH="",
+    SEMANTIC_CACHE_PATH="",
+    TRANSLATION_MEMORY_PATH="",
+    FAST_CLASSIFIER="0",
+    FAST_CLASSIFIER_DATA=""
+)
+
+
+@pytest.fixture
+def mock_server():
+    """
+    The shared mock server, reset to an instant default reply for each test.
+    """
+    SERVER.reply = DEFAULT_REPLY
+    SERVER.latency = 0.0
+    SERVER.tokens_per_second = 0.0
+    SERVER.prompt_tokens_per_second = 0.0
+    SERVER.error_rate = 0.0
+    SERVER.requests.clear()
+    SERVER.cancelled = 0
+    yield SERVER
+    # Failures injected by a test must not leave the shared client's breaker open
+    import virtual_assistant as va
+    for backend in va.get_ollama_client().backends:
+        backend.breaker.record_success()
+
+
+@pytest.fixture
+def task_manager():
+    import virtual_assistant as va
+    return va.TaskManager(cache=False, metrics=va.MetricsRegistry(), classifier=False, semantic_cache=False, translation_memory=False)
@@ -0,0 +1,116 @@
+import json
+import threading
+import http.client
+
+import pytest
+
+from api_server import APIServer
+
+
+@pytest.fixture
+def api_server(task_manager):
+    servers = []
+
+    def start(**kwargs):
+        server = APIServer(port=0, task_manager=task_manager, **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def post(server, path, body):
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=10)
+    connection.request("POST", path, json.dumps(body), {"Content-Type": "application/json"})
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read())
+    connection.close()
+    return result
+
+
+def post_concurrently(server, bodies):
+    results = [None] * len(bodies)
+
+    def call(i):
+        results[i] = post(server, "/api/qa", bodies[i])
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(bodies))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_answers_task_request(mock_server, api_server):
+    server = api_server()
+    assert post(server, "/api/qa", {"user_input": "Capital of France?"}) == (200, {"task": "qa", "response": mock_server.reply})
+
+
+def test_rejects_missing_input_and_unknown_task(mock_server, api_server):
+    server = api_server()
+    assert post(server, "/api/qa", {})[0] == 400
+    assert post(server, "/api/nope", {"user_input": "x"})[0] == 404
+
+
+def test_full_queue_answers_503(mock_server, api_server):
+    mock_server.latency = 0.5
+    server = api_server(max_concurrent=1, max_queue=0)
+
+    results = post_concurrently(server, [{"user_input": f"question {i}"} for i in range(2)])
+
+    assert sorted(status for status, _ in results) == [200, 503]
+    assert server.admission.rejected == 1
+
+
+def test_identical_requests_share_one_upstream_call(mock_server, api_server):
+    mock_server.latency = 0.3
+    server = api_server(max_concurrent=4)
+
+    results = post_concurrently(server, [{"user_input": "same question"}] * 3)
+
+    assert [status for status, _ in results] == [200, 200, 200]
+    assert len(mock_server.requests) == 1
+    assert server.coalescer.coalesced == 2
+
+
+def test_invalid_arguments_answer_400(mock_server, api_server):
+    server = api_server()
+    status, body = post(server, "/api/roleplay", {"user_input": "Hello"})
+    assert status == 400 and "'role' is required" in body["error"]
+    assert post(server, "/api/cot_reasoning", {"user_input": "2 + 2", "adaptive": "yes"})[0] == 400
+    assert post(server, "/api/translation", {"user_input": "Hi", "source_lang": "English", "target_lang": [1]})[0] == 400
+    assert post(server, "/api/qa", ["not", "an", "object"])[0] == 400
+    assert mock_server.requests == []
+
+
+def test_unexpected_failure_answers_500(mock_server, api_server, monkeypatch):
+    server = api_server()
+
+    def broken(user_input, stream=False):
+        raise KeyError("bug")
+
+    monkeypatch.setattr(server.ui.tm, "qa", broken)
+    status, body = post(server, "/api/qa", {"user_input": "Capital of France?"})
+    assert status == 500 and "bug" not in body["error"]
+
+
+def test_translation_into_several_languages(mock_server, api_server):
+    server = api_server()
+    body = {"user_input": "Hello", "source_lang": "English", "target_lang": ["French", "Urdu"]}
+    assert post(server, "/api/translation", body) == (200, {"task": "translation", "response": {"French": mock_server.reply, "Urdu": mock_server.reply}})
+    assert post(server, "/api/translation", dict(body, stream=True))[0] == 400
+    assert post(server, "/api/translation", dict(body, session_id="s1"))[0] == 400
+
+
+def test_role_comparison_accepts_several_roles(mock_server, api_server):
+    server = api_server()
+    status, body = post(server, "/api/roleplay_comparison", {"user_input": "I have a headache.", "role": ["Doctor", "Chef"]})
+    assert status == 200 and "Chef" in body["response"]
+    assert len(mock_server.requests) == 3
+    assert post(server, "/api/roleplay", {"user_input": "Hello", "role": ["Doctor"]})[0] == 400
+    assert post(server, "/api/roleplay_comparison", {"user_input": "Hello", "role": []})[0] == 400
@@ -0,0 +1,23 @@
+import os
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+from conftest import ROOT
+
+
+@pytest.fixture
+def app(mock_server):
+    return AppTest.from_file(os.path.join(ROOT, "virtual_assistant.py"), default_timeout=30).run()
+
+
+def test_invalid_schema_is_reported_after_reruns(app):
+    # Every rerun executes the script as a new module while the TaskManager
+    # stays cached from the first run, so the error classes differ between them
+    app.selectbox[0].select("JSON Formatter").run()
+    next(area for area in app.text_area if area.label.startswith("JSON Schema")).input('{"type": "nope"}')
+    app.text_input[0].input("name John, age 30")
+    next(button for button in app.button if button.label == "Run Task").click().run()
+
+    assert not app.exception
+    assert [block.value for block in app.code] == ["[Invalid Schema] Unknown type(s): nope"]
@@ -0,0 +1,40 @@
+import time
+
+import pytest
+
+import virtual_assistant as va
+
+
+@pytest.mark.parametrize("problem, answer", [
+    ("What is the result of (8 * 5) + (12 ÷ 4) - 7?", "36"),
+    ("Calculate 2^10", "1024"),
+    ("what's 7 / 2", "3.5"),
+    ("10 - 2 - 3", "5"),
+])
+def test_plain_arithmetic_is_answered_locally(problem, answer):
+    assert va.solve_arithmetic(problem).endswith(f"**Final Answer:** {answer}")
+
+
+@pytest.mark.parametrize("problem", [
+    "What is 12/25/2024?",
+    "what is 2024-12-25",
+    "25.12.2024",
+    "What is $5 + 3?",
+    "What is 5 + 3 apples?",
+    "If x = 3, what is 2 * 3?",
+    "What day is 12/25?",
+])
+def test_anything_else_goes_to_the_model(problem):
+    assert va.solve_arithmetic(problem) is None
+
+
+@pytest.mark.parametrize("expression", ["((((9**64)**64)**64)**64)", "(99**64)**64", "((2**64)**64)**2"])
+def test_oversized_results_are_refused_quickly(expression):
+    started = time.perf_counter()
+    assert va.evaluate_arithmetic(expression) is None
+    assert time.perf_counter() - started < 0.1
+
+
+@pytest.mark.parametrize("problem", ["What is ((99**64)**64)?", "What is (10**64)**7 / 3?"])
+def test_results_too_large_to_print_go_to_the_model(problem):
+    assert va.solve_arithmetic(problem) is None
@@ -0,0 +1,95 @@
+import re
+import csv
+
+import pytest
+
+import batch_classify
+import virtual_assistant as va
+
+
+def numbered_labels(payload):
+    return "\n".join(f"{number}: Positive" for number, _ in re.findall(r"^(\d+)\. (.+)$", payload["prompt"], re.MULTILINE))
+
+
+def write_input(path, count):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "text"])
+        for i in range(count):
+            writer.writerow([i, f"review number {i}"])
+
+
+def read_output(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_labels_every_row(mock_server, tmp_path):
+    mock_server.reply = numbered_labels
+    source, target = tmp_path / "in.csv", tmp_path / "out.csv"
+    write_input(source, 10)
+
+    batch_classify.main([str(source), str(target), "--batch-size", "4"])
+
+    rows = read_output(target)
+    assert [row["id"] for row in rows] == [str(i) for i in range(10)]
+    assert {row["label"] for row in rows} == {"Positive"}
+
+
+def test_resume_drops_partial_line_and_continues(mock_server, tmp_path):
+    mock_server.reply = numbered_labels
+    source, target = tmp_path / "in.csv", tmp_path / "out.csv"
+    write_input(source, 10)
+    # A run that crashed halfway through writing row 3
+    target.write_text("id,text,label\n0,review number 0,Positive\n1,review number 1,Positive\n2,review num", encoding="utf-8")
+
+    assert batch_classify.repair_output(str(target)) == 2
+    batch_classify.main([str(source), str(target), "--batch-size", "4"])
+
+    rows = read_output(target)
+    assert [row["id"] for row in rows] == [str(i) for i in range(10)]
+    prompts = "".join(request["prompt"] for request in mock_server.requests)
+    assert "review number 0" not in prompts and "review number 2" in prompts
+
+
+def test_restart_ignores_existing_output(mock_server, tmp_path):
+    mock_server.reply = numbered_labels
+    source, target = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    source.write_text('{"text": "a"}\n{"text": "b"}\n', encoding="utf-8")
+    target.write_text('{"text": "stale", "label": "Negative"}\n', encoding="utf-8")
+
+    batch_classify.main([str(source), str(target), "--restart"])
+
+    assert target.read_text(encoding="utf-8").splitlines() == ['{"text": "a", "label": "Positive"}', '{"text": "b", "label": "Positive"}']
+
+
+def test_stops_on_model_errors_and_resumes(mock_server, tmp_path):
+    mock_server.reply = numbered_labels
+    source, target = tmp_path / "in.csv", tmp_path / "out.csv"
+    write_input(source, 6)
+    failing = iter([False] + [True] * 100)
+    mock_server.should_fail = lambda: next(failing, True)
+    try:
+        with pytest.raises(SystemExit) as exit_info:
+            batch_classify.main([str(source), str(target), "--batch-size", "3", "--workers", "1"])
+    finally:
+        del mock_server.should_fail
+    assert exit_info.value.code != 0
+    rows = read_output(target)
+    assert all(not row["label"].startswith("[") for row in rows)
+
+    for backend in va.get_ollama_client().backends:
+        backend.breaker.record_success()
+    batch_classify.main([str(source), str(target), "--batch-size", "3"])
+    assert [row["id"] for row in read_output(target)] == [str(i) for i in range(6)]
+
+
+def test_repair_scans_back_past_long_partial_line(tmp_path):
+    target = tmp_path / "out.jsonl"
+    target.write_text('{"label": "a"}\n' + "x" * (batch_classify.REPAIR_BLOCK_SIZE * 2 + 5), encoding="utf-8")
+    assert batch_classify.repair_output(str(target)) == 1
+    assert target.read_text(encoding="utf-8") == '{"label": "a"}\n'
+
+    target.write_text("no newline at all", encoding="utf-8")
+    assert batch_classify.repair_output(str(target)) == 0
+    assert target.read_text(encoding="utf-8") == ""
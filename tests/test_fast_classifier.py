@@ -0,0 +1,58 @@
+import pytest
+
+import virtual_assistant as va
+
+
+TRAINING = {
+    "Positive": ["I love this app", "Great service, thank you", "Absolutely wonderful experience", "Fantastic support team"],
+    "Negative": ["This app is terrible", "Awful service, never again", "Horrible experience, it broke", "The worst support ever"]
+}
+
+
+def trained_classifier():
+    pytest.importorskip("numpy")
+    classifier = va.FastClassifier(threshold=0.5, data_path="")
+    classifier.add_examples("sentiment", [(text, label) for label, texts in TRAINING.items() for text in texts])
+    return classifier
+
+
+@pytest.mark.parametrize("label, expected", [
+    ("Intent: Weather Inquiry", "Weather Inquiry"),
+    ("weather inquiry", "Weather Inquiry"),
+    ("**Smart Home Control**", "Smart Home Control"),
+    (" Sentiment:  Negative.", "Negative")
+])
+def test_labels_are_normalized(label, expected):
+    assert va.normalize_label(label) == expected
+
+
+def test_embedded_intent_examples_share_one_label_format():
+    assert all(not label.lower().startswith("intent") for _, label in va.parse_examples(va.INTENT_EXAMPLES))
+
+
+def test_embedded_examples_alone_train_no_model():
+    classifier = va.FastClassifier(data_path="")
+    assert classifier._model("sentiment") is None and classifier._model("intent") is None
+
+
+def test_disabled_by_default():
+    assert not va.FAST_CLASSIFIER_ENABLED
+    assert va.TaskManager(cache=False, semantic_cache=False, translation_memory=False).classifier is None
+
+
+def test_confident_few_shot_inputs_skip_the_model(mock_server):
+    classifier = trained_classifier()
+    tm = va.TaskManager(cache=False, metrics=va.MetricsRegistry(), classifier=classifier, semantic_cache=False, translation_memory=False)
+
+    assert tm.few_shot_classification("I love this wonderful app", "sentiment", "few") == "Positive"
+    assert not mock_server.requests
+    assert classifier.stats()["answered"] == 1
+
+
+def test_zero_shot_requests_always_go_to_the_model(mock_server):
+    classifier = trained_classifier()
+    tm = va.TaskManager(cache=False, metrics=va.MetricsRegistry(), classifier=classifier, semantic_cache=False, translation_memory=False)
+
+    assert tm.few_shot_classification("I love this wonderful app", "sentiment", "zero") == mock_server.reply
+    assert len(mock_server.requests) == 1
+    assert classifier.stats()["answered"] == 0
@@ -0,0 +1,56 @@
+import pytest
+
+from virtual_assistant import SchemaError, compile_schema
+
+
+@pytest.mark.parametrize("document, message", [
+    ('{"name": "Ann", "age": 30, "email": "a@b.c", "city": "Rome"}', "[Valid JSON] JSON structure is correct and matches schema."),
+    ('{"name": "Ann", "age": "30", "email": "a@b.c", "city": "Rome"}', "[Schema Mismatch] Type errors: age expected int, got str"),
+    ('{"name": "Ann"}', "[Schema Mismatch] Missing keys: age, email, city"),
+    ('[1, 2]', "[Invalid JSON] Root element must be a JSON object."),
+    ('{"name": ', "[Invalid JSON] Error: Expecting value: line 1 column 10 (char 9)")
+])
+def test_default_schema_messages(task_manager, document, message):
+    assert task_manager.validate_json_output(document) == message
+
+
+def test_custom_schema_constraints(task_manager):
+    schema = {"type": "object", "properties": {"a": {"type": "integer", "minimum": 0}}}
+    assert task_manager.validate_json_output('{"a": -1}', schema) == "[Schema Mismatch] Errors: a violates minimum 0"
+    assert task_manager.validate_json_output('{"a": 1}', schema).startswith("[Valid JSON]")
+
+
+def test_invalid_schema_is_reported(task_manager):
+    assert task_manager.validate_json_output('{"a": 1}', '{"type": "nope"}') == "[Invalid Schema] Unknown type(s): nope"
+    assert task_manager.validate_json_output('{"a": 1}', "{not json").startswith("[Invalid Schema] Schema is not valid JSON")
+
+
+def test_compiled_validators_are_reused():
+    assert compile_schema({"type": "object"}) is compile_schema('{"type": "object"}')
+    with pytest.raises(SchemaError):
+        compile_schema({"type": "nope"})
+
+
+@pytest.mark.parametrize("schema, message", [
+    ({"properties": []}, "'properties' must be an object"),
+    ({"type": 5}, "'type' must be a string or an array of strings"),
+    ({"type": ["string", 1]}, "'type' must be a string or an array of strings"),
+    ({"required": 5}, "'required' must be an array"),
+    ({"required": [1]}, "'required' must be an array of strings"),
+    ({"enum": "a"}, "'enum' must be an array"),
+    ({"anyOf": 3}, "'anyOf' must be an array"),
+    ({"allOf": [5]}, "A subschema must be a JSON object, got 5"),
+    ({"properties": {"a": "string"}}, 'A subschema must be a JSON object, got "string"'),
+    ({"minimum": "a"}, "'minimum' must be a number"),
+    ({"maxLength": True}, "'maxLength' must be an integer"),
+    ({"additionalProperties": "no"}, "'additionalProperties' must be a boolean or an object")
+])
+def test_malformed_schema_is_a_schema_error(schema, message):
+    with pytest.raises(SchemaError) as error:
+        compile_schema(schema)
+    assert str(error.value) == message
+
+
+def test_malformed_schema_is_reported_by_every_task(task_manager):
+    assert task_manager.validate_json_output('{"a": 1}', {"properties": []}) == "[Invalid Schema] 'properties' must be an object"
+    assert task_manager.json_formatting("Ann, 30", schema={"anyOf": 3}) == "[Invalid Schema] 'anyOf' must be an array"
@@ -0,0 +1,27 @@
+import io
+
+import virtual_assistant as va
+
+
+def test_sentences_are_split_and_normalized():
+    text = "First sentence here. Second one\nwraps.  Third!\n\nLast line"
+    assert list(va.iter_sentences(io.StringIO(text))) == ["First sentence here.", "Second one wraps.", "Third!", "Last line"]
+
+
+def test_text_without_boundaries_is_split_at_the_window():
+    text = "word " * 10_000
+    sentences = list(va.iter_sentences(text, max_chars=1000))
+    assert len(sentences) > 1
+    assert all(len(sentence) <= 1000 for sentence in sentences)
+    assert " ".join(sentences) == text.strip()
+
+
+def test_text_without_whitespace_is_cut_hard():
+    sentences = list(va.iter_sentences("x" * 2500, max_chars=1000))
+    assert [len(sentence) for sentence in sentences] == [1000, 1000, 500]
+
+
+def test_chunks_stay_within_budget():
+    chunks = list(va.chunk_document("word " * 20_000, chunk_tokens=500, overlap_tokens=50))
+    assert len(chunks) > 1
+    assert all(va.estimate_tokens(chunk) <= 500 for chunk in chunks)
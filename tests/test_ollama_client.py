@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+from virtual_assistant import CircuitBreaker, CircuitOpenError, OllamaClient, OllamaServerError
+
+
+def make_client(server, **kwargs):
+    return OllamaClient(url=server.url, backoff_base=0.0, **kwargs)
+
+
+def test_server_errors_are_retried(mock_server):
+    mock_server.error_rate = 1.0
+    client = make_client(mock_server, max_retries=2)
+
+    with pytest.raises(OllamaServerError):
+        client.generate("hello")
+    assert len(mock_server.requests) == 3
+
+
+def test_retry_recovers_after_transient_error(mock_server):
+    failures = iter([True, False])
+    mock_server.should_fail = lambda: next(failures)
+    try:
+        client = make_client(mock_server, max_retries=2)
+        assert client.generate("hello")["response"] == mock_server.reply
+    finally:
+        del mock_server.should_fail
+    assert len(mock_server.requests) == 2
+
+
+def test_breaker_opens_after_consecutive_failures(mock_server):
+    mock_server.error_rate = 1.0
+    client = make_client(mock_server, max_retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+
+    for _ in range(2):
+        with pytest.raises(OllamaServerError):
+            client.generate("hello")
+    assert client.breaker.state == "open"
+
+    with pytest.raises(CircuitOpenError):
+        client.generate("hello")
+    assert len(mock_server.requests) == 2
+
+
+def test_breaker_lets_one_trial_through_after_reset_timeout(mock_server):
+    mock_server.error_rate = 1.0
+    client = make_client(mock_server, max_retries=0, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.05))
+    with pytest.raises(OllamaServerError):
+        client.generate("hello")
+    assert client.breaker.state == "open"
+
+    time.sleep(0.06)
+    assert client.breaker.state == "half-open"
+    mock_server.error_rate = 0.0
+    client.generate("hello")
+    assert client.breaker.state == "closed"
@@ -0,0 +1,50 @@
+import time
+
+from virtual_assistant import ResponseCache
+
+
+def test_key_depends_on_prompt_model_and_options():
+    key = ResponseCache.make_key("prompt", "model", {"temperature": 0})
+    assert key == ResponseCache.make_key("prompt", "model", {"temperature": 0})
+    assert key != ResponseCache.make_key("prompt ", "model", {"temperature": 0})
+    assert key != ResponseCache.make_key("prompt", "other", {"temperature": 0})
+    assert key != ResponseCache.make_key("prompt", "model", {"temperature": 0.7})
+
+
+def test_key_ignores_option_order():
+    assert ResponseCache.make_key("p", "m", {"a": 1, "b": 2}) == ResponseCache.make_key("p", "m", {"b": 2, "a": 1})
+
+
+def test_entries_expire_after_ttl():
+    cache = ResponseCache(ttl=0.05)
+    cache.set("key", "value")
+    assert cache.get("key") == "value"
+    time.sleep(0.06)
+    assert cache.get("key") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+
+
+def test_disk_tier_survives_a_new_instance(tmp_path):
+    path = str(tmp_path / "responses.sqlite3")
+    ResponseCache(path=path).set("key", "value")
+    cache = ResponseCache(path=path)
+    assert cache.get("key") == "value"
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_deterministic_task_is_served_from_cache(mock_server):
+    import virtual_assistant as va
+    tm = va.TaskManager(cache=ResponseCache(), metrics=va.MetricsRegistry(), classifier=False, semantic_cache=False, translation_memory=False)
+    first = tm.json_formatting("name John, age 30")
+    assert tm.json_formatting("name John, age 30") == first
+    assert len(mock_server.requests) == 1
@@ -0,0 +1,55 @@
+import pytest
+
+from virtual_assistant import OllamaRouter, OllamaServerError
+
+
+def make_router(server):
+    return OllamaRouter([server.url.rsplit("/api/", 1)[0]], health_interval=0)
+
+
+def test_closing_a_stream_early_counts_as_success(mock_server):
+    mock_server.reply = "one two three four five"
+    router = make_router(mock_server)
+    backend = router.backends[0]
+
+    chunks = router.generate_stream("hello", model="m")
+    next(chunks)
+    chunks.close()
+
+    assert backend.outstanding == 0
+    assert backend.latency is not None and "m" in backend.loaded_models
+
+
+def test_failed_backend_is_not_credited(mock_server):
+    mock_server.error_rate = 1.0
+    router = make_router(mock_server)
+    backend = router.backends[0]
+    backend.max_retries = 0
+
+    with pytest.raises(OllamaServerError):
+        router.generate("hello", model="m")
+
+    assert backend.outstanding == 0
+    assert backend.latency is None and not backend.loaded_models
+
+
+def test_unexpected_errors_release_the_backend(mock_server, monkeypatch):
+    router = make_router(mock_server)
+    backend = router.backends[0]
+
+    # Ollama answering 200 with an {"error": ...} body, which is not retried on another backend
+    def fail(prompt, **params):
+        raise RuntimeError("model not found")
+
+    def fail_stream(prompt, **params):
+        yield fail(prompt)
+
+    monkeypatch.setattr(backend, "generate", fail)
+    monkeypatch.setattr(backend, "generate_stream", fail_stream)
+
+    with pytest.raises(RuntimeError):
+        router.generate("hello", model="m")
+    with pytest.raises(RuntimeError):
+        list(router.generate_stream("hello", model="m"))
+
+    assert backend.outstanding == 0
@@ -0,0 +1,45 @@
+import numpy as np
+
+import virtual_assistant as va
+
+
+def make_task_manager():
+    return va.TaskManager(cache=False, metrics=va.MetricsRegistry(), classifier=False, semantic_cache=va.SemanticCache(np),
+                          translation_memory=False)
+
+
+def test_paraphrased_translation_is_served_from_the_cache(mock_server):
+    tm = make_task_manager()
+    mock_server.reply = "Bonjour, comment allez-vous ?"
+    tm.translation("Good morning, how are you?", "English", "French")
+    mock_server.reply = "wrong"
+    assert tm.translation("Good morning! How are you", "English", "French") == "Bonjour, comment allez-vous ?"
+    assert tm.semantic_cache.hits == 1
+
+
+def test_other_arguments_must_match(mock_server):
+    tm = make_task_manager()
+    mock_server.reply = "Bonjour"
+    tm.translation("Hello", "English", "French")
+    mock_server.reply = "Hallo"
+    assert tm.translation("Hello", "English", "German") == "Hallo"
+
+
+def test_input_that_also_appears_in_the_template_does_not_collide(mock_server):
+    # The input is the target language: the namespace must not depend on where it occurs in the prompt
+    tm = make_task_manager()
+    mock_server.reply = "Français"
+    tm.translation("French", "English", "French")
+    mock_server.reply = "Französisch"
+    assert tm.translation("French", "English", "German") == "Französisch"
+    assert va.SemanticCache.namespace("translation", "m", "translation", {"target_lang": "French"}) != \
+        va.SemanticCache.namespace("translation", "m", "translation", {"target_lang": "German"})
+
+
+def test_qa_is_not_semantically_cached_by_default(mock_server):
+    tm = make_task_manager()
+    mock_server.reply = "Paris"
+    tm.qa("What is the capital of France?")
+    mock_server.reply = "Madrid"
+    assert tm.qa("What is the capital of Spain?") == "Madrid"
+    assert "qa" not in va.SEMANTIC_CACHE_THRESHOLDS
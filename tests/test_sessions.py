@@ -0,0 +1,78 @@
+import gc
+import asyncio
+import warnings
+
+import pytest
+
+from virtual_assistant import STOP_TOKENS, SimpleUI
+
+
+COT_REPLY = "Step 1: add.\n\nStep 2: check.\n**Final Answer:** 42\nSome trailing chatter."
+COT_ANSWER = "Step 1: add.\n\nStep 2: check.\n**Final Answer:** 42"
+
+
+def test_later_turns_send_only_the_new_turn_with_context(mock_server, task_manager):
+    task_manager.chat("qa-session", "Capital of France?", "qa")
+    task_manager.chat("qa-session", "And of Spain?", "qa")
+
+    first, second = mock_server.requests
+    assert "context" not in first and second["context"]
+    assert "And of Spain?" in second["prompt"] and len(second["prompt"]) < len(first["prompt"])
+    assert second["options"]["stop"] == STOP_TOKENS
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_cot_turns_end_after_final_answer_and_keep_context(mock_server, task_manager, stream):
+    mock_server.reply = COT_REPLY
+    session_id = f"cot-{stream}"
+    for question in ("What is 6 * 7?", "And 7 * 6?"):
+        result = task_manager.chat(session_id, question, "cot_reasoning", stream=stream)
+        assert (result if isinstance(result, str) else "".join(result)) == COT_ANSWER
+
+    first, second = mock_server.requests
+    # Blank lines are part of a reasoning chain, so "\n\n" must not be sent as a stop
+    assert first["options"]["stop"] == []
+    assert second["context"]
+
+
+def test_several_target_languages_skip_the_session(mock_server, task_manager):
+    ui = SimpleUI(task_manager)
+    result = ui.route_task("Translation", "Hello", "English", ["French", "Urdu"], session_id="fan-out")
+    assert result == {"French": mock_server.reply, "Urdu": mock_server.reply}
+    assert "['French', 'Urdu']" not in mock_server.requests[0]["prompt"]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_async_chat_keeps_context_without_blocking(mock_server, stream):
+    from async_assistant import AsyncTaskManager
+
+    async def converse():
+        async with AsyncTaskManager(cache=False, classifier=False) as atm:
+            answers = []
+            for question in ("What is 6 * 7?", "And 7 * 6?"):
+                result = atm.chat(f"async-cot-{stream}", question, "cot_reasoning", stream=stream)
+                answers.append("".join([text async for text in result]) if stream else await result)
+            return answers
+
+    mock_server.reply = COT_REPLY
+    assert asyncio.run(converse()) == [COT_ANSWER, COT_ANSWER]
+    first, second = mock_server.requests
+    assert "context" not in first and second["context"]
+    assert "priority" not in first and "prefer" not in first
+
+
+def test_async_expired_deadline_leaves_no_coroutine_behind(mock_server):
+    from async_assistant import AsyncTaskManager
+
+    async def ask():
+        async with AsyncTaskManager(cache=False, classifier=False) as atm:
+            with atm.deadline(0):
+                await atm.qa("Capital of France?")
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(ask())
+        gc.collect()
+    assert not [warning for warning in caught if "never awaited" in str(warning.message)]
+    assert mock_server.requests == []
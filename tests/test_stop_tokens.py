@@ -0,0 +1,60 @@
+import asyncio
+import re
+import time
+
+import pytest
+
+from virtual_assistant import COT_STOP_TOKENS, STOP_TOKENS, StopSequenceFilter, apply_stop_tokens
+
+
+def run_filter(chunks, stop_tokens=STOP_TOKENS):
+    stop_filter = StopSequenceFilter(stop_tokens)
+    return "".join(stop_filter.feed(chunk) for chunk in chunks) + stop_filter.flush()
+
+
+@pytest.mark.parametrize("text", [
+    "  The answer is 42.\nQ: what else?",
+    "First paragraph.\n\nSecond paragraph.",
+    "Plain answer without any stop token.  ",
+    "Ends with a partial stop token\n"
+])
+def test_stop_token_split_across_chunks_matches_unstreamed_output(text):
+    expected = apply_stop_tokens(text)
+    for size in range(1, len(text) + 1):
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert run_filter(chunks) == expected
+
+
+def test_line_pattern_stops_after_matching_line():
+    stop_tokens = [re.compile(r"Final Answer:")]
+    chunks = ["Step 1\nFinal Ans", "wer: 5\nMore rambling", " text"]
+    assert run_filter(chunks, stop_tokens) == "Step 1\nFinal Answer: 5"
+
+
+def test_streamed_and_blocking_answers_match(mock_server, task_manager):
+    mock_server.reply = "Paris is the capital.\n\nQ: And of Spain?"
+    streamed = "".join(task_manager.qa("Capital of France?", stream=True))
+    assert streamed == task_manager.qa("Capital of France?") == "Paris is the capital."
+
+
+def test_blocking_request_with_pattern_stop_is_cancelled_at_the_match(mock_server, task_manager):
+    mock_server.reply = "Step 1: add.\n**Final Answer:** 42\n" + " more" * 200
+    mock_server.tokens_per_second = 200
+    started = time.perf_counter()
+    answer = task_manager.run_model("17 + 25?", task="cot_reasoning_short", stop_tokens=COT_STOP_TOKENS)
+    assert answer == "Step 1: add.\n**Final Answer:** 42"
+    assert mock_server.requests[-1]["stream"] is True
+    # 200 trailing tokens at 200/s would take a second
+    assert time.perf_counter() - started < 0.5
+
+
+def test_async_blocking_request_with_pattern_stop_is_streamed(mock_server):
+    from async_assistant import AsyncTaskManager
+
+    async def run():
+        async with AsyncTaskManager(cache=False, classifier=False) as atm:
+            return await atm.run_model("17 + 25?", task="cot_reasoning_short", stop_tokens=COT_STOP_TOKENS)
+
+    mock_server.reply = "Step 1: add.\n**Final Answer:** 42\nMore rambling."
+    assert asyncio.run(run()) == "Step 1: add.\n**Final Answer:** 42"
+    assert mock_server.requests[-1]["stream"] is True
@@ -0,0 +1,51 @@
+import asyncio
+
+import virtual_assistant as va
+
+
+def make_task_manager():
+    return va.TaskManager(cache=False, metrics=va.MetricsRegistry(), classifier=False, semantic_cache=False,
+                          translation_memory=va.TranslationMemory())
+
+
+def packed_reply(packed_output):
+    def reply(payload):
+        if "numbered" in payload["prompt"]:
+            return packed_output
+        return "single"
+    return reply
+
+
+def test_packed_translations_are_remembered(mock_server):
+    tm = make_task_manager()
+    mock_server.reply = packed_reply("1. Bonjour\n2. Au revoir")
+    assert tm.translate_many(["Hello", "Goodbye"], "English", ["French"]) == {"French": ["Bonjour", "Au revoir"]}
+    assert tm.translation_memory.get("English", "French", "Goodbye") == "Au revoir"
+
+
+def test_echoed_sources_are_not_remembered(mock_server):
+    tm = make_task_manager()
+    mock_server.reply = packed_reply("1. Hello\n2. Goodbye\n\n1. Bonjour\n2. Au revoir")
+    assert tm.translate_many(["Hello", "Goodbye"], "English", ["French"]) == {"French": ["single", "single"]}
+    assert tm.translation_memory.get("English", "French", "Hello") == "single"
+
+
+def test_untranslated_segment_is_retried(mock_server):
+    tm = make_task_manager()
+    mock_server.reply = packed_reply("1. Bonjour\n2. Goodbye")
+    assert tm.translate_many(["Hello", "Goodbye"], "English", ["French"]) == {"French": ["Bonjour", "single"]}
+    assert tm.translation_memory.get("English", "French", "Goodbye") == "single"
+
+
+def test_async_echoed_sources_are_not_remembered(mock_server):
+    from async_assistant import AsyncTaskManager
+
+    async def translate():
+        async with AsyncTaskManager(cache=False, classifier=False) as atm:
+            atm.translation_memory = va.TranslationMemory()
+            return atm, await atm.translate_many(["Hello", "Goodbye"], "English", ["French"])
+
+    mock_server.reply = packed_reply("1. Hello\n2. Goodbye\n\n1. Bonjour\n2. Au revoir")
+    atm, results = asyncio.run(translate())
+    assert results == {"French": ["single", "single"]}
+    assert atm.translation_memory.get("English", "French", "Hello") == "single"
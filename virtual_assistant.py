@@ -1,55 +1,1482 @@
 # Import Libraries
+import time
+
+# Taken before the imports so the startup report includes them
+_PROCESS_STARTED = time.perf_counter()
+
+import os
+import re
+import ast
 import json
+import math
+import uuid
+import codecs
 import base64
-import requests
+import sqlite3
+import hashlib
+import random
+import itertools
+import logging
+import importlib
+import threading
+import contextlib
+import contextvars
 import streamlit as st
-from PIL import Image
 from typing import Tuple
-from jinja2 import Template
+from fractions import Fraction
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LazyModule:
+    """
+    Imports a module on first attribute access. requests and jinja2 are only
+    needed once the first prompt is rendered or sent, so they stay out of the
+    app's startup path.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+requests = LazyModule("requests")
+jinja2 = LazyModule("jinja2")
 
 
 # Ollama Request
-OLLAMA_URL = "http://localhost:11434/api/generate"
-OLLAMA_MODEL = "gemma3:latest"
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434/api/generate")
+OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "gemma3:latest")
+OLLAMA_EMBED_MODEL = os.environ.get("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+
+# Connection pool / resilience settings for the shared Ollama client
+OLLAMA_POOL_SIZE = 10
+OLLAMA_CONNECT_TIMEOUT = 3.05
+OLLAMA_READ_TIMEOUT = 300
+OLLAMA_MAX_RETRIES = 3
+OLLAMA_BACKOFF_BASE = 0.5
+OLLAMA_BACKOFF_MAX = 8.0
+OLLAMA_BREAKER_THRESHOLD = 5
+OLLAMA_BREAKER_RESET = 30.0
+
+# Maximum number of role-play branches generated at once by compare_roles
+COMPARISON_MAX_WORKERS = 4
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class OllamaServerError(Exception):
+    def __init__(self, status_code, text):
+        super().__init__(f"[Error {status_code}]: {text}")
+        self.status_code = status_code
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls until
+    `reset_timeout` seconds have passed, then lets a single trial call through.
+    """
+
+    def __init__(self, failure_threshold=OLLAMA_BREAKER_THRESHOLD, reset_timeout=OLLAMA_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.half_open = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if self.half_open or time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.half_open:
+                return False
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.half_open = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.half_open = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.half_open or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.half_open = False
+
+
+class OllamaClient:
+    """
+    Keep-alive HTTP client for the Ollama API. Connections are pooled on a single
+    requests.Session, connection errors and 5xx responses are retried with jittered
+    exponential backoff, and a circuit breaker stops hammering a dead server.
+    """
+
+    def __init__(self, url=OLLAMA_URL, model=OLLAMA_MODEL, pool_size=OLLAMA_POOL_SIZE,
+                 connect_timeout=OLLAMA_CONNECT_TIMEOUT, read_timeout=OLLAMA_READ_TIMEOUT,
+                 max_retries=OLLAMA_MAX_RETRIES, backoff_base=OLLAMA_BACKOFF_BASE,
+                 backoff_max=OLLAMA_BACKOFF_MAX, breaker=None):
+        self.url = url
+        self.model = model
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _backoff(self, attempt):
+        # "Full jitter": sleep anywhere between 0 and the capped exponential delay
+        time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt))))
+
+    def post(self, payload, url=None, stream=False):
+        url = url or self.url
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"Circuit open for {url}; retry in {self.breaker.reset_timeout:.0f}s")
+
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout):
+                self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    raise
+                self._backoff(attempt)
+                continue
+            except requests.exceptions.RequestException:
+                # Read timeouts are not retried: the generation is already hung and
+                # re-sending it would only double the wasted time.
+                self.breaker.record_failure()
+                raise
+
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    return response
+                response.close()
+                self._backoff(attempt)
+                continue
+
+            self.breaker.record_success()
+            return response
+
+    def generate(self, prompt, **params):
+        payload = {"model": self.model, "prompt": prompt, "stream": False}
+        payload.update(params)
+        response = self.post(payload)
+        if response.status_code != 200:
+            raise OllamaServerError(response.status_code, response.text)
+        return response.json()
+
+    def generate_stream(self, prompt, **params):
+        """
+        Yields Ollama's NDJSON chunks as they arrive. Closing the generator closes
+        the HTTP response, which makes Ollama abort the generation.
+        """
+        payload = {"model": self.model, "prompt": prompt, "stream": True}
+        payload.update(params)
+        response = self.post(payload, stream=True)
+        try:
+            if response.status_code != 200:
+                raise OllamaServerError(response.status_code, response.text)
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise RuntimeError(chunk["error"])
+                yield chunk
+                if chunk.get("done"):
+                    break
+        finally:
+            response.close()
+
+    def embed(self, texts, model=None):
+        """
+        Returns one embedding vector per text from Ollama's `/api/embed`.
+        """
+        url = self.url.rsplit("/api/", 1)[0] + "/api/embed"
+        response = self.post({"model": model or OLLAMA_EMBED_MODEL, "input": list(texts)}, url=url)
+        if response.status_code != 200:
+            raise OllamaServerError(response.status_code, response.text)
+        return response.json()["embeddings"]
+
+    def close(self):
+        self.session.close()
+
+
+# Backend Pool
+# Several Ollama hosts can share the load. Backends come from OLLAMA_BACKENDS
+# (comma-separated base URLs) or from a JSON file:
+#
+#     {"backends": ["http://gpu1:11434", "http://gpu2:11434"],
+#      "task_models": {"few_shot_classification": "qwen3:0.6b", "cot_reasoning": "gemma3:27b"}}
+#
+# Without either, the single host in OLLAMA_URL is used.
+OLLAMA_BACKENDS = os.environ.get("OLLAMA_BACKENDS", "")
+OLLAMA_BACKENDS_FILE = os.environ.get("OLLAMA_BACKENDS_FILE", "ollama_backends.json")
+OLLAMA_HEALTH_INTERVAL = 15.0
+OLLAMA_LATENCY_EWMA = 0.2
+
+# Per-task model overrides; tasks not listed use OLLAMA_MODEL
+TASK_MODELS = json.loads(os.environ.get("OLLAMA_TASK_MODELS", "{}"))
+
+
+def load_backend_config():
+    backends = []
+    task_models = {}
+    if os.path.isfile(OLLAMA_BACKENDS_FILE):
+        with open(OLLAMA_BACKENDS_FILE, encoding="utf-8") as f:
+            config = json.load(f)
+        backends = config.get("backends", [])
+        task_models.update(config.get("task_models", {}))
+    if OLLAMA_BACKENDS:
+        backends = OLLAMA_BACKENDS.split(",")
+    task_models.update(TASK_MODELS)
+
+    urls = []
+    for backend in backends or [OLLAMA_URL]:
+        url = backend["url"] if isinstance(backend, dict) else backend
+        url = url.strip().rstrip("/")
+        if url.endswith("/api/generate"):
+            url = url[:-len("/api/generate")]
+        if url:
+            urls.append(url)
+    return urls, task_models
+
+
+class OllamaBackend(OllamaClient):
+    """
+    One Ollama host in the pool, with the bookkeeping the router needs: requests
+    in flight, a latency moving average, health and which models are available
+    and currently loaded in memory.
+    """
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(url=f"{base_url}/api/generate", **kwargs)
+        self.base_url = base_url
+        self.outstanding = 0
+        self.latency = None
+        self.healthy = True
+        self.available_models = None
+        self.loaded_models = set()
+        self._stats_lock = threading.Lock()
+
+    def begin(self):
+        with self._stats_lock:
+            self.outstanding += 1
+
+    def end(self, model, latency=None, failed=False):
+        with self._stats_lock:
+            self.outstanding -= 1
+            if failed:
+                return
+            self.healthy = True
+            self.loaded_models.add(model)
+            if latency is not None:
+                self.latency = latency if self.latency is None else (
+                    OLLAMA_LATENCY_EWMA * latency + (1 - OLLAMA_LATENCY_EWMA) * self.latency)
+
+    def check_health(self):
+        try:
+            loaded = self.session.get(f"{self.base_url}/api/ps", timeout=self.timeout[0])
+            tags = self.session.get(f"{self.base_url}/api/tags", timeout=self.timeout[0])
+            loaded.raise_for_status()
+            tags.raise_for_status()
+        except requests.exceptions.RequestException:
+            self.healthy = False
+            return False
+
+        self.loaded_models = {model["name"] for model in loaded.json().get("models", [])}
+        # An empty tag list tells us nothing, so don't rule the host out on it
+        self.available_models = {model["name"] for model in tags.json().get("models", [])} or None
+        self.healthy = True
+        return True
+
+    def status(self):
+        return {
+            "url": self.base_url,
+            "healthy": self.healthy,
+            "circuit": self.breaker.state,
+            "outstanding": self.outstanding,
+            "latency": self.latency,
+            "loaded_models": sorted(self.loaded_models)
+        }
 
 
-def send_ollama_request(prompt: str) -> str:
+# Request Scheduling
+# Every generation sent through the router first takes a slot from the
+# RequestScheduler. Waiting requests are started by priority class
+# (TASK_PRIORITIES), and within a class round-robin across users, so one
+# user's bulk job cannot starve everyone else. SCHEDULER_RESERVED_SLOTS are
+# kept free for interactive requests; when an interactive request still has
+# to wait, the most recently started bulk generation is preempted and queued
+# again. Requests past their deadline are cancelled, whether queued or running.
+PRIORITY_CLASSES = ("interactive", "standard", "bulk")
+TASK_PRIORITIES = {
+    "qa": "interactive",
+    "translation": "interactive",
+    "json_formatting": "interactive",
+    "few_shot_classification": "interactive",
+    "cot_reasoning_short": "interactive",
+    "summarization": "standard",
+    "roleplay": "standard",
+    "cot_reasoning": "standard",
+    "summarization_chunk": "bulk"
+}
+# Should match the parallel requests each Ollama host serves (OLLAMA_NUM_PARALLEL)
+SCHEDULER_SLOTS_PER_BACKEND = int(os.environ.get("SCHEDULER_SLOTS_PER_BACKEND", "4"))
+SCHEDULER_RESERVED_SLOTS = 1
+# Seconds a request of each class may take, queueing included (None = no limit)
+SCHEDULER_DEADLINES = {"interactive": None, "standard": None, "bulk": 600.0}
+# After this many preemptions a bulk request runs to completion
+SCHEDULER_MAX_PREEMPTIONS = 3
+
+_scheduling_user = contextvars.ContextVar("scheduling_user", default="anonymous")
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Preempted(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def scheduled_as(user):
+    """
+    Requests made inside the block are queued as `user` for fair scheduling.
+    """
+    token = _scheduling_user.set(str(user))
     try:
-        response = requests.post(OLLAMA_URL, json={
-            "model": OLLAMA_MODEL,
-            "prompt": prompt,
-            "stream": False,
-            "temperature": 0.7,
-            "top_k": 40,
-            "top_p": 0.95,
-            "max_tokens": 1024
-        })
-
-        if response.status_code == 200:
-            result = response.json()
-            generated_text = result.get("response", "").strip()
-
-            for stop_token in ["\nQ:", "\nA:", "\n\n", "\nQ: ", "Q: "]:
-                if stop_token in generated_text:
-                    generated_text = generated_text.split(stop_token)[0].strip()
-
-            return generated_text or "[Empty response]"
-        else:
-            return f"[Error {response.status_code}]: {response.text}"
+        yield
+    finally:
+        _scheduling_user.reset(token)
+
+
+def propagate_context(fn):
+    """
+    Wraps `fn` for a worker thread so each call sees the caller's context
+    variables, e.g. the scheduling user.
+    """
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(fn, *args)
+
+
+class ScheduledRequest:
+    def __init__(self, priority, user, deadline=None, preemptible=False):
+        self.priority = priority if priority in PRIORITY_CLASSES else "standard"
+        self.rank = PRIORITY_CLASSES.index(self.priority)
+        self.user = user
+        self.deadline = deadline
+        self.preemptible = preemptible
+        self.admitted = False
+        self.preempted = False
+        self.expired = False
+        self.started = None
+
+    def check(self):
+        """
+        Called between streamed chunks; raises once the request should stop.
+        """
+        if self.preempted:
+            raise Preempted(f"Preempted by interactive work ({self.priority} request from {self.user})")
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.expired = True
+            raise DeadlineExceeded(f"Deadline exceeded for {self.priority} request from {self.user}")
+
+
+class RequestScheduler:
+    def __init__(self, slots=SCHEDULER_SLOTS_PER_BACKEND, reserved=SCHEDULER_RESERVED_SLOTS):
+        self.slots = max(1, slots)
+        self.reserved = max(0, min(reserved, self.slots - 1))
+        self.running = []
+        self.admitted = dict.fromkeys(PRIORITY_CLASSES, 0)
+        self.preempted = 0
+        self.expired = 0
+        # One queue per priority class, each an ordered map of user -> waiting requests
+        self._queues = [OrderedDict() for _ in PRIORITY_CLASSES]
+        self._cond = threading.Condition()
+
+    def _limit(self, rank):
+        return self.slots if rank == 0 else self.slots - self.reserved
+
+    def _next(self):
+        for rank, queue in enumerate(self._queues):
+            if not queue:
+                continue
+            if len(self.running) >= self._limit(rank):
+                # Lower classes have smaller limits, so none of them can start either
+                return None
+            user, waiting = next(iter(queue.items()))
+            request = waiting.popleft()
+            del queue[user]
+            if waiting:
+                # Round-robin: the user goes to the back of the line
+                queue[user] = waiting
+            return request
+        return None
+
+    def _dispatch(self):
+        while True:
+            request = self._next()
+            if request is None:
+                break
+            request.admitted = True
+            request.started = time.monotonic()
+            self.running.append(request)
+            self.admitted[request.priority] += 1
+        self._cond.notify_all()
+
+    def _remove(self, request):
+        queue = self._queues[request.rank]
+        waiting = queue.get(request.user)
+        if waiting is not None and request in waiting:
+            waiting.remove(request)
+            if not waiting:
+                del queue[request.user]
+
+    def _preempt(self):
+        victims = [r for r in self.running if r.preemptible and not r.preempted and r.rank == len(PRIORITY_CLASSES) - 1]
+        if victims and len(self.running) >= self.slots:
+            victim = max(victims, key=lambda r: r.started)
+            victim.preempted = True
+            self.preempted += 1
+
+    def acquire(self, request):
+        with self._cond:
+            self._queues[request.rank].setdefault(request.user, deque()).append(request)
+            self._dispatch()
+            if not request.admitted and request.rank == 0:
+                self._preempt()
+            while not request.admitted:
+                timeout = None if request.deadline is None else request.deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    self._remove(request)
+                    self.expired += 1
+                    raise DeadlineExceeded(f"Deadline passed while queued ({request.priority} request from {request.user})")
+                self._cond.wait(timeout)
+
+    def release(self, request):
+        with self._cond:
+            if request in self.running:
+                self.running.remove(request)
+            self.expired += request.expired
+            self._dispatch()
+
+    @contextlib.contextmanager
+    def slot(self, request):
+        self.acquire(request)
+        try:
+            yield request
+        finally:
+            self.release(request)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "slots": self.slots,
+                "reserved": self.reserved,
+                "running": {name: sum(r.priority == name for r in self.running) for name in PRIORITY_CLASSES},
+                "queued": {name: sum(len(waiting) for waiting in queue.values()) for name, queue in zip(PRIORITY_CLASSES, self._queues)},
+                "admitted": dict(self.admitted),
+                "preempted": self.preempted,
+                "expired": self.expired
+            }
+
+
+class OllamaRouter:
+    """
+    Spreads requests over a pool of OllamaBackends. Healthy hosts that already
+    have the requested model loaded are preferred (avoiding a cold model load),
+    then the one with the fewest requests in flight, then the fastest. A host
+    that fails is skipped and the request fails over to the next candidate.
+    """
+
+    def __init__(self, base_urls, model=OLLAMA_MODEL, task_models=None, health_interval=OLLAMA_HEALTH_INTERVAL, scheduler=None, **client_kwargs):
+        if len(base_urls) > 1:
+            # With somewhere to fail over to, retrying the same host is less useful
+            client_kwargs.setdefault("max_retries", 1)
+        self.backends = [OllamaBackend(url, model=model, **client_kwargs) for url in base_urls]
+        self.model = model
+        self.task_models = task_models or {}
+        self.scheduler = scheduler or RequestScheduler(slots=len(self.backends) * SCHEDULER_SLOTS_PER_BACKEND)
+        self._stop = threading.Event()
+
+        if len(self.backends) > 1 and health_interval:
+            threading.Thread(target=self._health_loop, args=(health_interval,), daemon=True).start()
+
+    @property
+    def url(self):
+        return self.backends[0].url
+
+    def model_for(self, task):
+        return self.task_models.get(task, self.model)
+
+    def _health_loop(self, interval):
+        while not self._stop.is_set():
+            for backend in self.backends:
+                backend.check_health()
+            self._stop.wait(interval)
+
+    def candidates(self, model, prefer=None):
+        backends = self.backends
+        if any(b.available_models and model in b.available_models for b in backends):
+            # Skip hosts known not to have the model pulled
+            backends = [b for b in backends if b.available_models is None or model in b.available_models]
+
+        def score(backend):
+            return (
+                not backend.healthy,
+                backend.breaker.state == "open",
+                backend.base_url != prefer,
+                model not in backend.loaded_models,
+                backend.outstanding,
+                backend.latency if backend.latency is not None else 0.0
+            )
+
+        return sorted(backends, key=score)
+
+    @staticmethod
+    def _deadline(priority):
+        limit = SCHEDULER_DEADLINES.get(priority)
+        return None if limit is None else time.monotonic() + limit
+
+    def generate(self, prompt, prefer=None, priority="standard", **params):
+        """
+        Bulk requests and requests with a deadline are streamed internally, so
+        they can be stopped between tokens when preempted or out of time; a
+        preempted request is queued again, keeping its original deadline.
+        """
+        model = params.get("model", self.model)
+        deadline = self._deadline(priority)
+        user = _scheduling_user.get()
+        for preemptions in itertools.count():
+            request = ScheduledRequest(priority, user, deadline, preemptible=priority == "bulk" and preemptions < SCHEDULER_MAX_PREEMPTIONS)
+            with self.scheduler.slot(request):
+                if not request.preemptible and request.deadline is None:
+                    return self._failover(model, prefer, lambda backend: backend.generate(prompt, **params))
+                try:
+                    return self._collect(self._stream(prompt, prefer, params), request)
+                except Preempted:
+                    continue
+
+    @staticmethod
+    def _collect(chunks, request):
+        parts = []
+        result = {}
+        try:
+            for chunk in chunks:
+                request.check()
+                parts.append(chunk.get("response", ""))
+                if chunk.get("done"):
+                    result = chunk
+        finally:
+            chunks.close()
+        result["response"] = "".join(parts)
+        return result
+
+    def embed(self, texts, model=None):
+        model = model or OLLAMA_EMBED_MODEL
+        return self._failover(model, None, lambda backend: backend.embed(texts, model))
+
+    def _failover(self, model, prefer, call):
+        error = None
+        for backend in self.candidates(model, prefer):
+            backend.begin()
+            started = time.perf_counter()
+            try:
+                result = call(backend)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, CircuitOpenError) as e:
+                backend.end(model, failed=True)
+                if isinstance(e, requests.exceptions.ConnectionError):
+                    backend.healthy = False
+                error = e
+                continue
+            except OllamaServerError as e:
+                backend.end(model, failed=True)
+                if e.status_code < 500:
+                    raise
+                error = e
+                continue
+            except BaseException:
+                # Anything else (an error chunk, a malformed body) is not retried
+                # elsewhere, but the backend's outstanding count must still drop
+                backend.end(model, failed=True)
+                raise
+            backend.end(model, time.perf_counter() - started)
+            if isinstance(result, dict):
+                result["backend"] = backend.base_url
+            return result
+        raise error
+
+    def generate_stream(self, prompt, prefer=None, priority="standard", **params):
+        """
+        Fails over to the next backend only until the first chunk has been
+        received; after that an error ends the stream. The scheduler slot is
+        held until the generator is exhausted or closed.
+        """
+        request = ScheduledRequest(priority, _scheduling_user.get(), self._deadline(priority))
+        with self.scheduler.slot(request):
+            chunks = self._stream(prompt, prefer, params)
+            try:
+                for chunk in chunks:
+                    request.check()
+                    yield chunk
+            finally:
+                chunks.close()
+
+    def _stream(self, prompt, prefer, params):
+        model = params.get("model", self.model)
+        error = None
+        for backend in self.candidates(model, prefer):
+            backend.begin()
+            started = time.perf_counter()
+            chunks = backend.generate_stream(prompt, **params)
+            try:
+                first = next(chunks, None)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, CircuitOpenError, OllamaServerError) as e:
+                backend.end(model, failed=True)
+                if isinstance(e, OllamaServerError) and e.status_code < 500:
+                    raise
+                if isinstance(e, requests.exceptions.ConnectionError):
+                    backend.healthy = False
+                error = e
+                continue
+            except BaseException:
+                backend.end(model, failed=True)
+                raise
+
+            try:
+                if first is not None:
+                    first["backend"] = backend.base_url
+                    yield first
+                    for chunk in chunks:
+                        chunk["backend"] = backend.base_url
+                        yield chunk
+            except GeneratorExit:
+                # Closed by the consumer (stop token, preemption, deadline) while the
+                # backend was answering normally, so this counts as a success
+                backend.end(model, time.perf_counter() - started)
+                raise
+            except BaseException:
+                backend.end(model, failed=True)
+                raise
+            finally:
+                chunks.close()
+            backend.end(model, time.perf_counter() - started)
+            return
+        raise error
+
+    def status(self):
+        return [backend.status() for backend in self.backends]
+
+    def close(self):
+        self._stop.set()
+        for backend in self.backends:
+            backend.close()
+
+
+@st.cache_resource
+def get_ollama_client() -> OllamaRouter:
+    # Cached for the lifetime of the process so Streamlit reruns reuse the pool
+    base_urls, task_models = load_backend_config()
+    return OllamaRouter(base_urls, task_models=task_models)
+
+
+STOP_TOKENS = ["\nQ:", "\nA:", "\n\n", "\nQ: ", "Q: "]
+
+# Ollama only reads sampling settings and limits from the request's `options`
+SAMPLING_OPTIONS = {
+    "temperature": 0.7,
+    "top_k": 40,
+    "top_p": 0.95
+}
+
+# Token Budgets
+# Completion tokens (`num_predict`) allowed per task. The context window is the
+# same for every task because Ollama reloads the model whenever num_ctx changes;
+# it covers the longest session context plus an answer.
+OLLAMA_NUM_CTX = int(os.environ.get("OLLAMA_NUM_CTX", "8192"))
+DEFAULT_TOKEN_BUDGET = 1024
+MIN_TOKEN_BUDGET = 32
+TASK_TOKEN_BUDGETS = {
+    "qa": 256,
+    "few_shot_classification": 128,
+    "json_formatting": 512,
+    "translation": 1024,
+    "summarization": 512,
+    "summarization_chunk": 384,
+    "roleplay": 512,
+    "cot_reasoning": 1024,
+    "cot_reasoning_short": 256
+}
+
+
+def sampling_params(params):
+    """
+    Request parameters with SAMPLING_OPTIONS filled in under `options`.
+    """
+    return dict(params, options=dict(SAMPLING_OPTIONS, **params.get("options", {})))
+
+
+def budget_params(task, prompt, params):
+    """
+    Adds the task's token budget to `params`, reduced where needed so prompt
+    and answer fit into the context window. Options already in `params` win.
+    """
+    num_predict = TASK_TOKEN_BUDGETS.get(task, DEFAULT_TOKEN_BUDGET)
+    room = OLLAMA_NUM_CTX - estimate_tokens(prompt)
+    budget = {"num_ctx": OLLAMA_NUM_CTX, "num_predict": max(MIN_TOKEN_BUDGET, min(num_predict, room))}
+    return dict(params, options=dict(budget, **params.get("options", {})))
+
+
+class StopSequenceFilter:
+    """
+    Incremental version of the stop-token truncation in send_ollama_request.
+    Text is held back until it can no longer be the start of a stop token, so
+    the streamed output matches the non-streamed one exactly. Compiled regex
+    entries in `stop_tokens` are matched against each completed line and end
+    the output after that line.
+    """
+
+    def __init__(self, stop_tokens=STOP_TOKENS):
+        self.stop_tokens = [token for token in stop_tokens if isinstance(token, str)]
+        self.line_patterns = [token for token in stop_tokens if not isinstance(token, str)]
+        self.holdback = max((len(token) for token in self.stop_tokens), default=1) - 1
+        self.buffer = ""
+        self.line = ""
+        self.line_matched = False
+        self.started = False
+        self.stopped = False
+
+    def _cut_after_line(self, text):
+        lines = text.split("\n")
+        for i, part in enumerate(lines[:-1]):
+            self.line += part
+            if any(pattern.search(self.line) for pattern in self.line_patterns):
+                self.line_matched = True
+                return "\n".join(lines[:i + 1])
+            self.line = ""
+        self.line += lines[-1]
+        return text
+
+    def feed(self, text):
+        if self.stopped:
+            return ""
+
+        if self.line_patterns:
+            text = self._cut_after_line(text)
+        self.buffer += text
+        if not self.started:
+            self.buffer = self.buffer.lstrip()
+            if not self.buffer:
+                return ""
+            self.started = True
+
+        positions = [self.buffer.find(token) for token in self.stop_tokens]
+        positions = [pos for pos in positions if pos != -1]
+        if positions:
+            self.stopped = True
+            out = self.buffer[:min(positions)].rstrip()
+            self.buffer = ""
+            return out
+        if self.line_matched:
+            self.stopped = True
+            out, self.buffer = self.buffer.rstrip(), ""
+            return out
+
+        # Trailing whitespace is held back too, since the final output is stripped
+        safe = min(len(self.buffer) - self.holdback, len(self.buffer.rstrip()))
+        if safe <= 0:
+            return ""
+        out, self.buffer = self.buffer[:safe], self.buffer[safe:]
+        return out
+
+    def flush(self):
+        out = "" if self.stopped else self.buffer.rstrip()
+        self.buffer = ""
+        return out
+
+
+def apply_stop_tokens(generated_text: str, stop_tokens=STOP_TOKENS) -> str:
+    generated_text = generated_text.strip()
+    for stop_token in stop_tokens:
+        if not isinstance(stop_token, str):
+            continue
+        if stop_token in generated_text:
+            generated_text = generated_text.split(stop_token)[0].strip()
+    lines = generated_text.split("\n")
+    for i, line in enumerate(lines[:-1]):
+        if any(stop_token.search(line) for stop_token in stop_tokens if not isinstance(stop_token, str)):
+            return "\n".join(lines[:i + 1]).strip()
+    return generated_text
+
+
+# Timing and token counts reported by Ollama with every completed generation
+OLLAMA_STAT_FIELDS = ("total_duration", "load_duration", "prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration")
+
+
+def error_category(e: Exception) -> str:
+    if isinstance(e, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(e, DeadlineExceeded):
+        return "deadline"
+    if isinstance(e, OllamaServerError):
+        return f"http_{e.status_code}"
+    if isinstance(e, requests.exceptions.Timeout):
+        return "timeout"
+    if isinstance(e, requests.exceptions.ConnectionError):
+        return "connection"
+    return "other"
+
+
+def send_ollama_request(prompt: str, stop_tokens=STOP_TOKENS, stats=None, **params) -> str:
+    """
+    If a `stats` dict is given it is filled with Ollama's OLLAMA_STAT_FIELDS and
+    returned `context`, or with an `error` category when the request fails.
+    Extra `params` are added to the request payload.
+    """
+    stats = {} if stats is None else stats
+    try:
+        result = get_ollama_client().generate(prompt, **sampling_params(params))
+        stats.update((field, result[field]) for field in OLLAMA_STAT_FIELDS + ("context", "backend") if field in result)
+        generated_text = apply_stop_tokens(result.get("response", ""), stop_tokens)
+
+        return generated_text or "[Empty response]"
+    except OllamaServerError as e:
+        stats["error"] = error_category(e)
+        return str(e)
     except Exception as e:
+        stats["error"] = error_category(e)
         return f"[Exception]: {e}"
 
 
+def stream_ollama_request(prompt: str, stop_tokens=STOP_TOKENS, stats=None, drain=False, **params):
+    """
+    Streaming counterpart of send_ollama_request: yields text as Ollama produces it
+    and cancels the generation as soon as a stop token shows up. `stats` also
+    receives `first_token_at` (a time.perf_counter timestamp) and `chunks`, the
+    number of tokens streamed, which stands in for `eval_count` when the
+    generation is cut short. With `drain`, the rest of the generation is read
+    (but not yielded) after a stop token, so the final chunk's `context` arrives.
+    """
+    stats = {} if stats is None else stats
+    stats["chunks"] = 0
+    stop_filter = StopSequenceFilter(stop_tokens)
+    emitted = False
+    try:
+        chunks = get_ollama_client().generate_stream(prompt, **sampling_params(params))
+        try:
+            for chunk in chunks:
+                if chunk.get("done"):
+                    stats.update((field, chunk[field]) for field in OLLAMA_STAT_FIELDS + ("context", "backend") if field in chunk)
+                elif chunk.get("response"):
+                    stats.setdefault("first_token_at", time.perf_counter())
+                    stats["chunks"] += 1
+                text = stop_filter.feed(chunk.get("response", ""))
+                if text:
+                    emitted = True
+                    yield text
+                if stop_filter.stopped and not drain:
+                    break
+        finally:
+            chunks.close()
+
+        text = stop_filter.flush()
+        if text:
+            emitted = True
+            yield text
+        if not emitted:
+            yield "[Empty response]"
+    except OllamaServerError as e:
+        stats["error"] = error_category(e)
+        yield str(e)
+    except Exception as e:
+        stats["error"] = error_category(e)
+        yield f"[Exception]: {e}"
+
+
+
+# Metrics
+# Per-task latency, time-to-first-token, token and error accounting around
+# TaskManager.run_model. Exported in Prometheus text format (api_server.py serves
+# it at /metrics) and, when the "virtual_assistant.metrics" logger is enabled at
+# INFO level, as one JSON log line per request.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+METRICS_WINDOW = 1000
+
+metrics_logger = logging.getLogger("virtual_assistant.metrics")
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    # Nearest-rank method
+    return sorted_values[max(0, math.ceil(q / 100 * len(sorted_values)) - 1)]
+
+
+class MetricsRegistry:
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def _task(self, task):
+        if task not in self._tasks:
+            self._tasks[task] = {
+                "requests": 0,
+                "cache_hits": 0,
+                "errors": {},
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "load_seconds": 0.0,
+                "prompt_eval_seconds": 0.0,
+                "eval_seconds": 0.0,
+                "latency": Histogram(),
+                "ttft": Histogram(),
+                "recent_latency": deque(maxlen=self.window),
+                "recent_ttft": deque(maxlen=self.window),
+                "recent_tps": deque(maxlen=self.window)
+            }
+        return self._tasks[task]
+
+    def record(self, task, latency, ttft=None, cache_hit=False, error=None, **ollama_stats):
+        task = task or "unknown"
+        prompt_tokens = ollama_stats.get("prompt_eval_count", 0)
+        completion_tokens = ollama_stats.get("eval_count", ollama_stats.get("chunks", 0))
+        eval_seconds = ollama_stats.get("eval_duration", 0) / 1e9
+        tokens_per_second = completion_tokens / eval_seconds if eval_seconds else None
+
+        with self._lock:
+            metrics = self._task(task)
+            metrics["requests"] += 1
+            metrics["latency"].observe(latency)
+            metrics["recent_latency"].append(latency)
+            if cache_hit:
+                metrics["cache_hits"] += 1
+            if error:
+                metrics["errors"][error] = metrics["errors"].get(error, 0) + 1
+            if ttft is not None:
+                metrics["ttft"].observe(ttft)
+                metrics["recent_ttft"].append(ttft)
+            metrics["prompt_tokens"] += prompt_tokens
+            metrics["completion_tokens"] += completion_tokens
+            metrics["load_seconds"] += ollama_stats.get("load_duration", 0) / 1e9
+            metrics["prompt_eval_seconds"] += ollama_stats.get("prompt_eval_duration", 0) / 1e9
+            metrics["eval_seconds"] += eval_seconds
+            if tokens_per_second is not None:
+                metrics["recent_tps"].append(tokens_per_second)
+
+        if metrics_logger.isEnabledFor(logging.INFO):
+            metrics_logger.info(json.dumps({
+                "event": "run_model",
+                "task": task,
+                "latency": round(latency, 4),
+                "ttft": None if ttft is None else round(ttft, 4),
+                "cache_hit": cache_hit,
+                "error": error,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "tokens_per_second": None if tokens_per_second is None else round(tokens_per_second, 2),
+                "load_seconds": ollama_stats.get("load_duration", 0) / 1e9
+            }))
+
+    def snapshot(self):
+        """
+        Recent p50/p95/p99 latency and time-to-first-token per task, plus totals.
+        """
+        summary = {}
+        with self._lock:
+            for task, metrics in self._tasks.items():
+                latencies = sorted(metrics["recent_latency"])
+                ttfts = sorted(metrics["recent_ttft"])
+                tps = metrics["recent_tps"]
+                summary[task] = {
+                    "requests": metrics["requests"],
+                    "cache_hits": metrics["cache_hits"],
+                    "errors": sum(metrics["errors"].values()),
+                    "p50": percentile(latencies, 50),
+                    "p95": percentile(latencies, 95),
+                    "p99": percentile(latencies, 99),
+                    "ttft_p50": percentile(ttfts, 50),
+                    "tokens_per_second": sum(tps) / len(tps) if tps else None,
+                    "prompt_tokens": metrics["prompt_tokens"],
+                    "prompt_eval_seconds": metrics["prompt_eval_seconds"],
+                    "completion_tokens": metrics["completion_tokens"]
+                }
+        return summary
+
+    def prometheus_text(self):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+
+        def histogram(name, help_text, key):
+            samples = []
+            for task, metrics in tasks:
+                hist = metrics[key]
+                for bound, count in zip(hist.buckets, hist.counts):
+                    samples.append(f'{name}_bucket{{task="{task}",le="{bound}"}} {count}')
+                samples.append(f'{name}_bucket{{task="{task}",le="+Inf"}} {hist.count}')
+                samples.append(f'{name}_sum{{task="{task}"}} {hist.sum}')
+                samples.append(f'{name}_count{{task="{task}"}} {hist.count}')
+            metric(name, "histogram", help_text, samples)
+
+        def counter(name, help_text, key):
+            metric(name, "counter", help_text, [f'{name}{{task="{task}"}} {metrics[key]}' for task, metrics in tasks])
+
+        with self._lock:
+            tasks = sorted(self._tasks.items())
+            counter("va_requests_total", "Requests handled by run_model.", "requests")
+            counter("va_cache_hits_total", "Requests answered from the response cache.", "cache_hits")
+            metric("va_errors_total", "counter", "Failed requests by error category.", [
+                f'va_errors_total{{task="{task}",category="{category}"}} {count}'
+                for task, metrics in tasks for category, count in sorted(metrics["errors"].items())
+            ])
+            histogram("va_request_latency_seconds", "Wall-clock latency of run_model.", "latency")
+            histogram("va_time_to_first_token_seconds", "Time until the first streamed token.", "ttft")
+            counter("va_prompt_tokens_total", "Prompt tokens evaluated by Ollama.", "prompt_tokens")
+            counter("va_completion_tokens_total", "Tokens generated by Ollama.", "completion_tokens")
+            counter("va_model_load_seconds_total", "Time Ollama spent loading the model.", "load_seconds")
+            counter("va_prompt_eval_seconds_total", "Time Ollama spent evaluating prompts.", "prompt_eval_seconds")
+            counter("va_eval_seconds_total", "Time Ollama spent generating tokens.", "eval_seconds")
+
+        return "\n".join(lines) + "\n"
+
+
+@st.cache_resource
+def get_metrics() -> MetricsRegistry:
+    return MetricsRegistry()
+
+
+
+# Response Cache
+# Deterministic tasks are answered from cache when the same rendered prompt, model
+# and sampling options were seen before. The in-memory tier is an LRU with a TTL;
+# the optional SQLite tier survives Streamlit restarts (set the path to "" to disable).
+RESPONSE_CACHE_SIZE = 512
+RESPONSE_CACHE_TTL = 24 * 60 * 60
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", os.path.join(".cache", "responses.sqlite3"))
+CACHED_TASKS = {"json_formatting", "translation", "few_shot_classification", "summarization_chunk"}
+
+
+def is_error_response(text: str) -> bool:
+    return text.startswith(("[Error", "[Exception]", "[Empty response]"))
+
+
+class ResponseCache:
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+            self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+            self._db.commit()
 
-# Task Manager
-class TaskManager:
+    @staticmethod
+    def make_key(prompt, model, options):
+        raw = json.dumps({"prompt": prompt, "model": model, "options": options}, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, created = entry
+                if now - created < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] < self.ttl:
+                    self._store(key, row[0], row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        created = time.time()
+        with self._lock:
+            self._store(key, value, created)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO responses (key, value, created) VALUES (?, ?, ?)", (key, value, created))
+                self._db.commit()
+
+    def _store(self, key, value, created):
+        self._entries[key] = (value, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries)
+        }
 
-# -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
-# MODULE 1 : Prompt Template Engine
-# -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
-    def qa(self, user_input):
-        template = Template("""
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    return ResponseCache(path=RESPONSE_CACHE_PATH or None)
+
+
+# Translation Memory
+# Segment-level store of finished translations per language pair, used by
+# translate_many so re-translating a file only sends the new segments.
+TRANSLATION_MEMORY_PATH = os.environ.get("TRANSLATION_MEMORY_PATH", os.path.join(".cache", "translation_memory.sqlite3"))
+TRANSLATION_BATCH_SIZE = 8
+TRANSLATION_MAX_WORKERS = 4
+
+
+class TranslationMemory:
+    def __init__(self, path=None):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS segments (source_lang TEXT NOT NULL, target_lang TEXT NOT NULL, "
+                         "source TEXT NOT NULL, target TEXT NOT NULL, PRIMARY KEY (source_lang, target_lang, source))")
+        self._db.commit()
+
+    @staticmethod
+    def normalize(segment):
+        return " ".join(segment.split())
+
+    def get(self, source_lang, target_lang, segment):
+        with self._lock:
+            row = self._db.execute("SELECT target FROM segments WHERE source_lang = ? AND target_lang = ? AND source = ?",
+                                   (source_lang, target_lang, self.normalize(segment))).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def set_many(self, source_lang, target_lang, pairs):
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO segments (source_lang, target_lang, source, target) VALUES (?, ?, ?, ?)",
+                                 [(source_lang, target_lang, self.normalize(source), target) for source, target in pairs])
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM segments")
+            self._db.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0, "entries": entries}
+
+
+@st.cache_resource
+def get_translation_memory() -> TranslationMemory:
+    return TranslationMemory(TRANSLATION_MEMORY_PATH or None)
+
+
+# Semantic Cache
+# Catches paraphrases the exact-match cache misses. The user input is embedded
+# and compared against earlier inputs rendered with the same template, model and
+# arguments; above the task's similarity threshold the stored answer is reused.
+# Vectors live in a memory-mapped matrix (SEMANTIC_CACHE_PATH + ".f32") next to a
+# SQLite table of answers, so a warm cache is usable straight after startup.
+#
+# Q&A is opt-in (SEMANTIC_CACHE_QA=1): factual questions that differ in a single
+# word ("capital of France" / "capital of Spain") embed very close together, and
+# a wrong cached fact is worse than a slower answer.
+SEMANTIC_CACHE_QA = os.environ.get("SEMANTIC_CACHE_QA", "0") == "1"
+SEMANTIC_CACHE_THRESHOLDS = {"translation": 0.95, **({"qa": 0.97} if SEMANTIC_CACHE_QA else {})}
+SEMANTIC_CACHE_SIZE = 4096
+SEMANTIC_CACHE_PATH = os.environ.get("SEMANTIC_CACHE_PATH", os.path.join(".cache", "semantic"))
+# Above this many entries an HNSW index is used for lookups if hnswlib is installed
+SEMANTIC_ANN_MIN_ENTRIES = 1024
+
+
+class SemanticCache:
+    """
+    Fixed-capacity vector cache. Each entry occupies one row ("slot") of the
+    vector matrix; when every slot is taken the least recently used entry is
+    evicted. Lookups are a brute-force dot product over the entries that share
+    the query's namespace, or an HNSW search once the cache is large.
+    """
+
+    def __init__(self, np, max_entries=SEMANTIC_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, path=None, embed=None):
+        self.np = np
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.embed = embed or (lambda texts: get_ollama_client().embed(texts))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.embed_errors = 0
+        self.vectors = None
+        # slot -> [namespace, response, created, last_used]
+        self._entries = {}
+        self._namespaces = {}
+        self._ann = None
+        self._lock = threading.Lock()
+        self._db = None
+
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path + ".sqlite3", check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS entries (slot INTEGER PRIMARY KEY, namespace TEXT NOT NULL, "
+                             "response TEXT NOT NULL, created REAL NOT NULL, used REAL NOT NULL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._db.execute("DELETE FROM entries WHERE created < ? OR slot >= ?", (time.time() - ttl, max_entries))
+            self._db.commit()
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+            if row is not None and os.path.exists(path + ".f32"):
+                self._open_vectors(int(row[0]))
+                for slot, namespace, response, created, used in self._db.execute("SELECT * FROM entries"):
+                    self._entries[slot] = [namespace, response, created, used]
+                    self._namespaces.setdefault(namespace, set()).add(slot)
+
+    @staticmethod
+    def namespace(task, model, template, arguments=None):
+        # The template and every render argument other than the user input must match for a hit
+        raw = json.dumps({"task": task, "model": model, "template": template, "arguments": arguments or {}}, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _open_vectors(self, dim):
+        shape = (self.max_entries, dim)
+        if self.path:
+            exists = os.path.exists(self.path + ".f32")
+            self.vectors = self.np.memmap(self.path + ".f32", dtype=self.np.float32, mode="r+" if exists else "w+", shape=shape)
+            if not exists:
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('dim', ?)", (str(dim),))
+                self._db.commit()
+        else:
+            self.vectors = self.np.zeros(shape, dtype=self.np.float32)
+
+    def embed_query(self, query):
+        """
+        Returns the normalised embedding of `query`, or None if the embedding
+        model is unavailable (the cache is then skipped for this request).
+        """
+        try:
+            vector = self.np.asarray(self.embed([query])[0], dtype=self.np.float32)
+        except Exception:
+            self.embed_errors += 1
+            return None
+        norm = self.np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def get(self, namespace, vector, threshold):
+        now = time.time()
+        with self._lock:
+            slots = self._live_slots(namespace, now)
+            best, similarity = self._nearest(namespace, slots, vector) if slots else (None, 0.0)
+            if best is None or similarity < threshold:
+                self.misses += 1
+                return None
+            entry = self._entries[best]
+            entry[3] = now
+            self.hits += 1
+            if self._db is not None:
+                self._db.execute("UPDATE entries SET used = ? WHERE slot = ?", (now, best))
+                self._db.commit()
+            return entry[1]
+
+    def _live_slots(self, namespace, now):
+        slots = self._namespaces.get(namespace, set())
+        for slot in [slot for slot in slots if now - self._entries[slot][2] >= self.ttl]:
+            self._remove(slot)
+        return list(slots)
+
+    def _nearest(self, namespace, slots, vector):
+        if self.vectors is None or vector.shape[0] != self.vectors.shape[1]:
+            return None, 0.0
+        if self._use_ann():
+            try:
+                labels, distances = self._ann.knn_query(vector, k=1, filter=lambda slot: self._entries.get(slot, [None])[0] == namespace)
+                return int(labels[0][0]), 1.0 - float(distances[0][0])
+            except RuntimeError:
+                # HNSW found no neighbour in this namespace; fall back to the exact search
+                pass
+        similarities = self.vectors[slots] @ vector
+        best = int(similarities.argmax())
+        return slots[best], float(similarities[best])
+
+    def _use_ann(self):
+        if len(self._entries) < SEMANTIC_ANN_MIN_ENTRIES:
+            return False
+        if self._ann is None:
+            try:
+                import hnswlib
+            except ImportError:
+                return False
+            self._ann = hnswlib.Index(space="ip", dim=self.vectors.shape[1])
+            self._ann.init_index(max_elements=self.max_entries)
+            slots = list(self._entries)
+            self._ann.add_items(self.vectors[slots], slots)
+        return True
+
+    def set(self, namespace, vector, response):
+        now = time.time()
+        with self._lock:
+            if self.vectors is None:
+                self._open_vectors(vector.shape[0])
+            if vector.shape[0] != self.vectors.shape[1]:
+                # The embedding model changed; entries of the old width can't be compared
+                return
+            slot = self._free_slot()
+            self.vectors[slot] = vector
+            self._entries[slot] = [namespace, response, now, now]
+            self._namespaces.setdefault(namespace, set()).add(slot)
+            if self._ann is not None:
+                self._ann.add_items(vector[None, :], [slot])
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO entries (slot, namespace, response, created, used) VALUES (?, ?, ?, ?, ?)",
+                                 (slot, namespace, response, now, now))
+                self._db.commit()
+
+    def _free_slot(self):
+        if len(self._entries) < self.max_entries:
+            return next(slot for slot in range(self.max_entries) if slot not in self._entries)
+        slot = min(self._entries, key=lambda slot: self._entries[slot][3])
+        self._remove(slot)
+        self.evictions += 1
+        return slot
+
+    def _remove(self, slot):
+        namespace = self._entries.pop(slot)[0]
+        self._namespaces[namespace].discard(slot)
+        if not self._namespaces[namespace]:
+            del self._namespaces[namespace]
+        if self._db is not None:
+            self._db.execute("DELETE FROM entries WHERE slot = ?", (slot,))
+
+    def flush(self):
+        with self._lock:
+            if isinstance(self.vectors, self.np.memmap):
+                self.vectors.flush()
+            if self._db is not None:
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._namespaces.clear()
+            self._ann = None
+            if self._db is not None:
+                self._db.execute("DELETE FROM entries")
+                self._db.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+            "evictions": self.evictions,
+            "embed_errors": self.embed_errors,
+            "ann": self._ann is not None
+        }
+
+
+@st.cache_resource
+def get_semantic_cache():
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+    return SemanticCache(np, path=SEMANTIC_CACHE_PATH or None)
+
+
+
+# Prompt Templates
+# Each task template is compiled once by the shared jinja2 Environment below and
+# cached. A file named `<template>.j2` in PROMPT_TEMPLATE_DIR overrides the built-in
+# source and is picked up on the next render, without restarting the app.
+#
+# Templates named `<task>.compact` are shorter versions of the task prompts with
+# the same answer format. PROMPT_VARIANT picks the variant for a deployment;
+# tasks without a template of that variant use the full one.
+# benchmarks/prompt_tokens.py reports the size of each template and
+# benchmarks/prompt_ab.py compares the variants' answer quality.
+PROMPT_TEMPLATE_DIR = os.environ.get("PROMPT_TEMPLATE_DIR", "prompts")
+PROMPT_VARIANT = os.environ.get("PROMPT_VARIANT", "full")
+
+PROMPT_TEMPLATES = {
+    "qa": """
 **System Prompt**
 You are a highly intelligent and professionally trained Question Answering (QA) Assistant with expert-level proficiency in answering factual, technical, scientific, cultural, and general knowledge questions across all domains. Your knowledge base is up-to-date and spans disciplines such as science, history, medicine, engineering, philosophy, art, mathematics, and modern technologies. Your primary task is to provide accurate, concise answers to any question posed by the user.
 
@@ -70,12 +1497,9 @@ You are a highly intelligent and professionally trained Question Answering (QA)
 You are expected to respond with precision, brevity, and a commitment to truthfulness.
 
 Q: {{ user_input }}
-A:""")
-        return self.run_model(template.render(user_input=user_input))
+A:""",
 
-
-    def summarization(self, user_input):
-        template = Template("""
+    "summarization": """
 **System Prompt**
 You are a highly trained Summarization Assistant with expert-level experience in compressing complex content into clear, accurate, and concise summaries. You specialize in summarizing articles, documents, essays, transcripts, and factual or narrative content across all domains, including technical, academic, legal, and literary fields.
 
@@ -97,12 +1521,23 @@ You are a highly trained Summarization Assistant with expert-level experience in
 Your job is to distill content into its essential points with precision, brevity, and fidelity to the original message.
 
 Text: {{ user_input }}
-Summary:""")
-        return self.run_model(template.render(user_input=user_input))
+Summary:""",
+
+    "summarization_chunk": """
+**System Prompt**
+You are a Summarization Assistant condensing one part of a longer document. Your summary will be combined with the summaries of the other parts, so it must stand on its own.
 
+**Rules**:
 
-    def translation(self, user_input, source_lang, target_lang):
-        template = Template("""
+* Keep every key fact, name, date, number, and conclusion in this part.
+* Do **not** add opinions, interpretations, or outside knowledge.
+* Do not refer to "this part" or "the text"; state the content directly.
+* Use at most {{ max_sentences }} concise sentences in a single paragraph, without headings or lists.
+
+Text: {{ user_input }}
+Summary:""",
+
+    "translation": """
 **System Prompt**
 You are a professional Translation Assistant with native-level proficiency in both {{ source_lang }} and {{ target_lang }}. You specialize in accurately translating text from {{ source_lang }} to {{ target_lang }} across a wide range of domains including academic, literary, legal, technical, medical, and conversational contexts.
 
@@ -123,12 +1558,33 @@ You are a professional Translation Assistant with native-level proficiency in bo
 Your task is to deliver a clear, accurate, and contextually faithful translation.
 
 {{ source_lang }}: {{ user_input }}
-{{ target_lang }}:""")
-        return self.run_model(template.render(user_input=user_input, source_lang=source_lang, target_lang=target_lang))
+{{ target_lang }}:""",
+
+    "translation_batch": """
+**System Prompt**
+You are a professional Translation Assistant with native-level proficiency in both {{ source_lang }} and {{ target_lang }}. Translate each of the numbered {{ source_lang }} segments below into {{ target_lang }}.
+
+**Rules**:
+
+* Preserve the **original meaning**, **tone**, and **intent** of every segment.
+* Translate each segment on its own; do **not** merge, split, reorder, or skip segments.
+* Do **not** add, omit, or alter any information beyond what is provided.
+* Translate idioms and cultural expressions to their **closest natural equivalents** in {{ target_lang }}.
+
+**Preferred Response Format**:
+
+* Answer with exactly one line per segment, in the same order, formatted as `<number>: <translation>`.
+* Do **not** repeat the original segments or add explanations.
+
+---
+
+{% for text in inputs %}
+{{ loop.index }}. {{ text }}
+{% endfor %}
 
+{{ target_lang }} translations:""",
 
-    def roleplay(self, user_input, role):
-        template = Template("""
+    "roleplay": """
 **System Prompt**
 You are role-playing as a highly experienced and professional {{ role }}. Your responses must reflect the tone, knowledge, and manner expected from someone with years of experience in that role.
 
@@ -146,12 +1602,9 @@ You are role-playing as a highly experienced and professional {{ role }}. Your r
 * Avoid formatting like markdown or emojis unless natural to the role.
 
 User: {{ user_input }}
-{{ role.capitalize() }}:""")
-        return self.run_model(template.render(user_input=user_input, role=role.lower()))
+{{ role.capitalize() }}:""",
 
-
-    def json_formatting(self, user_input):
-        template = Template("""
+    "json_formatting": """
 **System Prompt**
 You are a strict and highly reliable JSON Formatting Assistant. Your task is to convert human-written input into a valid, well-structured JSON object with clear key-value mappings. You do not assume or guess missing structure. You only return JSON if the input can be clearly interpreted without ambiguity.
 
@@ -172,74 +1625,12 @@ You are a strict and highly reliable JSON Formatting Assistant. Your task is to
 
 Your role is to deliver consistent, machine-readable JSON outputs with zero tolerance for structural ambiguity.
 
-Input: {{ user_input }}
-JSON:""")
-        return self.run_model(template.render(user_input=user_input))
-
-# -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
-# MODULE 2 : Few-Shot Prompting for Classification
-# -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
-
-    def few_shot_classification(self, user_input, mode="sentiment", shot_type="few"):
-        # FEW-SHOT EXAMPLES
-        # Sentiment Analysis
-        sentiment_examples = """
-Q: I love how smooth and fast this app runs!
-A: Positive
-
-Q: This is the worst service I've ever used.
-A: Negative
-
-Q: It's okay, not bad but nothing special.
-A: Neutral
-
-Q: Oh wow, this app crashes every time I open it. Amazing job.
-A: Negative
-
-Q: It's not terrible, just disappointingly mediocre.
-A: Neutral
-
-Q: Woah, truly the best customer service experience of my life. Can't wait to see you again—this time in court.
-A: Negative
-
-Q: The food was edible. That's all I can say.
-A: Neutral
-
-Q: Fantastic. Another crash right before my deadline. Love it.
-A: Negative
-"""
-        # Intent Classification
-        intent_examples = """
-Q: Can you tell me the weather in New York?
-A: Intent: Weather Inquiry
-
-Q: I need to book a flight to London.
-A: Intent: Travel Booking
+{% if schema %}The JSON object must conform to this JSON Schema: {{ schema }}
 
-Q: What time is it in Tokyo?
-A: Intent: Time Lookup
-
-Q: Please cancel my gym membership.
-A: Account Management
+{% endif %}Input: {{ user_input }}
+JSON:""",
 
-Q: Turn off the lights in the living room.
-A: Smart Home Control
-"""
-
-        # Prompt
-        examples = ""
-        label_format = ""
-
-        if mode == "sentiment":
-            if shot_type == "few":
-                examples = sentiment_examples
-            label_format = "A:"
-        elif mode == "intent":
-            if shot_type == "few":
-                examples = intent_examples
-            label_format = "A:"
-
-        template = Template("""
+    "few_shot_classification": """
 You are an expert AI assistant specializing in {{ mode }} classification.
 - Your goal is to accurately classify user inputs based on the specified task.
 - Carefully analyze both surface wording and the implied tone, purpose, or context.
@@ -275,23 +1666,43 @@ Q: {{ user_input }}
 Intent:
 {% elif mode == "sentiment" %}
 Sentiment:
-{% endif %}""")
+{% endif %}""",
 
-        prompt = template.render(
-            mode=mode,
-            examples=examples if shot_type == "few" else "",
-            user_input=user_input,
-            label_format=label_format
-        )
+    "few_shot_classification_batch": """
+You are an expert AI assistant specializing in {{ mode }} classification.
+- Your goal is to accurately classify each of the numbered user inputs below.
+- Carefully analyze both surface wording and the implied tone, purpose, or context.
+
+{% if mode == "sentiment" %}
+- For **sentiment analysis**, detect subtle emotional cues such as sarcasm, irony, exaggeration, insincere praise, or passive-aggressive phrasing.
+{% elif mode == "intent" %}
+- For **intent classification**, infer the user's underlying purpose—even when phrased emotionally or indirectly.
+{% endif %}
 
-        return self.run_model(prompt)
+{% if examples %}
+- Use the provided few-shot examples below to guide your interpretation and label formatting.
 
-# -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
-# MODULE 3 : Chain-of-Thought (CoT) Reasoning
-# -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+Here are some examples:
+{{ examples }}
+{% endif %}
+
+- Answer with exactly one line per input, in the same order, formatted as `<number>: <label>`.
+{% if mode == "intent" %}
+- Each label is the most appropriate intent, e.g. `1: Complaint`.
+{% elif mode == "sentiment" %}
+- Each label must be one of `Positive`, `Negative`, or `Neutral`, e.g. `1: Negative`.
+{% endif %}
+- Do not add explanations or any other text.
+
+---
+
+{% for text in inputs %}
+{{ loop.index }}. {{ text }}
+{% endfor %}
 
-    def cot_reasoning(self, user_input):
-        template = Template("""
+Labels:""",
+
+    "cot_reasoning": """
 You are a world-class mathematician and teacher, known for your clarity and precision like Terence Tao or Richard Feynman.
 Your task is to solve and explain the following problem using a highly detailed, step-by-step reasoning with a structured format.
 
@@ -317,63 +1728,1617 @@ Your task is to solve and explain the following problem using a highly detailed,
 
 Let's work this out step by step.
 
-""")
-        return self.run_model(template.render(user_input=user_input))
+""",
+
+    "qa.compact": """
+Answer the question accurately in 1-3 sentences of plain text, without commentary. If you are unsure, reply exactly: Unsure about answer
+
+Q: {{ user_input }}
+A:""",
+
+    "summarization.compact": """
+Summarize the text in one neutral paragraph of 3-5 sentences. Keep key names, dates and facts, and add nothing. If there is too little to summarize, reply exactly: Insufficient content to summarize.
+
+Text: {{ user_input }}
+Summary:""",
+
+    "translation.compact": """
+Translate from {{ source_lang }} to {{ target_lang }}, keeping the meaning and tone and using natural equivalents for idioms. Output only the translation.
+
+{{ source_lang }}: {{ user_input }}
+{{ target_lang }}:""",
+
+    "roleplay.compact": """
+You are an experienced {{ role }}. Stay in character and reply concisely and professionally, starting with **{{ role.capitalize() }}:**.
+
+User: {{ user_input }}
+{{ role.capitalize() }}:""",
+
+    "json_formatting.compact": """
+Convert the input into one valid JSON object, using only keys present in the input. Output only the JSON. If the input cannot be mapped unambiguously, reply exactly: Invalid input for JSON formatting.
+
+{% if schema %}JSON Schema: {{ schema }}
+
+{% endif %}Input: {{ user_input }}
+JSON:""",
+
+    "few_shot_classification.compact": """
+Classify the {{ mode }} of the input{% if mode == "sentiment" %} as Positive, Negative or Neutral, watching for sarcasm{% else %} with a short intent label{% endif %}. Answer with the label only.
+{% if prompt_type == "few-shot" and examples %}
+{{ examples }}
+{% endif %}
+Q: {{ user_input }}
+{% if mode == "intent" %}Intent:{% else %}Sentiment:{% endif %}""",
+
+    "few_shot_classification_batch.compact": """
+Classify the {{ mode }} of each numbered input{% if mode == "sentiment" %} as Positive, Negative or Neutral, watching for sarcasm{% else %} with a short intent label{% endif %}.
+{% if examples %}
+Examples:
+{{ examples }}
+{% endif %}
+Answer with one line per input, in order, as `<number>: <label>`, and nothing else.
+
+{% for text in inputs %}
+{{ loop.index }}. {{ text }}
+{% endfor %}
+
+Labels:""",
+
+    "cot_short": """
+You are a careful mathematician. Solve the following problem.
+
+**Guidelines:**
+- Keep the working short: at most three brief lines, no headings.
+- Then give the result on its own line, exactly like: `**Final Answer:** 33`.
+
+**Problem:** {{ user_input }}
+
+"""
+}
+
+# FEW-SHOT EXAMPLES
+# Sentiment Analysis
+SENTIMENT_EXAMPLES = """
+Q: I love how smooth and fast this app runs!
+A: Positive
+
+Q: This is the worst service I've ever used.
+A: Negative
+
+Q: It's okay, not bad but nothing special.
+A: Neutral
+
+Q: Oh wow, this app crashes every time I open it. Amazing job.
+A: Negative
+
+Q: It's not terrible, just disappointingly mediocre.
+A: Neutral
+
+Q: Woah, truly the best customer service experience of my life. Can't wait to see you again—this time in court.
+A: Negative
+
+Q: The food was edible. That's all I can say.
+A: Neutral
 
+Q: Fantastic. Another crash right before my deadline. Love it.
+A: Negative
+"""
 
-# 1. If a train travels 60 miles per hour for 2.5 hours, how far does it go?
+# Intent Classification
+INTENT_EXAMPLES = """
+Q: Can you tell me the weather in New York?
+A: Intent: Weather Inquiry
 
-# 2. Alice is older than Bob. Bob is older than Charlie. Who is the oldest?
+Q: I need to book a flight to London.
+A: Intent: Travel Booking
 
-# 3. What is the result of (8 * 5) + (12 ÷ 4) - 7?
+Q: What time is it in Tokyo?
+A: Intent: Time Lookup
 
-# 4. You start studying at 3:15 PM and finish at 5:45 PM. How long did you study?
+Q: Please cancel my gym membership.
+A: Account Management
 
-# 5. If apples cost $2 each and bananas cost $1.50, how many bananas can you buy for the price of 3 apples?
+Q: Turn off the lights in the living room.
+A: Smart Home Control
+"""
 
-# 6. Solve the differential equation: dy/dx = 3x², and find y when x = 2, assuming y = 0 when x = 0.
 
-# 7. Given a 2D vector space, if v₁ = [1, 2] and v₂ = [2, -1], and a vector v = [5, 3], express v as a linear combination of v₁ and v₂ (if possible). What does this mean geometrically?
+# Sample CoT problems, from simple arithmetic to linear algebra
+COT_SAMPLE_PROBLEMS = [
+    "If a train travels 60 miles per hour for 2.5 hours, how far does it go?",
+    "Alice is older than Bob. Bob is older than Charlie. Who is the oldest?",
+    "What is the result of (8 * 5) + (12 ÷ 4) - 7?",
+    "You start studying at 3:15 PM and finish at 5:45 PM. How long did you study?",
+    "If apples cost $2 each and bananas cost $1.50, how many bananas can you buy for the price of 3 apples?",
+    "Solve the differential equation: dy/dx = 3x², and find y when x = 2, assuming y = 0 when x = 0.",
+    "Given a 2D vector space, if v₁ = [1, 2] and v₂ = [2, -1], and a vector v = [5, 3], express v as a linear combination of v₁ and v₂ (if possible). What does this mean geometrically?"
+]
+
+
+class PromptTemplateLoader:
+    """
+    Loads `<name>.j2` from the override directory if it exists, otherwise the
+    built-in source from PROMPT_TEMPLATES. Implements jinja2's loader protocol
+    without subclassing BaseLoader, so jinja2 is only imported on first render.
+    """
+
+    def __init__(self, templates, search_path=None):
+        self.templates = templates
+        self.search_path = search_path
+
+    def _override_path(self, name):
+        if not self.search_path:
+            return None
+        return os.path.join(self.search_path, f"{name}.j2")
+
+    def get_source(self, environment, name):
+        path = self._override_path(name)
+        if path and os.path.isfile(path):
+            mtime = os.path.getmtime(path)
+            with open(path, encoding="utf-8") as f:
+                source = f.read()
+
+            def uptodate():
+                try:
+                    return os.path.getmtime(path) == mtime
+                except OSError:
+                    return False
+
+            return source, path, uptodate
+
+        if name not in self.templates:
+            raise jinja2.TemplateNotFound(name)
+
+        # A built-in template goes stale as soon as an override file appears
+        return self.templates[name], None, lambda: not (path and os.path.isfile(path))
+
+    def list_templates(self):
+        return sorted(self.templates)
+
+    def load(self, environment, name, globals=None):
+        return jinja2.BaseLoader.load(self, environment, name, globals)
+
+
+@st.cache_resource
+def get_prompt_env():
+    # Held across Streamlit reruns, which re-execute this module, so compiled
+    # templates are not thrown away on every interaction
+    return jinja2.Environment(
+        loader=PromptTemplateLoader(PROMPT_TEMPLATES, PROMPT_TEMPLATE_DIR),
+        auto_reload=True,
+        cache_size=-1
+    )
+
+
+def get_prompt_template(name: str, variant=None):
+    variant = PROMPT_VARIANT if variant is None else variant
+    if variant != "full" and f"{name}.{variant}" in PROMPT_TEMPLATES:
+        name = f"{name}.{variant}"
+    return get_prompt_env().get_template(name)
+
+
+# Parses one line of a packed classification answer, e.g. "3: Sentiment: Negative"
+NUMBERED_LABEL_RE = re.compile(r"^\s*(\d+)\s*[.):-]\s*(?:(?:Sentiment|Intent)\s*:\s*)?(.+)$", re.IGNORECASE)
+NUMBERED_SEGMENT_RE = re.compile(r"^\s*\[?(\d+)\s*[.):\]-]\s*(.+)$")
+
+
+
+# Conversation Sessions
+# Multi-turn sessions keep the `context` tokens Ollama returns after each turn.
+# The first turn sends the full task prompt; later turns send only the new
+# user turn together with that context, so Ollama does not re-evaluate the
+# long static prefix. `keep_alive` keeps the model (and its KV cache) loaded
+# between turns.
+SESSION_MAX_COUNT = 256
+SESSION_MAX_CONTEXT_TOKENS = 6144
+SESSION_TTL = 60 * 60
+OLLAMA_KEEP_ALIVE = "30m"
+SESSION_TASKS = {"qa", "summarization", "translation", "roleplay", "json_formatting", "cot_reasoning"}
+
+# Stands in for the user input when locating the static part of a task prompt
+_PROMPT_SENTINEL = "\x00"
+
+
+def split_task_prompt(task, variant=None, **kwargs):
+    """
+    Renders a task template and splits it into the static prefix (everything
+    before the line holding the user input) and the per-turn remainder.
+    """
+    template = get_prompt_template(task, variant)
+    marked = template.render(**dict(kwargs, user_input=_PROMPT_SENTINEL))
+    boundary = marked.rfind("\n", 0, marked.index(_PROMPT_SENTINEL)) + 1
+    rendered = template.render(**kwargs)
+    return rendered[:boundary], rendered[boundary:]
+
+
+class ChatSession:
+    def __init__(self, session_id, task, task_kwargs):
+        self.session_id = session_id
+        self.task = task
+        self.task_kwargs = task_kwargs
+        self.context = []
+        self.backend = None
+        self.turns = 0
+        self.last_used = time.time()
+        self.prompt_tokens = 0
+        self.prefix_tokens = 0
+        self.seconds_per_prompt_token = 0.0
+        self.tokens_saved = 0
+        self.seconds_saved = 0.0
+        self.lock = threading.Lock()
+
+    def record_turn(self, prefix_chars, prompt_chars, stats, reused_context):
+        self.turns += 1
+        self.last_used = time.time()
+        prompt_tokens = stats.get("prompt_eval_count", 0)
+        self.prompt_tokens += prompt_tokens
+
+        if reused_context:
+            # Without the session this turn would have re-evaluated the whole prefix
+            self.tokens_saved += self.prefix_tokens
+            self.seconds_saved += self.prefix_tokens * self.seconds_per_prompt_token
+        elif prompt_tokens:
+            # Split the first turn's token count between prefix and input by length
+            self.prefix_tokens = round(prompt_tokens * prefix_chars / max(1, prompt_chars))
+            self.seconds_per_prompt_token = stats.get("prompt_eval_duration", 0) / 1e9 / prompt_tokens
+
+        self.backend = stats.get("backend", self.backend)
+        self.context = stats.get("context") or []
+        if len(self.context) > SESSION_MAX_CONTEXT_TOKENS:
+            # Start over from the full prompt rather than overflow the model context
+            self.context = []
+
+
+class SessionStore:
+    """
+    LRU store of ChatSessions bounded by session count and idle time.
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX_COUNT, ttl=SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.evicted = 0
+        self._sessions = OrderedDict()
+        # Totals of sessions that have ended, so stats() stays cumulative
+        self._retired = {"turns": 0, "prompt_tokens": 0, "prompt_tokens_saved": 0, "prompt_eval_seconds_saved": 0.0}
+        self._lock = threading.Lock()
+
+    def _retire(self, session):
+        self._retired["turns"] += session.turns
+        self._retired["prompt_tokens"] += session.prompt_tokens
+        self._retired["prompt_tokens_saved"] += session.tokens_saved
+        self._retired["prompt_eval_seconds_saved"] += session.seconds_saved
+
+    def get(self, session_id, task, task_kwargs):
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and (now - session.last_used > self.ttl
+                                        or session.task != task or session.task_kwargs != task_kwargs):
+                # Expired, or the user switched task/role/languages: start a new conversation
+                self._retire(session)
+                session = None
+            if session is None:
+                session = ChatSession(session_id, task, task_kwargs)
+            self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+
+            while len(self._sessions) > self.max_sessions:
+                self._retire(self._sessions.popitem(last=False)[1])
+                self.evicted += 1
+            return session
+
+    def reset(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._retire(session)
+
+    def stats(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            totals = dict(self._retired)
+        return {
+            "sessions": len(sessions),
+            "evicted": self.evicted,
+            "turns": totals["turns"] + sum(session.turns for session in sessions),
+            "prompt_tokens": totals["prompt_tokens"] + sum(session.prompt_tokens for session in sessions),
+            "prompt_tokens_saved": totals["prompt_tokens_saved"] + sum(session.tokens_saved for session in sessions),
+            "prompt_eval_seconds_saved": totals["prompt_eval_seconds_saved"] + sum(session.seconds_saved for session in sessions)
+        }
+
+
+@st.cache_resource
+def get_session_store() -> SessionStore:
+    return SessionStore()
+
+
+# Long-document Summarization
+# Text over LONG_DOC_CHUNK_TOKENS is summarized map-reduce style: it is read as a
+# stream and cut into overlapping chunks at sentence boundaries, the chunks are
+# summarized concurrently, and the partial summaries are merged level by level
+# until they fit in one final summarization prompt. Chunk boundaries are chosen
+# by content (a hash of the sentence), so an edit only changes the chunks around
+# it and the rest are answered from the response cache.
+LONG_DOC_CHUNK_TOKENS = 1500
+LONG_DOC_OVERLAP_TOKENS = 120
+LONG_DOC_MAX_WORKERS = 4
+LONG_DOC_READ_SIZE = 64 * 1024
+# A chunk may end at any sentence once it has this fraction of LONG_DOC_CHUNK_TOKENS
+LONG_DOC_MIN_FILL = 0.5
+LONG_DOC_BOUNDARY_MODULUS = 4
+
+APPROX_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+
+def estimate_tokens(text):
+    # Roughly one token per word or punctuation mark; close enough for budgeting
+    return len(APPROX_TOKEN_RE.findall(text))
+
+
+def iter_text(source, read_size=LONG_DOC_READ_SIZE):
+    """
+    Yields a string, or the contents of a text/binary file object, in blocks.
+    """
+    if isinstance(source, str):
+        for start in range(0, len(source), read_size):
+            yield source[start:start + read_size]
+        return
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        block = source.read(read_size)
+        if not block:
+            break
+        yield decoder.decode(block) if isinstance(block, bytes) else block
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def iter_sentences(source, max_chars=LONG_DOC_READ_SIZE):
+    """
+    Yields the whitespace-normalized sentences of `source`. Text without a
+    sentence boundary is cut at the last whitespace within `max_chars` (or at
+    `max_chars` itself), so at most that much is buffered at once.
+    """
+    buffer = ""
+    for block in iter_text(source):
+        parts = SENTENCE_SPLIT_RE.split(buffer + block)
+        # The last part may continue in the next block
+        buffer = parts.pop()
+        while len(buffer) > max_chars:
+            cut = max(buffer.rfind(" ", 0, max_chars + 1), buffer.rfind("\n", 0, max_chars + 1))
+            cut = cut if cut > 0 else max_chars
+            parts.append(buffer[:cut])
+            buffer = buffer[cut:]
+        for sentence in parts:
+            sentence = " ".join(sentence.split())
+            if sentence:
+                yield sentence
+    sentence = " ".join(buffer.split())
+    if sentence:
+        yield sentence
+
+
+def chunk_document(source, chunk_tokens=LONG_DOC_CHUNK_TOKENS, overlap_tokens=LONG_DOC_OVERLAP_TOKENS):
+    """
+    Yields chunks of roughly `chunk_tokens` tokens, each starting with the last
+    `overlap_tokens` worth of sentences of the previous chunk. Only the current
+    chunk is held in memory.
+    """
+    chunk = []
+    size = 0
+    fresh = False
+
+    def overlap(sentences):
+        kept = []
+        kept_size = 0
+        for sentence in reversed(sentences):
+            tokens = estimate_tokens(sentence)
+            if kept_size + tokens > overlap_tokens:
+                break
+            kept.insert(0, sentence)
+            kept_size += tokens
+        return kept, kept_size
+
+    for sentence in iter_sentences(source):
+        tokens = estimate_tokens(sentence)
+        if tokens > chunk_tokens:
+            # A single run-on "sentence" longer than a chunk: split it on words
+            words = sentence.split()
+            step = max(1, len(words) * chunk_tokens // tokens)
+            pieces = [" ".join(words[i:i + step]) for i in range(0, len(words), step)]
+        else:
+            pieces = [sentence]
+
+        for piece in pieces:
+            piece_tokens = estimate_tokens(piece)
+            if fresh and size + piece_tokens > chunk_tokens:
+                yield " ".join(chunk)
+                chunk, size = overlap(chunk)
+                fresh = False
+            chunk.append(piece)
+            size += piece_tokens
+            fresh = True
+            content_boundary = int(hashlib.md5(piece.encode("utf-8")).hexdigest(), 16) % LONG_DOC_BOUNDARY_MODULUS == 0
+            if size >= chunk_tokens * LONG_DOC_MIN_FILL and content_boundary:
+                yield " ".join(chunk)
+                chunk, size = overlap(chunk)
+                fresh = False
+
+    if fresh:
+        yield " ".join(chunk)
+
+
+def group_summaries(summaries, budget=LONG_DOC_CHUNK_TOKENS):
+    """
+    Splits partial summaries into consecutive groups that each fit in `budget`
+    tokens.
+    """
+    groups = [[]]
+    size = 0
+    for summary in summaries:
+        tokens = estimate_tokens(summary)
+        if groups[-1] and size + tokens > budget:
+            groups.append([])
+            size = 0
+        groups[-1].append(summary)
+        size += tokens
+    return groups
+
+
+
+# Local Fast-path Classifier
+# A TF-IDF + logistic regression model per classification mode, trained from the
+# few-shot examples plus any labelled data in FAST_CLASSIFIER_DATA (JSONL lines of
+# {"mode": "sentiment", "text": "...", "label": "Positive"}). Inputs it labels with
+# at least FAST_CLASSIFIER_THRESHOLD probability skip the LLM on few-shot requests.
+# Needs numpy; without it, or without enough examples per label, every input goes
+# to the model as before.
+#
+# Off unless FAST_CLASSIFIER=1: the embedded examples alone are too few (one
+# Positive sentiment, one example per intent) for any mode to reach
+# FAST_CLASSIFIER_MIN_EXAMPLES, so it only helps with a labelled data file.
+FAST_CLASSIFIER_ENABLED = os.environ.get("FAST_CLASSIFIER", "0") == "1"
+FAST_CLASSIFIER_THRESHOLD = float(os.environ.get("FAST_CLASSIFIER_THRESHOLD", "0.85"))
+FAST_CLASSIFIER_DATA = os.environ.get("FAST_CLASSIFIER_DATA", "classifier_data.jsonl")
+# A mode's model is only used once every label has this many examples
+FAST_CLASSIFIER_MIN_EXAMPLES = 3
+FAST_CLASSIFIER_EPOCHS = 300
+FAST_CLASSIFIER_LEARNING_RATE = 0.5
+FAST_CLASSIFIER_L2 = 1e-3
+
+EXAMPLE_PAIR_RE = re.compile(r"^Q:\s*(.+?)\s*\nA:\s*(.+?)\s*$", re.MULTILINE)
+LABEL_PREFIX_RE = re.compile(r"^(?:intent|sentiment)\s*:\s*", re.IGNORECASE)
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+
+def normalize_label(label):
+    """
+    "Intent: Travel Booking", "travel booking" and "**Travel Booking**" all
+    count as the label "Travel Booking".
+    """
+    label = LABEL_PREFIX_RE.sub("", label.strip().strip("*`").strip())
+    return " ".join(word[:1].upper() + word[1:] for word in label.strip(" .").split())
+
+
+def parse_examples(examples):
+    return [(text, normalize_label(label)) for text, label in EXAMPLE_PAIR_RE.findall(examples)]
+
+
+def classifier_features(text):
+    words = TOKEN_RE.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class LinearTextClassifier:
+    """
+    TF-IDF features (word unigrams and bigrams) and a multinomial logistic
+    regression trained by full-batch gradient descent.
+    """
+
+    def __init__(self, texts, labels, np):
+        self.np = np
+        self.labels = sorted(set(labels))
+        documents = [classifier_features(text) for text in texts]
+        self.vocabulary = {term: i for i, term in enumerate(sorted({term for doc in documents for term in doc}))}
+
+        document_frequency = np.zeros(len(self.vocabulary))
+        for doc in documents:
+            for term in set(doc):
+                document_frequency[self.vocabulary[term]] += 1
+        self.idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1
+
+        x = np.vstack([self.vectorize(doc) for doc in documents])
+        y = np.zeros((len(documents), len(self.labels)))
+        y[np.arange(len(documents)), [self.labels.index(label) for label in labels]] = 1
+
+        self.weights = np.zeros((x.shape[1], len(self.labels)))
+        self.bias = np.zeros(len(self.labels))
+        for _ in range(FAST_CLASSIFIER_EPOCHS):
+            error = (self._softmax(x @ self.weights + self.bias) - y) / len(documents)
+            self.weights -= FAST_CLASSIFIER_LEARNING_RATE * (x.T @ error + FAST_CLASSIFIER_L2 * self.weights)
+            self.bias -= FAST_CLASSIFIER_LEARNING_RATE * error.sum(axis=0)
+
+    def vectorize(self, terms):
+        vector = self.np.zeros(len(self.vocabulary))
+        for term in terms:
+            index = self.vocabulary.get(term)
+            if index is not None:
+                vector[index] += 1
+        vector *= self.idf
+        norm = self.np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _softmax(self, scores):
+        scores = scores - scores.max(axis=-1, keepdims=True)
+        exp = self.np.exp(scores)
+        return exp / exp.sum(axis=-1, keepdims=True)
+
+    def predict(self, text):
+        """
+        Returns (label, probability), or (None, 0.0) when the text shares no
+        vocabulary with the training data.
+        """
+        vector = self.vectorize(classifier_features(text))
+        if not vector.any():
+            return None, 0.0
+        probabilities = self._softmax(vector @ self.weights + self.bias)
+        best = int(probabilities.argmax())
+        return self.labels[best], float(probabilities[best])
+
+
+class FastClassifier:
+    """
+    Answers high-confidence sentiment/intent inputs locally and counts how many
+    LLM calls that avoided. Models are trained lazily, once per mode.
+    """
+
+    def __init__(self, threshold=FAST_CLASSIFIER_THRESHOLD, data_path=FAST_CLASSIFIER_DATA):
+        self.threshold = threshold
+        self.data_path = data_path
+        self.answered = 0
+        self.deferred = 0
+        self._examples = {
+            "sentiment": parse_examples(SENTIMENT_EXAMPLES),
+            "intent": parse_examples(INTENT_EXAMPLES)
+        }
+        self._models = {}
+        self._lock = threading.Lock()
+        self._load_data()
+
+    def _load_data(self):
+        if not self.data_path or not os.path.isfile(self.data_path):
+            return
+        with open(self.data_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self._examples.setdefault(record["mode"], []).append((record["text"], normalize_label(record["label"])))
+
+    def add_examples(self, mode, examples):
+        """
+        Adds (text, label) pairs for `mode`; the model is retrained on next use.
+        """
+        with self._lock:
+            self._examples.setdefault(mode, []).extend((text, normalize_label(label)) for text, label in examples)
+            self._models.pop(mode, None)
+
+    def _model(self, mode):
+        with self._lock:
+            if mode not in self._models:
+                examples = self._examples.get(mode, [])
+                model = None
+                try:
+                    import numpy as np
+                except ImportError:
+                    np = None
+                counts = {}
+                for _, label in examples:
+                    counts[label] = counts.get(label, 0) + 1
+                if np is not None and len(counts) > 1 and min(counts.values()) >= FAST_CLASSIFIER_MIN_EXAMPLES:
+                    texts, labels = zip(*examples)
+                    model = LinearTextClassifier(texts, labels, np)
+                self._models[mode] = model
+            return self._models[mode]
+
+    def predict(self, text, mode):
+        """
+        Returns a label when the local model is confident enough, otherwise None
+        (the caller should ask the LLM).
+        """
+        model = self._model(mode)
+        label, probability = model.predict(text) if model is not None else (None, 0.0)
+        with self._lock:
+            if label is not None and probability >= self.threshold:
+                self.answered += 1
+                return label
+            self.deferred += 1
+        return None
+
+    def stats(self):
+        total = self.answered + self.deferred
+        return {
+            "answered": self.answered,
+            "deferred": self.deferred,
+            "threshold": self.threshold,
+            "llm_calls_avoided": self.answered / total if total else 0.0
+        }
+
+
+@st.cache_resource
+def get_fast_classifier() -> FastClassifier:
+    return FastClassifier()
+
+
+# Adaptive Reasoning
+# cot_reasoning first tries a cheap path and only falls back to the long
+# step-by-step prompt when that path is unsure:
+#   1. plain arithmetic is evaluated exactly, without calling the model;
+#   2. otherwise COT_FAST_SAMPLES short answers are sampled, and if they agree
+#      (COT_FAST_AGREEMENT) the first one is returned;
+#   3. otherwise the full CoT prompt runs.
+# Every generation ends as soon as its **Final Answer:** line is complete.
+COT_ADAPTIVE = os.environ.get("COT_ADAPTIVE", "1") != "0"
+COT_FAST_SAMPLES = 3
+COT_FAST_AGREEMENT = 1.0
+COT_FAST_OPTIONS = {"temperature": 0.7, "num_predict": 256}
+# Assumed length of a full CoT answer until one has been observed
+COT_FULL_TOKENS_ESTIMATE = 600
+ARITHMETIC_MAX_LENGTH = 200
+ARITHMETIC_MAX_EXPONENT = 64
+# Largest numerator or denominator an intermediate result may have; keeps
+# nested powers cheap and every result printable (Python refuses int -> str
+# beyond 4300 digits)
+ARITHMETIC_MAX_BITS = 4096
+
+COT_FINAL_ANSWER_RE = re.compile(r"\*\*Final Answer:?\s*(?:\*\*)?:?[ \t]*(?P<answer>[^\n]*\S)")
+COT_STOP_TOKENS = [COT_FINAL_ANSWER_RE]
+# Stop tokens for session turns, where they differ from STOP_TOKENS. Session
+# CoT turns always use the full step-by-step prompt: the local and sampled
+# short paths answer without the conversation's context, so they could not
+# follow up on earlier turns.
+SESSION_STOP_TOKENS = {"cot_reasoning": COT_STOP_TOKENS}
+
+ARITHMETIC_SYMBOLS = str.maketrans({"÷": "/", "×": "*", "·": "*", "−": "-", "–": "-", "^": "**"})
+ARITHMETIC_EXPR_RE = re.compile(r"-?[\d.(][\d.\s+\-*/%()]*[\d)]")
+ARITHMETIC_OPERATOR_RE = re.compile(r"\d\s*(?:[+\-*/%]|\*\*)\s*[\d(.-]|\)\s*(?:[+\-*/%]|\*\*)")
+# 12/25/2024, 2024-12-25, 25.12.2024: three numbers joined by the same unspaced separator read as a date
+ARITHMETIC_DATE_RE = re.compile(r"\b\d{1,4}([/.-])\d{1,2}\1\d{1,4}\b")
+# Punctuation allowed around an expression; any other symbol (units, currency, ...) goes to the model
+ARITHMETIC_OTHER_SYMBOL_RE = re.compile(r"[^\w\s?!.,:=]")
+# Words allowed around an expression for the problem to count as plain arithmetic
+ARITHMETIC_FILLER = {
+    "what", "whats", "is", "the", "result", "value", "of", "calculate", "compute", "evaluate",
+    "solve", "simplify", "find", "how", "much", "please", "equals", "equal", "to"
+}
+ARITHMETIC_OPERATORS = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+    ast.FloorDiv: lambda a, b: a // b,
+    ast.Mod: lambda a, b: a % b
+}
+
+
+def _bits(value):
+    return max(value.numerator.bit_length(), value.denominator.bit_length())
+
+
+def _evaluate_node(node):
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return Fraction(str(node.value))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        value = _evaluate_node(node.operand)
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.BinOp):
+        left, right = _evaluate_node(node.left), _evaluate_node(node.right)
+        if isinstance(node.op, ast.Pow):
+            if right.denominator != 1 or abs(right) > ARITHMETIC_MAX_EXPONENT:
+                raise ValueError("Unsupported exponent")
+            # Estimated before computing: the size of a power grows with the exponent
+            if _bits(left) * abs(int(right)) > ARITHMETIC_MAX_BITS:
+                raise ValueError("Result too large")
+            return left ** int(right)
+        if type(node.op) in ARITHMETIC_OPERATORS:
+            # Any other operation's result is at most as large as both operands together
+            if _bits(left) + _bits(right) > ARITHMETIC_MAX_BITS:
+                raise ValueError("Result too large")
+            return ARITHMETIC_OPERATORS[type(node.op)](left, right)
+    raise ValueError(f"Unsupported expression: {ast.dump(node)}")
+
+
+def evaluate_arithmetic(expression):
+    """
+    Exact value of an arithmetic expression (numbers, + - * / // % ** and
+    parentheses) as a Fraction, or None if it is anything else. Only the
+    syntax tree is walked; nothing is executed.
+    """
+    if len(expression) > ARITHMETIC_MAX_LENGTH:
+        return None
+    try:
+        return _evaluate_node(ast.parse(expression.strip(), mode="eval").body)
+    except (SyntaxError, ValueError, ZeroDivisionError, OverflowError):
+        return None
+
+
+def format_number(value):
+    if value.denominator == 1:
+        return str(value.numerator)
+    # Exact decimals (e.g. 2.5) are shown in full, anything else rounded
+    denominator = value.denominator
+    for factor in (2, 5):
+        while denominator % factor == 0:
+            denominator //= factor
+    if denominator == 1:
+        return f"{float(value):.15g}"
+    return f"{value.numerator}/{value.denominator} ≈ {float(value):.6g}"
+
+
+def solve_arithmetic(problem):
+    """
+    Answers problems that are nothing but an arithmetic expression, e.g.
+    "What is the result of (8 * 5) + (12 ÷ 4) - 7?", in the same shape as a
+    CoT answer. Returns None for anything else, including dates such as
+    "What is 12/25/2024?".
+    """
+    text = problem.translate(ARITHMETIC_SYMBOLS)
+    if ARITHMETIC_DATE_RE.search(text):
+        return None
+    expressions = [match for match in ARITHMETIC_EXPR_RE.finditer(text) if ARITHMETIC_OPERATOR_RE.search(match.group())]
+    if len(expressions) != 1:
+        return None
+    match = expressions[0]
+    rest = (text[:match.start()] + " " + text[match.end():]).lower().replace("'", "").replace("’", "")
+    if ARITHMETIC_OTHER_SYMBOL_RE.search(rest) or any(word not in ARITHMETIC_FILLER for word in re.findall(r"\w+", rest)):
+        return None
+
+    value = evaluate_arithmetic(match.group())
+    if value is None:
+        return None
+    try:
+        # Too large for a float, or too many digits to print: let the model answer
+        answer = format_number(value)
+    except (ValueError, OverflowError):
+        return None
+    expression = " ".join(match.group().split())
+    return f"### Calculation\n`{expression}` = {answer}\n\n**Final Answer:** {answer}"
+
+
+def normalize_answer(answer):
+    answer = answer.strip().strip("*`$").rstrip(".").strip()
+    try:
+        return str(Fraction(answer.replace(",", "")))
+    except (ValueError, ZeroDivisionError):
+        return " ".join(answer.lower().split())
+
+
+def consistent_answer(samples, agreement=COT_FAST_AGREEMENT):
+    """
+    Returns the first sample whose final answer is shared by at least
+    `agreement` of all samples, or None if the samples disagree, failed or
+    lack a **Final Answer:** line.
+    """
+    answers = []
+    for sample in samples:
+        match = None if is_error_response(sample) else COT_FINAL_ANSWER_RE.search(sample)
+        if match is None:
+            return None
+        answers.append(normalize_answer(match.group("answer")))
+
+    answer, count = Counter(answers).most_common(1)[0]
+    if count < agreement * len(samples):
+        return None
+    return samples[answers.index(answer)]
+
+
+class ReasoningTelemetry:
+    """
+    Which path answered each cot_reasoning request and roughly how many
+    completion tokens that saved compared with always running the full prompt.
+    Token counts are estimated from the generated text.
+    """
+
+    PATHS = ("local", "short", "full")
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.counts = dict.fromkeys(self.PATHS, 0)
+        self.tokens_used = 0
+        self.tokens_saved = 0
+        self.recent = deque(maxlen=window)
+        self._full_tokens = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def full_tokens(self):
+        with self._lock:
+            if not self._full_tokens:
+                return COT_FULL_TOKENS_ESTIMATE
+            return sum(self._full_tokens) / len(self._full_tokens)
+
+    def record(self, path, tokens_used, latency, full_tokens=None, telemetry=None):
+        """
+        `tokens_used` counts every generation the request needed, including
+        short samples that were discarded before escalating. `full_tokens` is
+        the length of the full CoT answer when one was generated.
+        """
+        with self._lock:
+            if full_tokens is not None:
+                self._full_tokens.append(full_tokens)
+        saved = round(self.full_tokens() - tokens_used)
+        entry = {"path": path, "tokens": tokens_used, "tokens_saved": saved, "latency": latency}
+        with self._lock:
+            self.counts[path] += 1
+            self.tokens_used += tokens_used
+            self.tokens_saved += saved
+            self.recent.append(entry)
+        if telemetry is not None:
+            telemetry.update(entry)
+        if metrics_logger.isEnabledFor(logging.INFO):
+            metrics_logger.info(json.dumps(dict(entry, event="cot_reasoning", latency=round(latency, 4))))
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, tokens_used=self.tokens_used, tokens_saved=self.tokens_saved)
+
+
+@st.cache_resource
+def get_reasoning_telemetry() -> ReasoningTelemetry:
+    return ReasoningTelemetry()
+
+
+# JSON Schema Validation
+# Schemas are compiled once into a tree of small check functions and cached by
+# their canonical JSON, so validating many documents against the same schema
+# doesn't re-walk the schema each time. Supported keywords: type, enum, const,
+# properties, required, additionalProperties, items, minItems, maxItems,
+# minLength, maxLength, pattern, minimum, maximum, exclusiveMinimum,
+# exclusiveMaximum, anyOf, allOf. Other keywords are ignored.
+SCHEMA_CACHE_SIZE = 128
+NDJSON_MAX_ERRORS = 20
+
+# The schema validate_json_output has always checked
+DEFAULT_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "age": {"type": "integer"},
+        "email": {"type": "string"},
+        "city": {"type": "string"}
+    },
+    "required": ["name", "age", "email", "city"]
+}
+
+JSON_TYPES = {
+    "string": (lambda value: isinstance(value, str), "str"),
+    "integer": (lambda value: isinstance(value, int) and not isinstance(value, bool), "int"),
+    "number": (lambda value: isinstance(value, (int, float)) and not isinstance(value, bool), "float"),
+    "boolean": (lambda value: isinstance(value, bool), "bool"),
+    "object": (lambda value: isinstance(value, dict), "dict"),
+    "array": (lambda value: isinstance(value, list), "list"),
+    "null": (lambda value: value is None, "None")
+}
+
+
+# Expected JSON shape of each keyword's value, checked when a schema is compiled
+SCHEMA_KEYWORD_SHAPES = {
+    "properties": ((dict,), "an object"),
+    "additionalProperties": ((bool, dict), "a boolean or an object"),
+    "required": ((list,), "an array"),
+    "enum": ((list,), "an array"),
+    "anyOf": ((list,), "an array"),
+    "allOf": ((list,), "an array"),
+    "pattern": ((str,), "a string"),
+    "minLength": ((int,), "an integer"),
+    "maxLength": ((int,), "an integer"),
+    "minItems": ((int,), "an integer"),
+    "maxItems": ((int,), "an integer"),
+    "minimum": ((int, float), "a number"),
+    "maximum": ((int, float), "a number"),
+    "exclusiveMinimum": ((int, float), "a number"),
+    "exclusiveMaximum": ((int, float), "a number")
+}
+
+
+class SchemaError(ValueError):
+    pass
+
+
+class SchemaViolation:
+    def __init__(self, kind, path, message):
+        self.kind = kind
+        self.path = path
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+def _join_path(path, key):
+    if isinstance(key, int):
+        return f"{path}[{key}]"
+    return f"{path}.{key}" if path else key
+
+
+class SchemaValidator:
+    """
+    A compiled JSON Schema. `errors(instance)` returns a list of
+    SchemaViolations, empty when the instance is valid.
+    """
+
+    def __init__(self, schema):
+        if not isinstance(schema, dict):
+            raise SchemaError("A schema must be a JSON object")
+        self.schema = schema
+        self._check = self._compile(schema)
+
+    def errors(self, instance):
+        errors = []
+        self._check(instance, "", errors)
+        return errors
+
+    def is_valid(self, instance):
+        return not self.errors(instance)
+
+    @staticmethod
+    def _check_shape(schema):
+        if not isinstance(schema, dict):
+            raise SchemaError(f"A subschema must be a JSON object, got {json.dumps(schema)}")
+        for keyword, (types, description) in SCHEMA_KEYWORD_SHAPES.items():
+            value = schema.get(keyword)
+            # bool is an int in Python, but true/false is not a JSON number
+            if keyword in schema and (not isinstance(value, types) or (isinstance(value, bool) and bool not in types)):
+                raise SchemaError(f"'{keyword}' must be {description}")
+        types = schema.get("type")
+        if types is not None and not isinstance(types, str) and not (isinstance(types, list) and all(isinstance(name, str) for name in types)):
+            raise SchemaError("'type' must be a string or an array of strings")
+        if not all(isinstance(name, str) for name in schema.get("required", [])):
+            raise SchemaError("'required' must be an array of strings")
+
+    def _compile(self, schema):
+        self._check_shape(schema)
+        checks = []
+
+        types = schema.get("type")
+        if types is not None:
+            types = [types] if isinstance(types, str) else list(types)
+            unknown = [name for name in types if name not in JSON_TYPES]
+            if unknown:
+                raise SchemaError(f"Unknown type(s): {', '.join(unknown)}")
+            tests = [JSON_TYPES[name][0] for name in types]
+            expected = "/".join(JSON_TYPES[name][1] for name in types)
+
+            def check_type(value, path, errors):
+                if not any(test(value) for test in tests):
+                    errors.append(SchemaViolation("type", path, f"{path or 'root'} expected {expected}, got {type(value).__name__}"))
+                    return False
+                return True
+            checks.append(check_type)
+
+        if "enum" in schema:
+            options = schema["enum"]
+
+            def check_enum(value, path, errors):
+                if value not in options:
+                    errors.append(SchemaViolation("enum", path, f"{path or 'root'} must be one of {json.dumps(options)}"))
+                return True
+            checks.append(check_enum)
+
+        if "const" in schema:
+            constant = schema["const"]
+
+            def check_const(value, path, errors):
+                if value != constant:
+                    errors.append(SchemaViolation("const", path, f"{path or 'root'} must be {json.dumps(constant)}"))
+                return True
+            checks.append(check_const)
+
+        checks.extend(self._compile_object(schema))
+        checks.extend(self._compile_array(schema))
+        checks.extend(self._compile_scalar(schema))
+
+        for keyword in ("anyOf", "allOf"):
+            if keyword in schema:
+                branches = [self._compile(branch) for branch in schema[keyword]]
+                checks.append(self._combine(keyword, branches))
+
+        def check(value, path, errors):
+            for step in checks:
+                # A wrong type makes the remaining keywords meaningless
+                if step(value, path, errors) is False:
+                    return
+        return check
+
+    def _compile_object(self, schema):
+        properties = {name: self._compile(sub) for name, sub in schema.get("properties", {}).items()}
+        required = list(schema.get("required", []))
+        additional = schema.get("additionalProperties", True)
+        if isinstance(additional, dict):
+            additional = self._compile(additional)
+        if not properties and not required and additional is True:
+            return []
+
+        def check_object(value, path, errors):
+            if not isinstance(value, dict):
+                return True
+            for name in required:
+                if name not in value:
+                    errors.append(SchemaViolation("required", _join_path(path, name), f"missing {_join_path(path, name)}"))
+            for name, item in value.items():
+                if name in properties:
+                    properties[name](item, _join_path(path, name), errors)
+                elif additional is False:
+                    errors.append(SchemaViolation("additional", _join_path(path, name), f"{_join_path(path, name)} is not allowed"))
+                elif additional is not True:
+                    additional(item, _join_path(path, name), errors)
+            return True
+        return [check_object]
+
+    def _compile_array(self, schema):
+        items = self._compile(schema["items"]) if isinstance(schema.get("items"), dict) else None
+        min_items = schema.get("minItems")
+        max_items = schema.get("maxItems")
+        if items is None and min_items is None and max_items is None:
+            return []
+
+        def check_array(value, path, errors):
+            if not isinstance(value, list):
+                return True
+            if min_items is not None and len(value) < min_items:
+                errors.append(SchemaViolation("minItems", path, f"{path or 'root'} needs at least {min_items} items"))
+            if max_items is not None and len(value) > max_items:
+                errors.append(SchemaViolation("maxItems", path, f"{path or 'root'} allows at most {max_items} items"))
+            if items is not None:
+                for index, item in enumerate(value):
+                    items(item, _join_path(path, index), errors)
+            return True
+        return [check_array]
+
+    def _compile_scalar(self, schema):
+        checks = []
+        pattern = re.compile(schema["pattern"]) if "pattern" in schema else None
+        min_length = schema.get("minLength")
+        max_length = schema.get("maxLength")
+        if pattern is not None or min_length is not None or max_length is not None:
+            def check_string(value, path, errors):
+                if not isinstance(value, str):
+                    return True
+                if min_length is not None and len(value) < min_length:
+                    errors.append(SchemaViolation("minLength", path, f"{path or 'root'} must be at least {min_length} characters"))
+                if max_length is not None and len(value) > max_length:
+                    errors.append(SchemaViolation("maxLength", path, f"{path or 'root'} must be at most {max_length} characters"))
+                if pattern is not None and not pattern.search(value):
+                    errors.append(SchemaViolation("pattern", path, f"{path or 'root'} does not match {pattern.pattern}"))
+                return True
+            checks.append(check_string)
+
+        bounds = [(keyword, schema[keyword]) for keyword in ("minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum") if keyword in schema]
+        if bounds:
+            compare = {
+                "minimum": lambda value, bound: value >= bound,
+                "maximum": lambda value, bound: value <= bound,
+                "exclusiveMinimum": lambda value, bound: value > bound,
+                "exclusiveMaximum": lambda value, bound: value < bound
+            }
+
+            def check_number(value, path, errors):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    return True
+                for keyword, bound in bounds:
+                    if not compare[keyword](value, bound):
+                        errors.append(SchemaViolation(keyword, path, f"{path or 'root'} violates {keyword} {bound}"))
+                return True
+            checks.append(check_number)
+        return checks
+
+    @staticmethod
+    def _combine(keyword, branches):
+        def check_branches(value, path, errors):
+            results = []
+            for branch in branches:
+                branch_errors = []
+                branch(value, path, branch_errors)
+                results.append(branch_errors)
+            if keyword == "allOf":
+                for branch_errors in results:
+                    errors.extend(branch_errors)
+            elif all(results):
+                errors.append(SchemaViolation("anyOf", path, f"{path or 'root'} matches none of the anyOf schemas"))
+            return True
+        return check_branches
+
+
+@st.cache_resource(max_entries=SCHEMA_CACHE_SIZE)
+def _compile_schema_json(canonical):
+    return SchemaValidator(json.loads(canonical))
+
+
+def compile_schema(schema):
+    """
+    Returns the cached SchemaValidator for `schema` (a dict or a JSON string).
+    """
+    if isinstance(schema, str):
+        try:
+            schema = json.loads(schema)
+        except json.JSONDecodeError as e:
+            raise SchemaError(f"Schema is not valid JSON: {e}")
+    return _compile_schema_json(json.dumps(schema, sort_keys=True))
+
+
+def format_violations(errors):
+    missing = [error.path for error in errors if error.kind == "required"]
+    if missing:
+        return f"[Schema Mismatch] Missing keys: {', '.join(missing)}"
+    label = "Type errors" if all(error.kind == "type" for error in errors) else "Errors"
+    return f"[Schema Mismatch] {label}: {', '.join(str(error) for error in errors)}"
+
+
+def validate_ndjson(lines, validator, max_errors=NDJSON_MAX_ERRORS):
+    """
+    Validates newline-delimited JSON one record at a time from any iterable of
+    lines (a file object, an upload or a generator). Returns (records, invalid,
+    messages) where messages holds the first `max_errors` problems.
+    """
+    records = invalid = 0
+    messages = []
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        if not line.strip():
+            continue
+        records += 1
+        try:
+            errors = validator.errors(json.loads(line))
+        except json.JSONDecodeError as e:
+            errors = [SchemaViolation("json", "", f"invalid JSON: {e}")]
+        if errors:
+            invalid += 1
+            if len(messages) < max_errors:
+                messages.append(f"line {number}: {'; '.join(str(error) for error in errors)}")
+    return records, invalid, messages
+
+
+
+# Task Manager
+class TaskManager:
+    def __init__(self, cache=None, metrics=None, sessions=None, classifier=None, semantic_cache=None, translation_memory=None, prompt_variant=None):
+        # cache=None uses the shared response cache, cache=False disables caching;
+        # the same applies to the semantic cache, the local fast-path classifier
+        # and the translation memory. prompt_variant=None uses PROMPT_VARIANT.
+        self.cache = get_response_cache() if cache is None else cache or None
+        self.semantic_cache = get_semantic_cache() if semantic_cache is None else semantic_cache or None
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.sessions = sessions if sessions is not None else get_session_store()
+        if classifier is None:
+            classifier = get_fast_classifier() if FAST_CLASSIFIER_ENABLED else False
+        self.classifier = classifier or None
+        self.translation_memory = get_translation_memory() if translation_memory is None else translation_memory or None
+        self.reasoning = get_reasoning_telemetry()
+        self.prompt_variant = PROMPT_VARIANT if prompt_variant is None else prompt_variant
+
+    def _template(self, name):
+        return get_prompt_template(name, self.prompt_variant)
 
 # -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
-# MODULE 4 : JSON Mode and Structured Output Generator
+# MODULE 1 : Prompt Template Engine
 # -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
-    def validate_json_output(self, user_input):
+    def qa(self, user_input, stream=False):
+        template = self._template("qa")
+        return self.run_model(template.render(user_input=user_input), stream=stream, task="qa", query=user_input, query_args={"template": template.name})
+
+
+    def summarization(self, user_input, stream=False):
+        if estimate_tokens(user_input) > LONG_DOC_CHUNK_TOKENS:
+            return self.summarize_document(user_input, stream=stream)
+        template = self._template("summarization")
+        return self.run_model(template.render(user_input=user_input), stream=stream, task="summarization")
+
+
+    def summarize_document(self, source, stream=False, progress=None, max_workers=LONG_DOC_MAX_WORKERS):
         """
-        This function attempts to parse the input as JSON and checks whether
-        it matches a predefined mock schema: { "name": str, "age": int, "email": str, "city": str }
+        Map-reduce summary of a long string or file object (e.g. an upload),
+        read incrementally. `progress(done, total, stage)` is called as chunks
+        ("map") and merge groups ("reduce") complete; `total` grows while the
+        document is still being read.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            prompt = self._document_prompt(pool, source, progress, max_workers)
+        if is_error_response(prompt):
+            return iter([prompt]) if stream else prompt
+        return self.run_model(prompt, stream=stream, task="summarization")
+
+    def _document_prompt(self, pool, source, progress, max_workers):
+        chunks = chunk_document(source)
+        first = next(chunks, "")
+        second = next(chunks, None)
+        if second is None:
+            # Fits in a single chunk: no need for a map step
+            return self._template("summarization").render(user_input=first)
+
+        summaries = []
+        pending = deque()
+        total = 0
+        for chunk in itertools.chain([first, second], chunks):
+            pending.append(pool.submit(propagate_context(self._summarize_chunk), chunk))
+            total += 1
+            # Bound the chunks in flight so only a window of the document is held in memory
+            if len(pending) >= max_workers * 2:
+                summaries.append(pending.popleft().result())
+                if progress:
+                    progress(len(summaries), total, "map")
+        while pending:
+            summaries.append(pending.popleft().result())
+            if progress:
+                progress(len(summaries), total, "map")
+
+        while True:
+            error = next((summary for summary in summaries if is_error_response(summary)), None)
+            if error is not None:
+                return error
+            groups = self._reduce_groups(summaries)
+            if groups is None:
+                break
+            summaries = []
+            for summary in pool.map(propagate_context(lambda group: self._summarize_chunk("\n\n".join(group))), groups):
+                summaries.append(summary)
+                if progress:
+                    progress(len(summaries), len(groups), "reduce")
+
+        return self._template("summarization").render(user_input="\n\n".join(summaries))
+
+    @staticmethod
+    def _reduce_groups(summaries):
         """
+        Returns the next level of merge groups, or None once the summaries fit
+        in the final prompt.
+        """
+        if len(summaries) == 1 or estimate_tokens("\n\n".join(summaries)) <= LONG_DOC_CHUNK_TOKENS:
+            return None
+        groups = group_summaries(summaries)
+        if len(groups) == len(summaries):
+            # Each summary fills a group on its own; merge pairwise so the level still shrinks
+            groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+        return groups
+
+    def _summarize_chunk(self, text):
+        template = self._template("summarization_chunk")
+        return self.run_model(template.render(user_input=text, max_sentences=5), task="summarization_chunk")
+
+
+    def translation(self, user_input, source_lang, target_lang, stream=False):
+        template = self._template("translation")
+        return self.run_model(template.render(user_input=user_input, source_lang=source_lang, target_lang=target_lang), stream=stream, task="translation",
+                              query=user_input, query_args={"template": template.name, "source_lang": source_lang, "target_lang": target_lang})
+
 
-        schema_keys = {
-            "name": str,
-            "age": int,
-            "email": str,
-            "city": str
+    def translate_many(self, segments, source_lang, target_langs, batch_size=TRANSLATION_BATCH_SIZE, max_workers=TRANSLATION_MAX_WORKERS):
+        """
+        Translates every segment into every language in `target_langs` and returns
+        {target_lang: [translation of each segment]}. Segments found in the
+        translation memory are not sent again; the rest are packed `batch_size`
+        to a prompt, and the batches for all languages run concurrently on at
+        most `max_workers` requests.
+        """
+        results, jobs = self._plan_translations(segments, source_lang, target_langs, batch_size)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            translated = pool.map(propagate_context(lambda job: self._translate_packed(job[1], source_lang, job[0])), jobs)
+            for (target_lang, batch), translations in zip(jobs, translated):
+                self._remember_translations(results[target_lang], source_lang, target_lang, batch, translations)
+        return self._collect_translations(results, segments)
+
+    def translate_text(self, user_input, source_lang, target_langs):
+        """
+        Fan-out of a single text: each non-empty line is a segment. Returns
+        {target_lang: translated text}.
+        """
+        segments = [line for line in user_input.splitlines() if line.strip()] or [user_input]
+        results = self.translate_many(segments, source_lang, target_langs)
+        return {target_lang: "\n".join(lines) for target_lang, lines in results.items()}
+
+    def _plan_translations(self, segments, source_lang, target_langs, batch_size):
+        unique = list(dict.fromkeys(TranslationMemory.normalize(segment) for segment in segments))
+        results = {}
+        jobs = []
+        for target_lang in dict.fromkeys(target_langs):
+            results[target_lang] = {}
+            missing = []
+            for segment in unique:
+                known = segment if target_lang == source_lang else None
+                if known is None and self.translation_memory is not None:
+                    known = self.translation_memory.get(source_lang, target_lang, segment)
+                if known is None:
+                    missing.append(segment)
+                else:
+                    results[target_lang][segment] = known
+            jobs.extend((target_lang, batch) for batch in self._batched(missing, batch_size))
+        return results, jobs
+
+    def _remember_translations(self, results, source_lang, target_lang, batch, translations):
+        pairs = list(zip(batch, translations))
+        results.update(pairs)
+        if self.translation_memory is not None:
+            self.translation_memory.set_many(source_lang, target_lang, [(source, target) for source, target in pairs if not is_error_response(target)])
+
+    @staticmethod
+    def _collect_translations(results, segments):
+        return {
+            target_lang: [translated[TranslationMemory.normalize(segment)] for segment in segments]
+            for target_lang, translated in results.items()
         }
 
+    def _translate_packed(self, batch, source_lang, target_lang):
+        if len(batch) == 1:
+            return [self.translation(batch[0], source_lang, target_lang)]
+
+        prompt = self.packed_translation_prompt(batch, source_lang, target_lang)
+        output = self.run_model(prompt, task="translation", stop_tokens=[], priority="standard")
+        return [
+            translation if translation is not None else self.translation(segment, source_lang, target_lang)
+            for segment, translation in zip(batch, self.parse_packed_translations(output, batch))
+        ]
+
+    def packed_translation_prompt(self, batch, source_lang, target_lang):
+        return self._template("translation_batch").render(source_lang=source_lang, target_lang=target_lang, inputs=batch)
+
+    @classmethod
+    def parse_packed_translations(cls, output, batch):
+        """
+        The translation of each segment of `batch` in a packed answer, or None
+        where it has to be retried on its own.
+        """
+        translations = cls.parse_numbered_labels(output, len(batch), NUMBERED_SEGMENT_RE)
+        # More numbered lines than segments means the model echoed the sources, so
+        # no line can be trusted to be a translation; an unchanged segment is
+        # likewise an echo. Neither may reach the translation memory.
+        if sum(1 for line in output.splitlines() if NUMBERED_SEGMENT_RE.match(line)) > len(batch):
+            return [None] * len(batch)
+        return [None if translation == segment else translation for segment, translation in zip(batch, translations)]
+
+
+    def roleplay(self, user_input, role, stream=False):
+        template = self._template("roleplay")
+        return self.run_model(template.render(user_input=user_input, role=role.lower()), stream=stream, task="roleplay")
+
+
+    def json_formatting(self, user_input, stream=False, schema=None):
+        """
+        With a JSON Schema (dict or JSON string), the schema is passed as Ollama's
+        `format` so decoding is constrained to matching JSON. An unusable schema
+        is answered with an "[Invalid Schema]" message.
+        """
+        template = self._template("json_formatting")
+        if schema is None:
+            return self.run_model(template.render(user_input=user_input), stream=stream, task="json_formatting")
+
+        # Caught here rather than by the caller: a TaskManager cached across
+        # Streamlit reruns raises the SchemaError class of the run that created it
+        try:
+            schema = compile_schema(schema).schema
+        except (SchemaError, re.error) as e:
+            message = f"[Invalid Schema] {e}"
+            return iter([message]) if stream else message
+        prompt = template.render(user_input=user_input, schema=json.dumps(schema))
+        # Constrained output is always JSON, so none of the plain-text stop tokens apply
+        return self.run_model(prompt, stream=stream, task="json_formatting", stop_tokens=[], format=schema)
+
+# -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+# MODULE 2 : Few-Shot Prompting for Classification
+# -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def few_shot_classification(self, user_input, mode="sentiment", shot_type="few", stream=False):
+        label = self._fast_label(user_input, mode, shot_type)
+        if label is not None:
+            return iter([label]) if stream else label
+        return self._llm_classification(user_input, mode, shot_type, stream)
+
+    def _fast_label(self, user_input, mode, shot_type="few"):
+        # Trained on the few-shot examples, so zero-shot requests always go to the model
+        if self.classifier is None or shot_type != "few":
+            return None
+        started = time.perf_counter()
+        label = self.classifier.predict(user_input, mode)
+        if label is not None:
+            self.metrics.record("few_shot_classification_local", time.perf_counter() - started)
+        return label
+
+    def _llm_classification(self, user_input, mode, shot_type, stream=False):
+        # Prompt
+        examples = ""
+        label_format = ""
+
+        if mode == "sentiment":
+            if shot_type == "few":
+                examples = SENTIMENT_EXAMPLES
+            label_format = "A:"
+        elif mode == "intent":
+            if shot_type == "few":
+                examples = INTENT_EXAMPLES
+            label_format = "A:"
+
+        template = self._template("few_shot_classification")
+
+        prompt = template.render(
+            mode=mode,
+            examples=examples if shot_type == "few" else "",
+            user_input=user_input,
+            label_format=label_format
+        )
+
+        return self.run_model(prompt, stream=stream, task="few_shot_classification")
+
+
+    def classify_batch(self, texts, mode="sentiment", shot_type="few", batch_size=8, max_workers=4):
+        """
+        Classifies an iterable of texts, yielding labels in input order. Texts are
+        packed `batch_size` at a time into one numbered prompt and the batches run
+        on a bounded thread pool. Items the model fails to label are retried one by one.
+        """
+        batches = self._batched(texts, batch_size)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = deque()
+            for batch in batches:
+                pending.append(pool.submit(propagate_context(self._classify_packed), batch, mode, shot_type))
+                # Keep a bounded number of batches in flight so huge inputs are never fully buffered
+                if len(pending) >= max_workers * 2:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    @staticmethod
+    def _batched(texts, batch_size):
+        batch = []
+        for text in texts:
+            batch.append(text)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _classify_packed(self, batch, mode, shot_type):
+        labels = [self._fast_label(text, mode, shot_type) for text in batch]
+        remaining = [text for text, label in zip(batch, labels) if label is None]
+        if len(remaining) == 1:
+            llm_labels = [self._llm_classification(remaining[0], mode, shot_type)]
+        elif remaining:
+            prompt = self.packed_classification_prompt(remaining, mode, shot_type)
+            output = self.run_model(prompt, task="few_shot_classification", stop_tokens=[], priority="bulk")
+            llm_labels = [
+                label if label is not None else self._llm_classification(text, mode, shot_type)
+                for text, label in zip(remaining, self.parse_numbered_labels(output, len(remaining)))
+            ]
+        else:
+            llm_labels = []
+
+        llm_labels = iter(llm_labels)
+        return [label if label is not None else next(llm_labels) for label in labels]
+
+    def packed_classification_prompt(self, batch, mode, shot_type):
+        examples = ""
+        if shot_type == "few":
+            examples = SENTIMENT_EXAMPLES if mode == "sentiment" else INTENT_EXAMPLES
+
+        return self._template("few_shot_classification_batch").render(
+            mode=mode,
+            examples=examples,
+            inputs=[" ".join(text.split()) for text in batch]
+        )
+
+    @staticmethod
+    def parse_numbered_labels(output, count, pattern=NUMBERED_LABEL_RE):
+        labels = [None] * count
+        for line in output.splitlines():
+            match = pattern.match(line)
+            if not match:
+                continue
+            index = int(match.group(1)) - 1
+            if 0 <= index < count and labels[index] is None:
+                labels[index] = match.group(2).strip().strip("`*")
+        return labels
+
+# -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+# MODULE 3 : Chain-of-Thought (CoT) Reasoning
+# -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def cot_reasoning(self, user_input, stream=False, adaptive=COT_ADAPTIVE, telemetry=None):
+        """
+        With `adaptive`, plain arithmetic is answered locally and other problems
+        get a few short sampled answers first; the full step-by-step prompt only
+        runs when those disagree. If a `telemetry` dict is given it receives the
+        path taken ("local", "short" or "full") and the estimated tokens saved.
+        """
+        started = time.perf_counter()
+        if not adaptive:
+            return self._full_cot(user_input, stream, started, 0, telemetry)
+
+        answer = solve_arithmetic(user_input)
+        if answer is not None:
+            self.metrics.record("cot_reasoning_local", time.perf_counter() - started)
+            self.reasoning.record("local", 0, time.perf_counter() - started, telemetry=telemetry)
+            return iter([answer]) if stream else answer
+
+        samples = self._short_cot_samples(user_input)
+        spent = sum(estimate_tokens(sample) for sample in samples)
+        answer = consistent_answer(samples)
+        if answer is None:
+            return self._full_cot(user_input, stream, started, spent, telemetry)
+
+        self.reasoning.record("short", spent, time.perf_counter() - started, telemetry=telemetry)
+        return iter([answer]) if stream else answer
+
+    def _short_cot_samples(self, user_input):
+        prompt = self._template("cot_short").render(user_input=user_input)
+
+        def sample(seed):
+            return self.run_model(prompt, task="cot_reasoning_short", stop_tokens=COT_STOP_TOKENS, options=dict(COT_FAST_OPTIONS, seed=seed))
+
+        with ThreadPoolExecutor(max_workers=COT_FAST_SAMPLES) as pool:
+            return list(pool.map(propagate_context(sample), range(COT_FAST_SAMPLES)))
+
+    def _full_cot(self, user_input, stream, started, spent, telemetry):
+        # Always streamed internally, so generation is cancelled as soon as the
+        # final answer line is complete even when the caller wants one string
+        template = self._template("cot_reasoning")
+        chunks = self._record_full_cot(self.run_model(template.render(user_input=user_input), stream=True, task="cot_reasoning", stop_tokens=COT_STOP_TOKENS), started, spent, telemetry)
+        return chunks if stream else "".join(chunks)
+
+    def _record_full_cot(self, chunks, started, spent, telemetry):
+        parts = []
+        for text in chunks:
+            parts.append(text)
+            yield text
+        tokens = estimate_tokens("".join(parts))
+        if not is_error_response("".join(parts)):
+            self.reasoning.record("full", spent + tokens, time.perf_counter() - started, full_tokens=tokens, telemetry=telemetry)
+
+# -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+# MODULE 4 : JSON Mode and Structured Output Generator
+# -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def validate_json_output(self, user_input, schema=None):
+        """
+        This function attempts to parse the input as JSON and checks whether
+        it matches `schema` (a JSON Schema dict or string), by default the mock
+        schema: { "name": str, "age": int, "email": str, "city": str }
+        """
+        try:
+            validator = compile_schema(DEFAULT_JSON_SCHEMA if schema is None else schema)
+        except (SchemaError, re.error) as e:
+            return f"[Invalid Schema] {e}"
+
         try:
             parsed = json.loads(user_input)
         except json.JSONDecodeError as e:
             return f"[Invalid JSON] Error: {e}"
 
-        if not isinstance(parsed, dict):
+        if schema is None and not isinstance(parsed, dict):
             return "[Invalid JSON] Root element must be a JSON object."
 
-        missing_keys = [key for key in schema_keys if key not in parsed]
-        type_mismatches = [
-            f"{key} expected {schema_keys[key].__name__}, got {type(parsed[key]).__name__}"
-            for key in schema_keys
-            if key in parsed and not isinstance(parsed[key], schema_keys[key])
-        ]
+        errors = validator.errors(parsed)
+        if errors:
+            return format_violations(errors)
 
-        if missing_keys:
-            return f"[Schema Mismatch] Missing keys: {', '.join(missing_keys)}"
+        return "[Valid JSON] JSON structure is correct and matches schema."
 
-        if type_mismatches:
-            return f"[Schema Mismatch] Type errors: {', '.join(type_mismatches)}"
+    def validate_json_lines(self, lines, schema=None):
+        """
+        Validates an NDJSON file object or iterable of lines record by record,
+        without reading it all into memory.
+        """
+        try:
+            validator = compile_schema(DEFAULT_JSON_SCHEMA if schema is None else schema)
+        except (SchemaError, re.error) as e:
+            return f"[Invalid Schema] {e}"
 
-        return "[Valid JSON] JSON structure is correct and matches schema."
+        records, invalid, messages = validate_ndjson(lines, validator)
+        if not invalid:
+            return f"[Valid JSON] All {records} records match the schema."
+        shown = "\n".join(messages)
+        more = f"\n... and {invalid - len(messages)} more" if invalid > len(messages) else ""
+        return f"[Schema Mismatch] {invalid} of {records} records are invalid:\n{shown}{more}"
 
 # -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 # MODULE 5 : Role-Playing Prompting Engine
@@ -383,72 +3348,283 @@ Let's work this out step by step.
         """
         Compares the model's response with and without the role-playing prompt.
         Returns both outputs and highlights differences in tone, accuracy, and relevance.
+        `role` may be a single role or a list of roles; all branches run concurrently.
         """
-        # Roleplay response
-        role_response = self.roleplay(user_input, role)
+        roles = [role] if isinstance(role, str) else list(role)
+        results, wall_time = self.compare_roles(user_input, roles)
+        return self.format_comparison(results, wall_time)
 
-        # Normal QA response (no role)
-        normal_response = self.qa(user_input)
+    @staticmethod
+    def format_comparison(results, wall_time):
+        sections = []
+        for result in results:
+            if result["role"] is None:
+                heading = "Without Role Prompt (General QA)"
+            else:
+                heading = f"With Role Prompt ({result['role']})"
+            sections.append(f"--- **{heading}** ({result['latency']:.2f}s) ---\n{result['response']}")
+
+        comparison_output = "\n\n".join(sections)
+        comparison_output += f"\n\n_Total wall time: {wall_time:.2f}s for {len(results)} concurrent requests_"
 
-        comparison_output = f"""
---- **Without Role Prompt (General QA)** ---
-{normal_response}
+        return comparison_output.strip()
 
---- **With Role Prompt ({role})** ---
-{role_response}
-"""
 
-        return comparison_output.strip()
+    def compare_roles(self, user_input, roles, max_workers=COMPARISON_MAX_WORKERS, include_normal=True):
+        """
+        Runs the plain QA prompt and one role-play prompt per role in parallel
+        (at most `max_workers` at a time). Returns the per-branch results in
+        order, as dicts with `role` (None for plain QA), `response` and `latency`
+        in seconds, together with the total wall-clock time.
+        """
+        branches = ([None] if include_normal else []) + list(roles)
+
+        def run_branch(role):
+            started = time.perf_counter()
+            response = self.qa(user_input) if role is None else self.roleplay(user_input, role)
+            return {"role": role, "response": response, "latency": time.perf_counter() - started}
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(branches)))) as pool:
+            results = list(pool.map(propagate_context(run_branch), branches))
+
+        return results, time.perf_counter() - started
 
 # -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 # RUN EVERYTHING
 # -------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
  
-    def run_model(self, full_prompt):
-        return send_ollama_request(full_prompt)
+    def run_model(self, full_prompt, stream=False, task=None, stop_tokens=STOP_TOKENS, query=None, query_args=None, priority=None, **params):
+        """
+        Returns the completion as a string, or a generator of text chunks when
+        `stream` is True. Tasks listed in CACHED_TASKS are served from the
+        response cache when possible, and tasks in SEMANTIC_CACHE_THRESHOLDS from
+        the semantic cache when `query` (the user input) is given; `query_args`
+        holds the template name and its other arguments, which must match
+        exactly for a semantic hit. Extra `params`
+        (e.g. `format`) are added to the Ollama request, on top of the task's
+        token budget. `priority` overrides the scheduling class from
+        TASK_PRIORITIES. Every call is recorded in self.metrics.
+        """
+        started = time.perf_counter()
+        params = budget_params(task, full_prompt, params)
+        key = self._cache_key(full_prompt, task, params)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.metrics.record(task, time.perf_counter() - started, cache_hit=True)
+                return iter([cached]) if stream else cached
+
+        semantic = self._semantic_lookup(task, query, query_args)
+        if semantic is not None and semantic[2] is not None:
+            self.metrics.record(task, time.perf_counter() - started, cache_hit=True)
+            return iter([semantic[2]]) if stream else semantic[2]
+
+        params["priority"] = priority or TASK_PRIORITIES.get(task, "standard")
+        if stream:
+            return self._run_stream(full_prompt, task, key, stop_tokens, started, semantic, params)
+
+        stats = {}
+        model = get_ollama_client().model_for(task)
+        if any(not isinstance(token, str) for token in stop_tokens):
+            # Pattern stop tokens (e.g. the CoT **Final Answer:** line) are matched
+            # here, not by Ollama: stream so the generation is cancelled at the match
+            # instead of running on to num_predict
+            result = "".join(stream_ollama_request(full_prompt, stop_tokens, stats, model=model, **params)).strip() or "[Empty response]"
+            stats.pop("first_token_at", None)
+        else:
+            result = send_ollama_request(full_prompt, stop_tokens, stats, model=model, **params)
+        self.metrics.record(task, time.perf_counter() - started, **stats)
+        self._store(key, semantic, result)
+        return result
+
+    def _semantic_lookup(self, task, query, query_args):
+        """
+        Returns (namespace, vector, cached answer or None), or None when the
+        semantic cache doesn't apply to this request.
+        """
+        if self.semantic_cache is None or not query or task not in SEMANTIC_CACHE_THRESHOLDS:
+            return None
+        vector = self.semantic_cache.embed_query(query)
+        if vector is None:
+            return None
+        namespace = SemanticCache.namespace(task, get_ollama_client().model_for(task), (query_args or {}).get("template"), query_args)
+        return namespace, vector, self.semantic_cache.get(namespace, vector, SEMANTIC_CACHE_THRESHOLDS[task])
+
+    def _store(self, key, semantic, result):
+        if is_error_response(result):
+            return
+        if key is not None:
+            self.cache.set(key, result)
+        if semantic is not None:
+            self.semantic_cache.set(semantic[0], semantic[1], result)
+
+    def chat(self, session_id, user_input, task="qa", stream=False, **task_kwargs):
+        """
+        Multi-turn version of the task methods: `task` is one of SESSION_TASKS and
+        `task_kwargs` its extra arguments (e.g. role="Doctor"). Turns with the same
+        session_id continue one conversation and reuse Ollama's context.
+        """
+        if task not in SESSION_TASKS:
+            return f"[Invalid Task] {task} does not support sessions"
+
+        session, prefix, turn = self._start_chat(session_id, user_input, task, task_kwargs)
+        if stream:
+            return self._run_chat_stream(session, prefix, turn)
+
+        with session.lock:
+            started = time.perf_counter()
+            stats = {}
+            result = send_ollama_request(self._chat_prompt(session, prefix, turn), SESSION_STOP_TOKENS.get(session.task, STOP_TOKENS),
+                                         stats, **self._chat_params(session))
+            self._finish_chat_turn(session, prefix, turn, stats, started)
+        return result
+
+    def _start_chat(self, session_id, user_input, task, task_kwargs):
+        """
+        Returns the session and the turn's prompt split into the static prefix
+        and the part that changes with every turn.
+        """
+        session = self.sessions.get(session_id, task, task_kwargs)
+        render_kwargs = dict(task_kwargs, user_input=user_input)
+        if task == "roleplay":
+            render_kwargs["role"] = render_kwargs["role"].lower()
+        prefix, turn = split_task_prompt(task, self.prompt_variant, **render_kwargs)
+        return session, prefix, turn
+
+    def _run_chat_stream(self, session, prefix, turn):
+        stop_tokens = SESSION_STOP_TOKENS.get(session.task, STOP_TOKENS)
+        with session.lock:
+            started = time.perf_counter()
+            stats = {}
+            # Ollama can only stop on plain strings; after a local pattern match the
+            # stream is drained so the context for the next turn still arrives
+            drain = any(not isinstance(token, str) for token in stop_tokens)
+            yield from stream_ollama_request(self._chat_prompt(session, prefix, turn), stop_tokens, stats, drain=drain, **self._chat_params(session))
+            self._finish_chat_turn(session, prefix, turn, stats, started)
+
+    @staticmethod
+    def _chat_prompt(session, prefix, turn):
+        return "\n\n" + turn if session.context else prefix + turn
+
+    def _model_for(self, task):
+        return get_ollama_client().model_for(task)
+
+    def _chat_params(self, session):
+        # Ollama applies the stop tokens itself, so the final chunk (which carries
+        # the context) still arrives when a stop sequence ends the answer
+        stop_tokens = SESSION_STOP_TOKENS.get(session.task, STOP_TOKENS)
+        params = {
+            "model": self._model_for(session.task),
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "options": {"stop": [token for token in stop_tokens if isinstance(token, str)], "num_ctx": OLLAMA_NUM_CTX, "num_predict": TASK_TOKEN_BUDGETS.get(session.task, DEFAULT_TOKEN_BUDGET)},
+            # A conversation turn is always someone waiting for an answer
+            "priority": "interactive",
+            # Stay on the backend that holds this conversation's model in memory
+            "prefer": session.backend
+        }
+        if session.context:
+            params["context"] = session.context
+        return params
+
+    def _finish_chat_turn(self, session, prefix, turn, stats, started):
+        session.record_turn(len(prefix), len(prefix) + len(turn), stats, reused_context=bool(session.context))
+        stats.pop("context", None)
+        stats.pop("backend", None)
+        first_token_at = stats.pop("first_token_at", None)
+        ttft = None if first_token_at is None else first_token_at - started
+        self.metrics.record(f"{session.task}_chat", time.perf_counter() - started, ttft=ttft, **stats)
+
+    def _cache_key(self, full_prompt, task, params=None):
+        if task not in CACHED_TASKS or self.cache is None:
+            return None
+        return ResponseCache.make_key(full_prompt, get_ollama_client().model_for(task), sampling_params(params or {}))
+
+    def _run_stream(self, full_prompt, task, key, stop_tokens, started, semantic=None, params=None):
+        stats = {}
+        parts = []
+        try:
+            for text in stream_ollama_request(full_prompt, stop_tokens, stats, model=get_ollama_client().model_for(task), **(params or {})):
+                parts.append(text)
+                yield text
+        finally:
+            first_token_at = stats.pop("first_token_at", None)
+            ttft = None if first_token_at is None else first_token_at - started
+            self.metrics.record(task, time.perf_counter() - started, ttft=ttft, **stats)
+
+        self._store(key, semantic, "".join(parts))
 
 
 
 # Streamlit UI
+ICON_PATH = "ai_bot.png"
+
+GRADIENT_CSS = """
+    <style>
+        body { background-color: #0d1117; }
+        .stApp {
+            background: radial-gradient(circle at top left, #0d1117, #000000);
+            color: white;
+        }
+        h1 { color: #58a6ff; }
+        .stTextInput, .stSelectbox, .stButton button {
+            background-color: #161b22;
+            color: white;
+        }
+    </style>
+"""
+
+
+@st.cache_data
+def load_icon_html(path):
+    """
+    Reads and base64-encodes the icon once per process instead of on every rerun.
+    Returns None if the file is missing.
+    """
+    try:
+        with open(path, "rb") as img_file:
+            encoded = base64.b64encode(img_file.read()).decode()
+    except OSError:
+        return None
+    return f"""
+        <div style='text-align: center;'>
+            <img src='data:image/png;base64,{encoded}' width='120'/>
+        </div>
+    """
+
+
 class SimpleUI:
+    # Tasks whose output is rendered token-by-token when streaming is enabled
+    STREAMING_TASKS = ["Q&A", "Summarization", "Translation", "Role-Play", "Classification", "CoT Reasoning"]
+
+    # Tasks that can run as a multi-turn conversation, mapped to their TaskManager method
+    SESSION_TASKS = {
+        "Q&A": "qa",
+        "Summarization": "summarization",
+        "Translation": "translation",
+        "Role-Play": "roleplay",
+        "JSON Formatter": "json_formatting",
+        "CoT Reasoning": "cot_reasoning"
+    }
+
     def __init__(self, task_manager):
         self.tm = task_manager
         
 
     @staticmethod
     def set_gradient_background():
-        st.markdown("""
-            <style>
-                body { background-color: #0d1117; }
-                .stApp {
-                    background: radial-gradient(circle at top left, #0d1117, #000000);
-                    color: white;
-                }
-                h1 { color: #58a6ff; }
-                .stTextInput, .stSelectbox, .stButton button {
-                    background-color: #161b22;
-                    color: white;
-                }
-            </style>
-        """, unsafe_allow_html=True)
+        # Streamlit rebuilds the page on every rerun, so the style block has to be
+        # re-emitted; it is a constant string, so this costs nothing to build
+        st.markdown(GRADIENT_CSS, unsafe_allow_html=True)
 
 
     @staticmethod
     def display_icon():
-        try:
-            with open("ai_bot.png", "rb") as img_file:
-                img_bytes = img_file.read()
-                encoded = base64.b64encode(img_bytes).decode()
-                st.markdown(
-                    f"""
-                    <div style='text-align: center;'>
-                        <img src='data:image/png;base64,{encoded}' width='120'/>
-                    </div>
-                    """,
-                    unsafe_allow_html=True
-                )
-        except Exception as e:
+        icon_html = load_icon_html(ICON_PATH)
+        if icon_html is None:
             st.warning("Image 'ai_bot.png' not found.")
+        else:
+            st.markdown(icon_html, unsafe_allow_html=True)
 
 
     def display(self):
@@ -467,13 +3643,20 @@ class SimpleUI:
         role = None
         source_lang = target_lang = None
         classification_mode = shot_type = None
+        document = None
+        schema = None
+        adaptive = None
 
         if task == "Translation":
             col1, col2 = st.columns(2)
             with col1:
                 source_lang = st.selectbox("Translate From", ["English", "Urdu", "Chinese", "French", "Arabic", "Japanese", "Persian","Korean"])
             with col2:
-                target_lang = st.selectbox("Translate To", ["Urdu", "English", "Chinese", "French", "Arabic", "Japanese", "Persian", "Korean"])
+                if st.toggle("Translate into several languages", value=False):
+                    target_lang = st.multiselect("Translate To", ["Urdu", "English", "Chinese", "French", "Arabic", "Japanese", "Persian", "Korean"], default=["Urdu"])
+                    document = st.file_uploader("Or upload segments to translate (one per line)", type=["txt"])
+                else:
+                    target_lang = st.selectbox("Translate To", ["Urdu", "English", "Chinese", "French", "Arabic", "Japanese", "Persian", "Korean"])
         
         elif task == "Role-Play":
                 role = st.selectbox("Choose a Role", ["Doctor", "Lawyer", "Teacher", "Therapist", "Chef", "Tech Support", "Artist", "Historian", "Engineer", "Scientist", "Customer Support Agent"])
@@ -485,43 +3668,183 @@ class SimpleUI:
             with col2:
                 shot_type = st.selectbox("Prompt Type", ["Zero-Shot", "Few-Shot"])
 
-        elif task == "Role-Play Comparison":
-            role = st.selectbox("Choose a Role for Comparison", ["Doctor", "Lawyer", "Teacher", "Therapist", "Chef", "Tech Support", "Artist", "Historian", "Engineer", "Scientist", "Customer Support Agent"])
+        elif task == "Summarization":
+            document = st.file_uploader("Or upload a long document", type=["txt", "md", "csv", "log"])
 
+        elif task in ("JSON Formatter", "JSON Validator"):
+            schema = st.text_area("JSON Schema (optional)", placeholder='{"type": "object", "properties": {...}, "required": [...]}').strip() or None
+            if task == "JSON Validator":
+                document = st.file_uploader("Or upload an NDJSON file to validate line by line", type=["jsonl", "ndjson"])
 
-        if st.button("Run Task") and user_input.strip():
+        elif task == "CoT Reasoning":
+            adaptive = st.toggle("Adaptive reasoning", value=COT_ADAPTIVE, help="Answer simple problems locally or with a short answer first, and only run the full step-by-step prompt when unsure")
+
+        elif task == "Role-Play Comparison":
+            role = st.multiselect("Choose Roles for Comparison", ["Doctor", "Lawyer", "Teacher", "Therapist", "Chef", "Tech Support", "Artist", "Historian", "Engineer", "Scientist", "Customer Support Agent"], default=["Doctor"])
+
+
+        fan_out = task == "Translation" and isinstance(target_lang, list)
+        stream = task in self.STREAMING_TASKS and not fan_out and st.toggle("Stream tokens", value=True)
+
+        session_id = None
+        if task in self.SESSION_TASKS and not fan_out and st.toggle("Remember conversation", value=False):
+            if "session_id" not in st.session_state:
+                st.session_state["session_id"] = uuid.uuid4().hex
+            if st.button("New conversation"):
+                self.tm.sessions.reset(st.session_state["session_id"])
+                st.session_state["session_id"] = uuid.uuid4().hex
+            session_id = st.session_state["session_id"]
+
+        if self.tm.cache is not None:
+            cache_stats = self.tm.cache.stats()
+            st.sidebar.caption(f"Response cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate)")
+
+        if self.tm.semantic_cache is not None:
+            semantic_stats = self.tm.semantic_cache.stats()
+            st.sidebar.caption(f"Semantic cache: {semantic_stats['hits']} hits / {semantic_stats['misses']} misses, {semantic_stats['entries']} entries")
+
+        if self.tm.classifier is not None:
+            classifier_stats = self.tm.classifier.stats()
+            st.sidebar.caption(
+                f"Local classifier: {classifier_stats['answered']} answered / {classifier_stats['deferred']} sent to the model "
+                f"({classifier_stats['llm_calls_avoided']:.0%} of LLM calls avoided)"
+            )
+
+        if self.tm.translation_memory is not None:
+            memory_stats = self.tm.translation_memory.stats()
+            st.sidebar.caption(f"Translation memory: {memory_stats['entries']} segments, {memory_stats['hits']} reused / {memory_stats['misses']} translated")
+
+        if st.sidebar.checkbox("Show performance metrics", key="show_metrics"):
+            self.display_metrics()
+            reasoning_stats = self.tm.reasoning.stats()
+            st.sidebar.caption(
+                f"Reasoning: {reasoning_stats['local']} local / {reasoning_stats['short']} short / {reasoning_stats['full']} full, "
+                f"~{reasoning_stats['tokens_saved']} tokens saved"
+            )
+            session_stats = self.tm.sessions.stats()
+            st.sidebar.caption(
+                f"Sessions: {session_stats['sessions']} active, {session_stats['turns']} turns, "
+                f"~{session_stats['prompt_tokens_saved']} prompt tokens / {session_stats['prompt_eval_seconds_saved']:.1f}s prompt eval saved"
+            )
+            scheduler_stats = get_ollama_client().scheduler.stats()
+            st.sidebar.caption(
+                "Scheduler: " + ", ".join(f"{name} {scheduler_stats['running'][name]} running / {scheduler_stats['queued'][name]} queued" for name in PRIORITY_CLASSES)
+                + f"; {scheduler_stats['preempted']} preempted, {scheduler_stats['expired']} past deadline"
+            )
+            for backend in get_ollama_client().status():
+                state = "up" if backend["healthy"] and backend["circuit"] != "open" else "down"
+                st.sidebar.caption(f"{backend['url']}: {state}, {backend['outstanding']} in flight, models loaded: {', '.join(backend['loaded_models']) or 'none'}")
+
+        run = st.button("Run Task")
+        if run and document is not None and task == "JSON Validator":
+            with st.spinner("Validating..."):
+                st.markdown("**Result:**")
+                st.text(self.tm.validate_json_lines(document, schema))
+
+        elif run and fan_out and target_lang and document is not None:
+            segments = [line for line in codecs.decode(document.getvalue(), "utf-8", "replace").splitlines() if line.strip()]
+            with st.spinner(f"Translating {len(segments)} segments into {len(target_lang)} languages..."):
+                results = self.tm.translate_many(segments, source_lang, target_lang)
+            rows = [dict({source_lang: segment}, **{lang: results[lang][i] for lang in target_lang}) for i, segment in enumerate(segments)]
+            st.markdown("**Result:**")
+            st.dataframe(rows)
+            st.download_button("Download translations (JSON Lines)", "\n".join(json.dumps(row, ensure_ascii=False) for row in rows),
+                               file_name="translations.jsonl", mime="application/x-ndjson")
+
+        elif run and document is not None and task == "Summarization":
+            bar = st.progress(0.0, text="Reading document...")
+
+            def report(done, total, stage):
+                label = "Summarizing sections" if stage == "map" else "Merging section summaries"
+                bar.progress(done / total, text=f"{label}: {done}/{total}")
+
+            result = self.tm.summarize_document(document, stream=stream, progress=report)
+            bar.progress(1.0, text="Writing the final summary...")
+            st.markdown("**Result:**")
+            if isinstance(result, str):
+                st.write(result)
+            else:
+                st.write_stream(result)
+
+        elif run and user_input.strip():
             with st.spinner("Generating..."):
-                result = self.route_task(task, user_input, source_lang, target_lang, role, classification_mode, shot_type)
+                telemetry = {}
+                result = self.route_task(task, user_input, source_lang, target_lang, role, classification_mode, shot_type, stream=stream, session_id=session_id, schema=schema, adaptive=adaptive, telemetry=telemetry)
 
                 st.markdown("**Result:**")
-                if task == "JSON Formatter":
+                if isinstance(result, dict):
+                    for lang, text in result.items():
+                        st.markdown(f"*{lang}*")
+                        st.write(text)
+                elif task == "JSON Formatter":
                     try:
                         st.json(json.loads(result))
                     except:
                         st.code(result, language="json")
-                else:
+                elif isinstance(result, str):
                     st.write(result)
+                else:
+                    st.write_stream(result)
+
+                if telemetry:
+                    path = {"local": "exact local evaluation", "short": "short answers (samples agreed)", "full": "full step-by-step reasoning"}[telemetry["path"]]
+                    st.caption(f"Answered by {path} in {telemetry['latency']:.1f}s · ~{telemetry['tokens']} tokens generated, ~{telemetry['tokens_saved']} saved vs. full reasoning")
+
+
+    def display_metrics(self):
+        rows = []
+        for task, summary in sorted(self.tm.metrics.snapshot().items()):
+            rows.append({
+                "Task": task,
+                "Requests": summary["requests"],
+                "Cache hits": summary["cache_hits"],
+                "Errors": summary["errors"],
+                "p50 (s)": None if summary["p50"] is None else round(summary["p50"], 2),
+                "p95 (s)": None if summary["p95"] is None else round(summary["p95"], 2),
+                "p99 (s)": None if summary["p99"] is None else round(summary["p99"], 2),
+                "TTFT p50 (s)": None if summary["ttft_p50"] is None else round(summary["ttft_p50"], 2),
+                "Tokens/s": None if summary["tokens_per_second"] is None else round(summary["tokens_per_second"], 1)
+            })
+        st.sidebar.markdown("**Recent performance**")
+        if rows:
+            st.sidebar.table(rows)
+        else:
+            st.sidebar.caption("No requests yet.")
+
 
+    def route_task(self, task, user_input, source_lang=None, target_lang=None, role=None, classification_mode=None, shot_type=None, stream=False, session_id=None, schema=None, adaptive=None, telemetry=None):
+        stream = stream and task in self.STREAMING_TASKS
+        # Several target languages fan out into a {language: translation} dict,
+        # which is neither streamed nor part of a conversation
+        if task == "Translation" and isinstance(target_lang, (list, tuple)):
+            return self.tm.translate_text(user_input, source_lang, target_lang)
+
+        if session_id and task in self.SESSION_TASKS and schema is None:
+            task_kwargs = {}
+            if task == "Translation":
+                task_kwargs = {"source_lang": source_lang, "target_lang": target_lang}
+            elif task == "Role-Play":
+                task_kwargs = {"role": role}
+            return self.tm.chat(session_id, user_input, self.SESSION_TASKS[task], stream=stream, **task_kwargs)
 
-    def route_task(self, task, user_input, source_lang=None, target_lang=None, role=None, classification_mode=None, shot_type=None):
         if task == "Q&A":
-            return self.tm.qa(user_input)
+            return self.tm.qa(user_input, stream=stream)
         elif task == "Summarization":
-            return self.tm.summarization(user_input)
+            return self.tm.summarization(user_input, stream=stream)
         elif task == "Translation":
-            return self.tm.translation(user_input, source_lang, target_lang)
+            return self.tm.translation(user_input, source_lang, target_lang, stream=stream)
         elif task == "Role-Play":
-            return self.tm.roleplay(user_input, role)
+            return self.tm.roleplay(user_input, role, stream=stream)
         elif task == "JSON Formatter":
-            return self.tm.json_formatting(user_input)
+            return self.tm.json_formatting(user_input, schema=schema)
         elif task == "Classification":
             mode = "sentiment" if classification_mode.lower() == "sentiment" else "intent"
             shot = "few" if shot_type.lower() == "few-shot" else "zero"
-            return self.tm.few_shot_classification(user_input, mode, shot)
+            return self.tm.few_shot_classification(user_input, mode, shot, stream=stream)
         elif task == "CoT Reasoning":
-            return self.tm.cot_reasoning(user_input)
+            return self.tm.cot_reasoning(user_input, stream=stream, adaptive=COT_ADAPTIVE if adaptive is None else adaptive, telemetry=telemetry)
         elif task == "JSON Validator":
-            return self.tm.validate_json_output(user_input)
+            return self.tm.validate_json_output(user_input, schema)
         elif task == "Role-Play Comparison":
             return self.tm.compare_roleplay_vs_normal(user_input, role)
         else:
@@ -529,11 +3852,56 @@ class SimpleUI:
 
 
 
+# Startup Timing
+# Streamlit re-executes this script on every interaction. The first run in a
+# process is the cold start (imports included); later runs should only pay for
+# rendering, since every expensive resource is held by st.cache_resource.
+timing_logger = logging.getLogger("virtual_assistant.timing")
+
+
+@st.cache_resource
+def get_run_timings():
+    return {"startup": None, "reruns": deque(maxlen=METRICS_WINDOW)}
+
+
+def record_run_timing(run_started, finished):
+    timings = get_run_timings()
+    if timings["startup"] is None:
+        timings["startup"] = {"module_load": run_started - _PROCESS_STARTED, "total": finished - _PROCESS_STARTED}
+        kind, seconds = "startup", timings["startup"]["total"]
+    else:
+        kind, seconds = "rerun", finished - run_started
+        timings["reruns"].append(seconds)
+    timing_logger.info(json.dumps({"event": kind, "seconds": round(seconds, 4)}))
+    return timings
+
+
+def timing_report(timings):
+    startup = timings["startup"]
+    report = f"Cold start: {startup['total'] * 1000:.0f} ms ({startup['module_load'] * 1000:.0f} ms module load)"
+    if timings["reruns"]:
+        reruns = sorted(timings["reruns"])
+        report += f" · rerun p50 {percentile(reruns, 50) * 1000:.0f} ms, last {timings['reruns'][-1] * 1000:.0f} ms"
+    return report
+
+
+@st.cache_resource
+def get_task_manager() -> TaskManager:
+    return TaskManager()
+
+
 # Main Function
 def main():
-    tm = TaskManager()
-    ui = SimpleUI(tm)
-    ui.display()
+    run_started = time.perf_counter()
+    if "user_id" not in st.session_state:
+        st.session_state["user_id"] = uuid.uuid4().hex
+    # Each browser session is one user for fair queuing
+    with scheduled_as(st.session_state["user_id"]):
+        ui = SimpleUI(get_task_manager())
+        ui.display()
+    timings = record_run_timing(run_started, time.perf_counter())
+    if st.session_state.get("show_metrics"):
+        st.sidebar.caption(timing_report(timings))
 
 
 if __name__ == "__main__":